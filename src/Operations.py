@@ -2,6 +2,7 @@
 
 from models.sat_model import SATModel
 from data.augmentation import Flickr30k
+from data.vocabulary import Vocabulary
 from models.Configuration import Configuration
 import os.path
 import torch
@@ -47,29 +48,8 @@ class Operations:
     # idk how to put this in python so I'm leaving this in a comment
     # Either way, "captions is list" returns false so I can't do that
     def caption_numbers_to_words(self, captions, validate=False):
-        captions = captions.tolist()
-        captions_words = []
-        if validate == False:
-            for k in range(len(captions)):
-                p = captions[k]
-                temp = [
-                    f"{self.data.inv_word_map[t]} "
-                    for t in p
-                    if t not in [self.data.word_map["<pad>"], self.data.word_map["<start>"]]
-                ]
-                captions_words.append("".join(temp))
-
-        else:
-            for k in range(len(captions)):
-                p = captions[k]
-                temp = [
-                    f"{self.validate_data.inv_word_map[t]} "
-                    for t in p
-                    if t not in [self.validate_data.word_map["<pad>"], self.validate_data.word_map["<start>"]]
-                ]
-                captions_words.append("".join(temp))
-
-        return captions_words
+        data = self.validate_data if validate else self.data
+        return Vocabulary(data.word_map).detokenize(captions)
 
         # When implementing beam search, inherit this class and modify this function
 
@@ -91,10 +71,19 @@ class Trainer(Operations):
         config: Configuration = None,
         criterion=nn.CrossEntropyLoss(),
         batch_size=64,
+        image_major=False,
     ):
         super().__init__(weights_file, exdir_data_location, smoke_test, fast_test, config, criterion, batch_size)
-        self.data = Flickr30k(exdir_data_location, mode="train", smoke_test=smoke_test, fast_test=fast_test)
-        self.data_loader = DataLoader(self.data, num_workers=0, batch_size=batch_size)
+        self.data = Flickr30k(
+            exdir_data_location, mode="train", smoke_test=smoke_test, fast_test=fast_test, image_major=image_major
+        )
+        if image_major:
+            # batches hold the five captions of batch_size // 5 images, each encoded once
+            self.data_loader = DataLoader(
+                self.data, num_workers=0, batch_size=max(1, batch_size // 5), collate_fn=self.data.collate_fn()
+            )
+        else:
+            self.data_loader = DataLoader(self.data, num_workers=0, batch_size=batch_size)
 
         self.validate_data = Flickr30k(exdir_data_location, mode="valid", smoke_test=smoke_test, fast_test=fast_test)
         self.validate_data_loader = DataLoader(self.validate_data, num_workers=8, batch_size=batch_size)
@@ -147,11 +136,13 @@ class Trainer(Operations):
         }
         start_time = time.time()
         prev_time = time.time()
-        for i, (images, captions, caption_lengths, all_captions, _) in enumerate(
+        for i, batch in enumerate(
             pbar := tqdm(self.data_loader, f"Epoch {self.epoch+1} Train Progress ", postfix=stats)
         ):
+            images, captions, caption_lengths, all_captions = batch[:4]
+            image_index = batch[5] if len(batch) > 5 else None
             # Forward
-            predictions, alphas = self.model.forward(images, captions, caption_lengths)
+            predictions, alphas = self.model.forward(images, captions, caption_lengths, image_index)
 
             y = self.remove_caption_padding(captions, caption_lengths, True)
             yhat = self.remove_caption_padding(predictions, caption_lengths, False)
@@ -161,10 +152,7 @@ class Trainer(Operations):
 
             # Processing captions and predictions
             # get  reference captions without additional characters
-            references = []
-            for j in range(all_captions.shape[0]):  # iterate over batches
-                ref_caps = all_captions[j]
-                references.append(self.caption_numbers_to_words(ref_caps))
+            references = self.caption_numbers_to_words(all_captions)
 
             # _, preds = torch.max(predictions, dim=2)
             preds = self.get_best_prediction(predictions)
@@ -250,10 +238,7 @@ class Trainer(Operations):
                 loss_meter.update(loss.item())
 
                 # Caption/prediction numbers to words
-                references = []
-                for j in range(all_captions.shape[0]):  # iterate over batches
-                    ref_caps = all_captions[j]
-                    references.append(self.caption_numbers_to_words(ref_caps, validate=True))
+                references = self.caption_numbers_to_words(all_captions, validate=True)
 
                 preds = self.get_best_prediction(predictions)
                 predicted_captions = self.caption_numbers_to_words(preds, validate=True)
@@ -378,10 +363,7 @@ class Evaluator(Operations):
             # Forward
             predictions, alphas = self.model.forward(images, captions, caption_lengths)
             # Caption/prediction numbers to words
-            references = []
-            for j in range(all_captions.shape[0]):  # iterate over batches
-                ref_caps = all_captions[j]
-                references.append(self.caption_numbers_to_words(ref_caps, validate=False))
+            references = self.caption_numbers_to_words(all_captions, validate=False)
 
             preds = self.get_best_prediction(predictions)
             predicted_captions = self.caption_numbers_to_words(preds, validate=False)
@@ -0,0 +1,92 @@
+"""Script to append new images and captions to an existing exdir archive.
+Instead of rerunning project1_preprocess_data.py over the whole corpus, the new
+images listed in --captions_file (in the format of results_20130124.token) are
+added to one split of the archive. Their captions are tokenized and lemmatized
+like the original corpus and encoded against the frozen word map of the archive,
+so the vocabulary, the existing records and the models trained on them are left
+as they are. Images already in the archive are skipped, so a refresh can pass a
+token file holding old and new images, and an interrupted run is continued by
+running the script again.
+
+With --feature_store the features of the new images are also appended to a
+packed feature store written by project2_preprocess_data.py, pass the backbone
+options the store was written with. Packed image stores have a fixed size and
+are rewritten with pack_images.py instead.
+"""
+import argparse
+from multiprocessing import Pool, cpu_count
+
+import nltk
+import torch
+from torchvision.datasets import Flickr30k
+from tqdm import tqdm
+
+from data.append import SPLIT_NAMES, DatasetAppender
+from data.feature_extraction import BACKBONES, REGION_LAYERS, FeatureExtractor, extract_features
+from data.jpeg import read_encoded
+from data.preprocessing import init_worker, load_example
+
+nltk.download("omw-1.4")
+nltk.download("wordnet")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Append images to a Flickr30K archive")
+    parser.add_argument("--data_dir", action="store", type=str, default="../flickr30k.exdir")
+    parser.add_argument("--image_dir", action="store", type=str, required=True)
+    parser.add_argument("--captions_file", action="store", type=str, required=True)
+    parser.add_argument("--split", action="store", choices=SPLIT_NAMES, default="train")
+    parser.add_argument("--batch_size", action="store", type=int, default=256, help="images per committed batch")
+    parser.add_argument("--num_workers", action="store", type=int, default=cpu_count())
+    # optionally also append the features of the new images to a packed feature store
+    parser.add_argument("--feature_store", action="store", type=str, default=None)
+    parser.add_argument("--backbone", action="store", choices=BACKBONES, default="resnet152")
+    parser.add_argument("--region_layer", action="store", choices=REGION_LAYERS, default="layer3")
+    parser.add_argument("--grid_size", action="store", type=int, default=7)
+    parser.add_argument("--image_size", action="store", type=int, default=224)
+    parser.add_argument("--device", action="store", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    appender = DatasetAppender(args.data_dir, args.split, disable_progress_bar=False)
+    if appender.image_format == "jpeg":
+        # reads the encoded bytes of the files without decoding them
+        dataset = Flickr30k(args.image_dir, args.captions_file, loader=read_encoded)
+    else:
+        dataset = Flickr30k(args.image_dir, args.captions_file)
+    img_ids = dataset.ids
+    todo = [i for i, img_id in enumerate(img_ids) if img_id not in appender]
+    print(f"Appending {len(todo)} of {len(img_ids)} images to the {args.split} split of {args.data_dir}")
+
+    batches = [todo[start : start + args.batch_size] for start in range(0, len(todo), args.batch_size)]
+    pbar = tqdm(total=len(todo), desc="Appending Data")
+    with Pool(args.num_workers, init_worker, (dataset,)) as pool:
+        for batch in batches:
+            for i, (image, _, caption_tokens) in zip(batch, pool.map(load_example, batch)):
+                appender.add(img_ids[i], image, caption_tokens)
+            appender.commit()
+            pbar.update(len(batch))
+    pbar.close()
+    print(f"{len(appender)} images in the {args.split} split")
+
+    if args.feature_store is not None:
+        extractor = FeatureExtractor(args.backbone, region_layer=args.region_layer, grid_size=args.grid_size)
+        # images of other splits are left out and images already in the store are skipped
+        split_ids = [img_id for img_id in img_ids if img_id in appender.indexed]
+        writer = extract_features(
+            extractor,
+            args.image_dir,
+            split_ids,
+            args.feature_store,
+            args.split,
+            num_workers=args.num_workers,
+            image_size=args.image_size,
+            device=args.device,
+        )
+        print(f"{len(writer)} images in the {args.split} split of {args.feature_store}")
+
+
+if __name__ == "__main__":
+    main()
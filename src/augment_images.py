@@ -0,0 +1,45 @@
+"""Script to write an augmentation bank into a packed image store.
+AugmentedFlickrDataset blurs and jitters the brightness of every sample on the
+CPU in every epoch. This script instead applies the same augmentations once to
+the images of a store written by pack_images.py, keeping --variants augmented
+variants of every image next to the store. Train with --image_store and
+--augmentation_bank to sample one of them per access; the augmentation defaults
+below are the ones of AugmentedFlickrDataset. The bank takes --variants times
+the disk space of the split's images.
+"""
+import argparse
+
+import torchvision.transforms as transforms
+
+from data.batch_transforms import BatchColorJitter, BatchGaussianBlur
+from data.image_store import write_augmentation_bank
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Write Flickr30K augmentation bank")
+    parser.add_argument("--store_dir", action="store", type=str, default="../flickr30k/flickr30k.images")
+    parser.add_argument("--modes", action="store", nargs="+", default=["train"])
+    parser.add_argument("--variants", action="store", type=int, default=4, help="augmented variants per image")
+    parser.add_argument("--blur_kernel", action="store", type=int, nargs=2, default=[5, 5])
+    parser.add_argument("--blur_sigma", action="store", type=float, nargs=2, default=[0.1, 3])
+    parser.add_argument("--brightness", action="store", type=float, default=0.2)
+    parser.add_argument("--batch_size", action="store", type=int, default=64)
+    parser.add_argument("--seed", action="store", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    augment = transforms.Compose(
+        [
+            BatchGaussianBlur(kernel_size=args.blur_kernel, sigma=args.blur_sigma),
+            BatchColorJitter(brightness=args.brightness),
+        ]
+    )
+    for mode in args.modes:
+        write_augmentation_bank(args.store_dir, mode, augment, args.variants, args.batch_size, args.seed)
+        print(f"{mode}: {args.variants} variants per image in {args.store_dir}")
+
+
+if __name__ == "__main__":
+    main()
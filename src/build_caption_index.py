@@ -0,0 +1,25 @@
+"""Script to build the consolidated caption index of an existing exdir archive.
+Archives written before the caption index existed store captions as per image
+attributes. This script reads them once and writes the binary index that
+Flickr30k and Flickr30KFeatures load at startup.
+"""
+import argparse
+
+from data.caption_index import write_caption_index
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Build Flickr30K caption index")
+    parser.add_argument("--data_dir", action="store", type=str, default="../flickr30k.exdir")
+    parser.add_argument("--modes", action="store", nargs="+", default=["train", "valid", "test"])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for mode in args.modes:
+        write_caption_index(args.data_dir, mode)
+
+
+if __name__ == "__main__":
+    main()
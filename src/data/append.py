@@ -0,0 +1,125 @@
+"""
+This module contains the incremental append of new images to an existing exdir archive.
+
+Rebuilding an archive with project1_preprocess_data.py tokenizes the whole corpus
+again, rebuilds the word map and rewrites every record. DatasetAppender instead
+adds new images to one split of the archive: their captions are encoded against
+the frozen word map of the archive, with words missing from it mapped to <unc>
+and captions longer than max_cap_len truncated, the images are written as new
+datasets in the image format of the archive, and the caption index of the split
+and the valid_ids manifest are extended. Existing datasets are never rewritten.
+
+The caption index is replaced atomically once the images of a batch were written
+and the manifest is updated after it, so images of an interrupted append are in
+neither and are written again by the next append. Features of the new images are
+appended to a packed feature store with data.feature_extraction.extract_features.
+"""
+from typing import Dict, List
+
+import exdir
+import numpy as np
+
+from .caption_index import CaptionIndex, has_caption_index, write_caption_index
+from .jpeg import decode_image, is_encoded
+from .preprocessing import encode_caption
+
+SPLIT_NAMES = ["train", "valid", "test"]
+
+
+def truncate_caption(tokens: List[str], max_caption_length: int) -> List[str]:
+    """Drops the words of a caption that don't fit the padded caption length with <start> and <end>"""
+    return tokens[: max_caption_length - 2]
+
+
+class DatasetAppender(object):
+    """Appends new images and their tokenized captions to one split of an exdir archive
+
+    Images are added with add and become visible to the datasets with commit, which
+    writes the caption index and the manifest. Images already in any split of the
+    archive are skipped.
+    """
+
+    def __init__(self, root: str, mode: str, disable_progress_bar: bool = True) -> None:
+        """
+        Args:
+            root (str): path to the exdir archive
+            mode (str): split the images are appended to (train, valid, or test)
+            disable_progress_bar (bool): hide the progress bar when a legacy archive is indexed first
+        """
+        self.root = root
+        self.mode = mode
+        self.archive = exdir.File(root)
+        self.group = self.archive.require_group(mode)
+        self.word_map = self.archive.attrs["word_map"].to_dict()
+        self.max_cap_len = self.archive.attrs["max_cap_len"]
+        self.image_format = self.archive.attrs["image_format"] if "image_format" in self.archive.attrs else "array"
+        if has_caption_index(root, mode):
+            self.index = CaptionIndex.load(root, mode)
+        else:
+            # legacy archives keep their captions in the attributes of every image
+            self.index = write_caption_index(root, mode, disable_progress_bar)
+        self.indexed = set(self.index.ids)
+        others = [name for name in SPLIT_NAMES if name != mode and name in self.archive]
+        self.others = set(img_id for name in others for img_id in self.archive[name].keys())
+        self.captions = {}
+        self.lengths = {}
+
+    def __contains__(self, img_id: str) -> bool:
+        return img_id in self.indexed or img_id in self.others or img_id in self.captions
+
+    def __len__(self) -> int:
+        return len(self.index.ids)
+
+    def encode(self, tokens: List[List[str]]) -> Dict[str, list]:
+        """Encoded captions and caption lengths of tokenized captions, using the word map of the archive"""
+        tokens = [truncate_caption(caption, self.max_cap_len) for caption in tokens]
+        return {
+            "captions": [encode_caption(caption, self.word_map, self.max_cap_len) for caption in tokens],
+            "lengths": [len(caption) for caption in tokens],
+        }
+
+    def add(self, img_id: str, image: np.ndarray, tokens: List[List[str]]) -> bool:
+        """Writes a new image and its captions, visible after the next commit
+        Args:
+            img_id (str): image id
+            image (np.ndarray): decoded image, or JPEG bytes for archives storing them
+            tokens (list): tokenized captions of the image
+        Returns:
+            (bool): False if the image is already in the archive and was skipped
+        """
+        if img_id in self:
+            return False
+        if is_encoded(image) and self.image_format == "array":
+            image = decode_image(image, None)
+        elif not is_encoded(image) and self.image_format == "jpeg":
+            raise ValueError(f"{self.root} stores JPEG bytes, read the images with data.jpeg.read_encoded")
+        if img_id in self.group:
+            # written by an interrupted append before its index was committed
+            del self.group[img_id]
+        encoded = self.encode(tokens)
+        dataset = self.group.create_dataset(img_id, data=np.asarray(image))
+        dataset.attrs["captions"] = encoded["captions"]
+        dataset.attrs["lengths"] = encoded["lengths"]
+        self.captions[img_id] = encoded["captions"]
+        self.lengths[img_id] = encoded["lengths"]
+        return True
+
+    def commit(self) -> List[str]:
+        """Appends the added images to the caption index and the manifest
+        Returns:
+            (list): ids of the committed images
+        """
+        ids = list(self.captions.keys())
+        if len(ids) == 0:
+            return ids
+        added = CaptionIndex.from_captions(self.captions, self.lengths, self.word_map, self.max_cap_len)
+        self.index = self.index.extend(added)
+        self.index.save(self.root, self.mode)
+        if "valid_ids" in self.archive.attrs:
+            valid_ids = list(self.archive.attrs["valid_ids"])
+            known = set(valid_ids)
+            self.archive.attrs["valid_ids"] = valid_ids + [img_id for img_id in ids if img_id not in known]
+        self.indexed.update(ids)
+        self.captions = {}
+        self.lengths = {}
+        return ids
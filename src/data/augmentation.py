@@ -4,22 +4,33 @@ perform data augmentation. By the end of the project, the
 following should be implemented
  - Child Class that performs data augmentation on Flicker30K dataset
 """
-from collections import defaultdict
 import numpy as np
 import exdir
 from tqdm import tqdm
 import torch
 from torchvision.datasets import VisionDataset
 import torchvision.transforms as transforms
+from torch.nn.utils.rnn import pad_sequence
 from torch import float32
-from typing import Any, Callable, NoReturn, Optional, Tuple
+from typing import Any, Callable, List, NoReturn, Optional, Tuple, Union
 from multiprocessing import Pool
 from copy import copy
+from .batch_transforms import BatchColorJitter, BatchGaussianBlur
+from .cache import SharedFeatureCache
+from .caption_index import CaptionIndex, has_caption_index
+from .caption_store import CaptionMapping, CaptionPairs, CaptionStore
+from .collate import ImageMajorCollate, NormalizeImageCollate
+from .encoder_cache import EncoderCache
+from .feature_store import PackedFeatureStore
+from .handles import archive_group
+from .image_store import PackedImageStore
+from .jpeg import DECODE_SIZE, DecodePool, decode_image
+from .samplers import detection_counts
 
 
 def load_metadata(path, key, mode):
-    archive = exdir.File(path, mode="r")
-    archive = archive.require_group(mode)
+    # pool processes reuse their handle for every key
+    archive = archive_group(path, mode)
     try:
         ret = {key: archive[key].attrs["captions"]}, {key: archive[key].attrs["lengths"]}
     except Exception as e:
@@ -47,38 +58,126 @@ class Flickr30k(VisionDataset):
         fast_test=False,
         disable_progress_bar=False,
         num_processes=4,
+        image_store: Optional[str] = None,
+        batch_transforms: bool = False,
+        image_major: bool = False,
+        subset: Optional[str] = None,
+        decode_size: int = DECODE_SIZE,
+        decode_threads: int = 0,
     ) -> None:
+        """
+        Args:
+            image_store (str, optional): path to a packed image store written by pack_images.py. When given,
+                images are returned as pre-resized uint8 tensors and the transform is skipped. Batches must
+                then be built with NormalizeImageCollate, which converts and normalizes the whole batch.
+            batch_transforms (bool): return resized and cropped uint8 images and apply the dtype conversion,
+                augmentation and normalization to whole batches in the collate function, see collate_fn.
+            image_major (bool): index images instead of captions. Every sample holds one image and all
+                of its captions, so each image is loaded and transformed once per epoch. Batches must be
+                built with ImageMajorCollate, see collate_fn.
+            subset (str, optional): path to a subset archive written by write_subset.py, read instead of root.
+                Holds a few stratified images per split for smoke tests and fast development runs.
+            decode_size (int): images of archives storing JPEG bytes are decoded at a reduced scale with
+                both sides of at least decode_size pixels, see data.jpeg
+            decode_threads (int): threads of every DataLoader worker decoding the JPEG images of a batch
+        """
+        if subset is not None:
+            root = subset
         super(Flickr30k, self).__init__(root, transform=transform, target_transform=target_transform)
+        self.mode = mode
+        self.image_store = None
+        if image_store is not None:
+            self.image_store = PackedImageStore(image_store, mode)
+        self.batch_transforms = batch_transforms
+        self.image_major = image_major
+        self.decode_size = decode_size
+        self.decode_pool = DecodePool(decode_threads)
+        # images of the current batch decoded by the decode pool, see __getitems__
+        self._decoded = {}
+        # per sample geometry of batch_transforms, raw images differ in size and can't be stacked before it
+        self.resize_crop = transforms.Compose([transforms.Resize((256, 256)), transforms.CenterCrop(224)])
+        # augmentation applied to the uint8 images of an image store
+        self.augment = None
+        # sample the precomputed variants of the image store's augmentation bank instead of augmenting
+        self.augmentation_bank = False
+        # batched augmentation applied by the collate function when batch_transforms is set
+        self.batch_augment = None
+        # only the attributes are read here, images and features are read through the handle pool
         archive = exdir.File(root, mode="r")
         self.valid_ids = archive.attrs["valid_ids"]
-        self.archive = archive.require_group(mode)
 
-        data_keys = list(set(self.archive.keys()).intersection(set(self.valid_ids)))
+        self.normalize = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+
+        if has_caption_index(root, mode):
+            self._load_caption_index(CaptionIndex.load(root, mode), smoke_test, fast_test)
+        else:
+            # legacy archives without a caption index, see build_caption_index.py
+            self._load_caption_attributes(archive, num_processes, smoke_test, fast_test, disable_progress_bar)
+        self.ids = self.captions.ids.tolist()
+
+    @property
+    def annotations(self) -> CaptionMapping:
+        """Tokenized captions of every image id, read from the caption store"""
+        return CaptionMapping(self.captions)
+
+    @property
+    def lengths(self) -> CaptionMapping:
+        """Caption lengths of every image id, read from the caption store"""
+        return CaptionMapping(self.captions, lengths=True)
+
+    @property
+    def ann_list(self) -> CaptionPairs:
+        """(image id, tokenized caption) of every caption, read from the caption store"""
+        return CaptionPairs(self.captions)
+
+    @property
+    def archive(self) -> exdir.Group:
+        """Group of the split, opened by the current process on first use, see data.handles"""
+        return archive_group(self.root, self.mode)
+
+    def open_handles(self) -> NoReturn:
+        """Opens the archive handle of the current process, called by open_worker_handles"""
+        archive_group(self.root, self.mode)
+
+    def _select_keys(self, data_keys: list, smoke_test: bool, fast_test: bool) -> list:
         if smoke_test:
             data_keys = data_keys[:2]
         elif fast_test:
             data_keys = data_keys[: int(len(data_keys) * 0.1)]
-        # Read tokenized captions and store in dict
-        self.annotations = defaultdict(list)
-        self.ann_list = []
-        self.lengths = defaultdict(list)
-        self.normalize = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+        return data_keys
 
+    def _load_caption_index(self, index: CaptionIndex, smoke_test: bool, fast_test: bool) -> NoReturn:
+        """Reads captions from the split's consolidated caption index"""
+        valid_ids = set(self.valid_ids)
+        positions = [i for i, img_id in enumerate(index.ids) if img_id in valid_ids]
+        self.captions = CaptionStore.from_index(index, self._select_keys(positions, smoke_test, fast_test))
+        self.word_map = index.word_map
+        self.inv_word_map = {v: k for k, v in self.word_map.items()}
+        self.max_cap_len = index.max_cap_len
+
+    def _load_caption_attributes(
+        self, archive: exdir.File, num_processes: int, smoke_test: bool, fast_test: bool, disable_progress_bar: bool
+    ) -> NoReturn:
+        """Reads captions from the attributes of every image in the archive"""
+        root = self.root
+        mode = self.mode
+        data_keys = sorted(set(self.archive.keys()).intersection(set(self.valid_ids)))
+        data_keys = self._select_keys(data_keys, smoke_test, fast_test)
+        annotations = {}
+        lengths = {}
         with Pool(processes=num_processes) as pool:
             zx = list(zip([root for _ in range(len(data_keys))], data_keys, [mode for _ in range(len(data_keys))]))
             jobs = [pool.apply_async(func=load_metadata, args=(*argument,)) for argument in zx]
             for job in tqdm(jobs, desc=f"Loading {mode} data", disable=disable_progress_bar):
                 job.wait()
                 a, l = job.get()
-                self.annotations.update(a)
-                for id, caps in a.items():
-                    for cap in caps:
-                        self.ann_list.append((id, cap))
-                self.lengths.update(l)
-        self.ids = list(sorted(self.annotations.keys()))
+                annotations.update(a)
+                lengths.update(l)
         self.word_map = archive.attrs["word_map"].to_dict()
         self.inv_word_map = {v: k for k, v in self.word_map.items()}
         self.max_cap_len = archive.attrs["max_cap_len"]
+        index = CaptionIndex.from_captions(annotations, lengths, self.word_map, self.max_cap_len)
+        self.captions = CaptionStore.from_index(index, range(len(index.ids)))
 
     def __getitem__(self, index: int) -> Tuple[Any, Any]:
         """
@@ -88,78 +187,298 @@ class Flickr30k(VisionDataset):
         Returns:
             tuple: Tuple (image, target). target is a list of captions for the image.
         """
-        img_id = self.ids[index // 5]
-
-        # Image
-        img = torch.Tensor(np.copy(self.archive[img_id][:]))
-        img = img.permute(2, 0, 1)
-        if self.transform is not None:
-            img = self.transform(img)
-        mod = self.normalize(img)
+        if self.image_major:
+            return self._image_sample(index)
+        record = self.captions.record(index)
+        mod, img = self._load_image(record.img_id)
 
         # Captions
-        target = self.annotations[img_id][index % 5]
-        target = torch.Tensor(target).long()
+        target = torch.from_numpy(record.tokens.astype(np.int64))
         if self.target_transform is not None:
             target = self.target_transform(target)
 
         # Caption lengths
-        lengths = self.lengths[img_id][index % 5]
-        lengths = torch.from_numpy([lengths]).long()
+        lengths = torch.tensor([record.length]).long()
 
-        all_caps = torch.Tensor(self.annotations[img_id]).long()
+        all_caps = torch.from_numpy(self.captions.captions(record.image).astype(np.int64))
         return mod, target, lengths, all_caps, img
 
+    def __getitems__(self, indices: List[int]) -> list:
+        """Samples of a batch, the JPEG images of the batch are decoded in parallel by the decode pool"""
+        if self.decode_pool.threads > 0 and self.image_store is None:
+            images = self.captions.images[indices] if not self.image_major else np.asarray(indices)
+            img_ids = [str(img_id) for img_id in self.captions.ids[np.unique(images)]]
+            self._decoded = dict(zip(img_ids, self.decode_pool.map(self._raw_image, img_ids)))
+        try:
+            return [self[index] for index in indices]
+        finally:
+            self._decoded = {}
+
+    def _raw_image(self, img_id: str) -> np.ndarray:
+        """Decoded (height, width, 3) uint8 image of the archive"""
+        if img_id in self._decoded:
+            return self._decoded[img_id]
+        return decode_image(self.archive[img_id][:], self.decode_size)
+
+    def _image_sample(self, image: int) -> tuple:
+        """Image major sample: (image, captions, caption lengths, all captions, image)"""
+        mod, img = self._load_image(str(self.captions.ids[image]))
+        all_caps = torch.from_numpy(self.captions.captions(image).astype(np.int64))
+        captions = all_caps
+        if self.target_transform is not None:
+            captions = torch.stack([self.target_transform(caption) for caption in all_caps])
+        lengths = torch.from_numpy(self.captions.caption_lengths(image).astype(np.int64))[:, None]
+        return mod, captions, lengths, all_caps, img
+
+    def _load_image(self, img_id: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Returns the model input and the transformed image"""
+        if self.image_store is not None:
+            # already resized and cropped, converted and normalized per batch by NormalizeImageCollate
+            if self.augmentation_bank:
+                # torch's generator is seeded differently in every DataLoader worker
+                k = int(torch.randint(self.image_store.num_variants, ()))
+                img = torch.from_numpy(self.image_store.variant(img_id, k))
+            else:
+                img = torch.from_numpy(self.image_store.image(img_id))
+                if self.augment is not None and not self.batch_transforms:
+                    img = self.augment(img)
+            mod = img
+        elif self.batch_transforms:
+            img = torch.from_numpy(np.array(self._raw_image(img_id), dtype=np.uint8)).permute(2, 0, 1)
+            img = self.resize_crop(img)
+            mod = img
+        else:
+            img = torch.Tensor(np.copy(self._raw_image(img_id)))
+            img = img.permute(2, 0, 1)
+            if self.transform is not None:
+                img = self.transform(img)
+            mod = self.normalize(img)
+        return mod, img
+
+    def collate_fn(self) -> Optional[Callable]:
+        """Collate function for the DataLoader, None when the default collate applies"""
+        collate = None
+        if self.batch_transforms:
+            collate = NormalizeImageCollate(self.batch_augment)
+        elif self.image_store is not None:
+            collate = NormalizeImageCollate()
+        if self.image_major:
+            return ImageMajorCollate(collate)
+        return collate
+
+    def sample_statistics(self) -> np.ndarray:
+        """Caption length and number of region detections of every sample, see BucketBatchSampler
+        Returns:
+            (np.ndarray): array of shape (len(self), 2). Raw images have no detections.
+        """
+        statistics = np.zeros((len(self), 2), dtype=np.int64)
+        statistics[:, 0] = self.captions.lengths
+        return statistics
+
     def __len__(self) -> int:
-        return len(self.ids) * 5
+        if self.image_major:
+            return len(self.ids)
+        return len(self.captions)
 
 
 class Flickr30KFeatures(Flickr30k):
-    def __init__(self, max_detections, feature_mode="global", lazy_cache=False, *args, **kwargs) -> NoReturn:
+    def __init__(
+        self,
+        max_detections,
+        feature_mode="global",
+        lazy_cache=False,
+        feature_store=None,
+        cache_bytes=2**30,
+        pad_detections=True,
+        dequantize=True,
+        *args,
+        **kwargs,
+    ) -> NoReturn:
+        """
+        Args:
+            max_detections (int): number of region features returned per image
+            feature_mode (str): "region" or "global" features
+            lazy_cache (bool): cache loaded features in a cache shared by all DataLoader workers
+            feature_store (str, optional): path to a packed feature store written by pack_features.py.
+                When given, features are read as views of the store's memory map instead of from exdir.
+            cache_bytes (int): memory budget of the lazy cache
+            pad_detections (bool): zero pad region features to max_detections. When False, images return
+                only their own detections and batches should be built with VariableLengthCollate.
+            dequantize (bool): convert float16 or int8 features of a quantized feature store to float32 per
+                sample. When False, samples keep the stored dtype and batches should be built with
+                DequantizeCollate, which converts a whole batch at once.
+        """
         self.max_detect = max_detections
         self.feature_mode = feature_mode
-        self.cache_mode = lazy_cache
-        self.cached = dict()
+        self.pad_detections = pad_detections
+        self.dequantize = dequantize
         super().__init__(*args, **kwargs)
+        self.store = None
+        if feature_store is not None:
+            self.store = PackedFeatureStore(feature_store, self.mode)
+        self.cache = None
+        if lazy_cache and len(self.ids) > 0:
+            # allocated here so that the workers forked by the DataLoader share it
+            sample = self._read_features(self.ids[0])
+            entry_shape = (self.max_detect if self.feature_mode == "region" else 1, sample.shape[1])
+            self.cache = SharedFeatureCache(len(self.ids), entry_shape, cache_bytes, sample.dtype)
 
-    def __getitem__(self, index: int) -> Tuple[Any, Any]:
+    def __getitem__(self, index: Union[int, List[int]]) -> Tuple[Any, Any]:
         """
         Args:
-            index (int): Index
+            index (int or list): Index, or the indices of a whole batch, see fetch_batch
 
         Returns:
             tuple: Tuple (features, target). target is a list of captions for the image.
         """
-        img_id, target = self.ann_list[index]
-        cached = self.cached.get(img_id, False)
-        if self.cache_mode and self.cached.get(img_id, False):  # Lazy load data
-            features, target = cached
-            return features, target, img_id
+        if not isinstance(index, (int, np.integer)):
+            return self.fetch_batch(index)
+        record = self.captions.record(index)
 
         # Image
-        if self.feature_mode == "region":
-            features = np.copy(self.archive[img_id]["region_features"][:])
-            if features.shape[0] > self.max_detect:
-                features = features[: self.max_detect, :]
-            elif features.shape[0] < self.max_detect:
-                diff = self.max_detect - features.shape[0]
-                features = np.concatenate([features, np.zeros((diff, features.shape[1]))])
-        else:
-            features = np.copy(self.archive[img_id]["global_features"][:])[None, :]
-
-        features = torch.tensor(features).float()
+        features = self._cached_features(record.image, record.img_id)
 
         # Captions
-        target = torch.tensor(target).long()
+        target = torch.from_numpy(record.tokens.astype(np.int64))
         if self.target_transform is not None:
             target = self.target_transform(target)
         # all_caps = torch.tensor(np.copy()).long()
-        if self.cache_mode:
-            self.cached[img_id] = (features, target)
-        return features, target, img_id
+        return features, target, record.img_id
+
+    def fetch_batch(self, indices: List[int]) -> tuple:
+        """Reads the samples of a whole batch at once and returns them stacked
+
+        Every image of the batch is read once. With an uncompressed feature store the rows of
+        all images are gathered from the memory map in a single pass in storage order and
+        quantized features are dequantized once for the batch. Use it with a batch sampler
+        passed as the DataLoader's sampler and batch_size=None, the collate functions of
+        data.collate accept the stacked batches.
+        Args:
+            indices (list): sample indices of the batch
+        Returns:
+            (tuple): (features, captions, img_ids) like default_collate of the samples. Without
+                pad_detections, features are padded to the most detections of the batch and a
+                padding mask that is True at padded detections is appended, like VariableLengthCollate.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        images, inverse = np.unique(self.captions.images[indices], return_inverse=True)
+        img_ids = [str(img_id) for img_id in self.captions.ids[images]]
+        if self.store is not None and self.store.chunks is None:
+            features, counts = self._gather_features(img_ids)
+        else:
+            if self.store is not None:
+                self.store.prefetch(img_ids)
+            samples = [self._cached_features(image, img_id) for image, img_id in zip(images, img_ids)]
+            counts = torch.tensor([sample.shape[0] for sample in samples])
+            features = pad_sequence(samples, batch_first=True)
+        features = features[torch.from_numpy(inverse)]
+
+        captions = torch.from_numpy(self.captions.tokens[indices].astype(np.int64))
+        if self.target_transform is not None:
+            captions = torch.stack([self.target_transform(caption) for caption in captions])
+        batch_ids = [img_ids[i] for i in inverse]
+        if self.feature_mode == "region" and not self.pad_detections:
+            padding_mask = torch.arange(features.shape[1])[None, :] >= counts[inverse][:, None]
+            return features, captions, batch_ids, padding_mask
+        return features, captions, batch_ids
+
+    def _cached_features(self, image: int, img_id: str) -> torch.Tensor:
+        features = None
+        if self.cache is not None:
+            features = self.cache.get(image)
+        if features is None:
+            features = self._read_features(img_id)
+            if self.cache is not None:
+                self.cache.put(image, features)
+        return features
+
+    def _gather_features(self, img_ids: List[str]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Reads the features of images from an uncompressed store with one gather in storage order"""
+        positions = np.array([self.store.positions[img_id] for img_id in img_ids], dtype=np.int64)
+        # read in storage order, returned in the order of img_ids
+        order = np.argsort(np.argsort(positions))
+        positions = np.sort(positions)
+        if self.feature_mode != "region":
+            features = torch.from_numpy(self.store.global_features[positions])[:, None, :]
+            counts = torch.ones(len(img_ids), dtype=torch.long)
+        else:
+            counts = np.minimum(self.store.counts[positions], self.max_detect)
+            detections = self.max_detect if self.pad_detections else int(counts.max(initial=0))
+            image = np.repeat(np.arange(len(positions)), counts)
+            row = np.arange(len(image)) - np.repeat(np.cumsum(counts) - counts, counts)
+            regions = self.store.region_features[self.store.offsets[positions][image] + row]
+            features = np.zeros((len(positions), detections, regions.shape[1]), dtype=regions.dtype)
+            features[image, row] = regions
+            features = torch.from_numpy(features)
+            counts = torch.from_numpy(counts)
+        if self.dequantize:
+            features = self.store.dequantize(features, self.feature_mode)
+        return features[torch.from_numpy(order)], counts[torch.from_numpy(order)]
+
+    def _read_features(self, img_id: str) -> torch.Tensor:
+        """Reads the float32 features of an image from the feature store or the exdir archive"""
+        if self.feature_mode != "region":
+            if self.store is not None:
+                features = torch.from_numpy(self.store.global_(img_id))[None, :]
+                return self.store.dequantize(features, "global") if self.dequantize else features
+            features = np.array(self.archive[img_id]["global_features"][:], dtype=np.float32)
+            return torch.from_numpy(features)[None, :]
+        if self.store is not None:
+            # view of the store's memory map, no copy is made unless padding is needed
+            features = torch.from_numpy(self.store.region(img_id)[: self.max_detect])
+        else:
+            features = np.array(self.archive[img_id]["region_features"][: self.max_detect], dtype=np.float32)
+            features = torch.from_numpy(features)
+        if self.pad_detections and features.shape[0] < self.max_detect:
+            padding = features.new_zeros((self.max_detect - features.shape[0], features.shape[1]))
+            features = torch.cat([features, padding])
+        if self.store is not None and self.dequantize:
+            features = self.store.dequantize(features, "region")
+        return features
+
+    def sample_statistics(self) -> np.ndarray:
+        """Caption length and number of region detections of every sample, see BucketBatchSampler
+        Returns:
+            (np.ndarray): array of shape (len(self), 2)
+        """
+        statistics = np.zeros((len(self), 2), dtype=np.int64)
+        statistics[:, 0] = self.captions.lengths
+        if self.feature_mode == "region":
+            if self.store is not None:
+                counts = self.store.counts[[self.store.positions[img_id] for img_id in self.ids]]
+            else:
+                counts = detection_counts(self.root, self.mode, self.ids)
+            # images of the caption store are in the order of self.ids
+            statistics[:, 1] = np.minimum(counts, self.max_detect)[self.captions.images]
+        else:
+            statistics[:, 1] = 1
+        return statistics
 
     def __len__(self) -> int:
-        return len(self.ann_list)
+        return len(self.captions)
+
+
+class Flickr30kAnnotations(Flickr30k):
+    """Flickr30k samples with the cached SATEncoder outputs of the images instead of the images
+
+    The first and last element of a sample are the (height, width, channels) annotation vectors
+    of the image, which go straight to SATDecoder. See data.encoder_cache.
+    """
+
+    def __init__(self, encoder_cache: str, *args, **kwargs) -> NoReturn:
+        """
+        Args:
+            encoder_cache (str): cache directory of the encoder written by write_encoder_cache
+        """
+        super().__init__(*args, **kwargs)
+        self.encoder_cache = EncoderCache(encoder_cache, self.mode)
+
+    def _load_image(self, img_id: str) -> Tuple[torch.Tensor, torch.Tensor]:
+        annotations = torch.from_numpy(self.encoder_cache.annotation(img_id)).float()
+        return annotations, annotations
+
+    def collate_fn(self) -> Optional[Callable]:
+        return ImageMajorCollate() if self.image_major else None
 
 
 class AugmentedFlickrDataset(Flickr30k):
@@ -183,7 +502,27 @@ class AugmentedFlickrDataset(Flickr30k):
         mode="test",
         smoke_test=False,
         fast_test=False,
+        # Path to a packed image store (see Flickr30k)
+        image_store=None,
+        # Augment whole batches in the collate function (see Flickr30k)
+        batch_transforms=False,
+        # One sample per image holding all of its captions (see Flickr30k)
+        image_major=False,
+        # Path to a subset archive read instead of root (see Flickr30k)
+        subset=None,
+        # Decode size and decode threads of archives storing JPEG bytes (see Flickr30k)
+        decode_size=DECODE_SIZE,
+        decode_threads=0,
+        # Sample the augmented variants of the image store written by augment_images.py (see data.image_store)
+        augmentation_bank=False,
     ) -> None:
+        augment = transforms.Compose(
+            [
+                # transforms.RandomAffine(degrees=degrees, translate=translate),
+                transforms.GaussianBlur(kernel_size=blur_kernel_mean, sigma=blur_kernel_std),
+                transforms.ColorJitter(brightness=brightness_factor),
+            ]
+        )
         super().__init__(
             root,
             transform=transforms.Compose(
@@ -192,16 +531,32 @@ class AugmentedFlickrDataset(Flickr30k):
                     transforms.ConvertImageDtype(float32),
                     transforms.Resize(resize),
                     transforms.CenterCrop(224),
-                    # transforms.RandomAffine(degrees=degrees, translate=translate),
-                    transforms.GaussianBlur(kernel_size=blur_kernel_mean, sigma=blur_kernel_std),
-                    transforms.ColorJitter(brightness=brightness_factor),
+                    augment,
                     # Convert to tensor, float [0.0, 255.0]
                 ]
             ),
             mode=mode,
             smoke_test=smoke_test,
             fast_test=fast_test,
+            image_store=image_store,
+            batch_transforms=batch_transforms,
+            image_major=image_major,
+            subset=subset,
+            decode_size=decode_size,
+            decode_threads=decode_threads,
+        )
+        self.augment = augment
+        self.resize_crop = transforms.Compose([transforms.Resize(resize), transforms.CenterCrop(224)])
+        self.batch_augment = transforms.Compose(
+            [
+                BatchGaussianBlur(kernel_size=blur_kernel_mean, sigma=blur_kernel_std),
+                BatchColorJitter(brightness=brightness_factor),
+            ]
         )
+        # augmentation is the fallback for image stores without an augmentation bank
+        if augmentation_bank and self.image_store is not None and self.image_store.num_variants > 0:
+            self.augmentation_bank = True
+            self.batch_augment = None
 
     # EfficientNet requires a float tensor with intensities of [0.0, 255.0]
     # AFAIK, Pytorch doesn't have a transform that can accomplish this
@@ -0,0 +1,62 @@
+"""
+This module contains image augmentations that run on a whole batch of images at
+once. They operate on float tensors of shape (batch_size, channels, height, width)
+and draw their random parameters per image, so a batch gets the same distribution
+of augmentations as applying the torchvision transforms to every image on its own,
+with one vectorized call per batch instead of one Python dispatch per image.
+"""
+from typing import Sequence, Tuple, Union
+
+import torch
+import torch.nn.functional as F
+
+
+def _pair(value: Union[int, float, Sequence]) -> tuple:
+    if isinstance(value, (int, float)):
+        return (value, value)
+    return tuple(value)
+
+
+class BatchGaussianBlur(object):
+    """Batched equivalent of transforms.GaussianBlur with a random sigma per image"""
+
+    def __init__(self, kernel_size: Union[int, Tuple[int, int]], sigma: Union[float, Tuple[float, float]] = (0.1, 2.0)):
+        self.kernel_size = _pair(kernel_size)
+        self.sigma = _pair(sigma)
+
+    @staticmethod
+    def kernels(size: int, sigma: torch.Tensor) -> torch.Tensor:
+        """Normalized 1D gaussian kernels of shape (batch_size, size)"""
+        x = torch.arange(size, dtype=sigma.dtype, device=sigma.device) - (size - 1) / 2
+        kernel = torch.exp(-0.5 * (x[None, :] / sigma[:, None]) ** 2)
+        return kernel / kernel.sum(dim=1, keepdim=True)
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        batch_size, channels, height, width = images.shape
+        sigma = torch.empty(batch_size, device=images.device).uniform_(*self.sigma)
+        kx, ky = self.kernel_size
+        # one group per (image, channel) so every image is blurred with its own kernel
+        weight_x = self.kernels(kx, sigma).to(images.dtype).repeat_interleave(channels, dim=0)
+        weight_y = self.kernels(ky, sigma).to(images.dtype).repeat_interleave(channels, dim=0)
+        x = images.reshape(1, batch_size * channels, height, width)
+        x = F.pad(x, (kx // 2, kx // 2, ky // 2, ky // 2), mode="reflect")
+        x = F.conv2d(x, weight_x.view(-1, 1, 1, kx), groups=batch_size * channels)
+        x = F.conv2d(x, weight_y.view(-1, 1, ky, 1), groups=batch_size * channels)
+        return x.view(batch_size, channels, height, width)
+
+
+class BatchColorJitter(object):
+    """Batched equivalent of transforms.ColorJitter(brightness=...) with a random factor per image"""
+
+    def __init__(self, brightness: float, bound: float = 255.0) -> None:
+        """
+        Args:
+            brightness (float): factors are drawn from [max(0, 1 - brightness), 1 + brightness]
+            bound (float): maximum intensity of the images
+        """
+        self.brightness = (max(0.0, 1 - brightness), 1 + brightness)
+        self.bound = bound
+
+    def __call__(self, images: torch.Tensor) -> torch.Tensor:
+        factor = torch.empty(images.shape[0], device=images.device, dtype=images.dtype).uniform_(*self.brightness)
+        return (images * factor.view(-1, 1, 1, 1)).clamp(0, self.bound)
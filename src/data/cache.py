@@ -0,0 +1,113 @@
+"""
+This module contains a feature cache that lives in shared memory so that every
+DataLoader worker, and every epoch, reads and fills the same copy of the hot
+features. The cache is split into fixed size slots holding up to ``max_rows``
+feature vectors each and is bounded by a byte budget. When it is full, the
+least recently used slot is evicted.
+
+The cache has to be constructed in the parent process, before the DataLoader
+starts its workers. Worker processes inherit the shared tensors on fork and
+receive handles to them when the dataset is pickled under spawn.
+"""
+import multiprocessing
+from typing import Optional, Tuple
+
+import torch
+
+# indices into the shared counter tensor
+_CLOCK, _HITS, _MISSES, _EVICTIONS = range(4)
+
+
+class SharedFeatureCache(object):
+    """Byte bounded LRU cache of feature tensors shared between processes
+
+    Keys are integers in [0, num_keys), e.g. the position of an image in a dataset's
+    sorted id list, so the lookup table can be a flat shared tensor instead of a dict.
+    """
+
+    def __init__(
+        self,
+        num_keys: int,
+        entry_shape: Tuple[int, int],
+        max_bytes: int,
+        dtype: torch.dtype = torch.float32,
+    ) -> None:
+        """
+        Args:
+            num_keys (int): number of distinct keys
+            entry_shape (tuple): (max_rows, feature_size) of the largest entry
+            max_bytes (int): memory budget of the cached features
+            dtype (torch.dtype): dtype of the cached features
+        """
+        max_rows, feature_size = entry_shape
+        entry_bytes = max_rows * feature_size * torch.empty((), dtype=dtype).element_size()
+        num_slots = int(min(num_keys, max_bytes // entry_bytes))
+        if num_slots < 1:
+            raise ValueError(f"Cache budget of {max_bytes} bytes cannot hold a {entry_bytes} byte entry")
+        self.num_slots = num_slots
+        self.entry_bytes = entry_bytes
+        self.data = torch.empty((num_slots, max_rows, feature_size), dtype=dtype).share_memory_()
+        self.rows = torch.zeros(num_slots, dtype=torch.int32).share_memory_()
+        self.owner = torch.full((num_slots,), -1, dtype=torch.int64).share_memory_()
+        self.last_used = torch.zeros(num_slots, dtype=torch.int64).share_memory_()
+        self.slot_of = torch.full((num_keys,), -1, dtype=torch.int64).share_memory_()
+        self.counters = torch.zeros(4, dtype=torch.int64).share_memory_()
+        self.lock = multiprocessing.Lock()
+
+    def _touch(self, slot: int) -> None:
+        self.counters[_CLOCK] += 1
+        self.last_used[slot] = self.counters[_CLOCK]
+
+    def get(self, key: int) -> Optional[torch.Tensor]:
+        """Returns a copy of the cached features of key or None on a miss"""
+        with self.lock:
+            slot = int(self.slot_of[key])
+            if slot < 0:
+                self.counters[_MISSES] += 1
+                return None
+            self.counters[_HITS] += 1
+            self._touch(slot)
+            # copy while holding the lock, the slot may be reused as soon as it is released
+            return self.data[slot, : int(self.rows[slot])].clone()
+
+    def put(self, key: int, features: torch.Tensor) -> None:
+        """Stores the features of key, evicting the least recently used entry if the cache is full"""
+        rows = min(features.shape[0], self.data.shape[1])
+        with self.lock:
+            slot = int(self.slot_of[key])
+            if slot < 0:
+                slot = int(torch.argmin(self.last_used))
+                evicted = int(self.owner[slot])
+                if evicted >= 0:
+                    self.slot_of[evicted] = -1
+                    self.counters[_EVICTIONS] += 1
+                self.owner[slot] = key
+                self.slot_of[key] = slot
+            self.data[slot, :rows] = features[:rows]
+            self.rows[slot] = rows
+            self._touch(slot)
+
+    def __contains__(self, key: int) -> bool:
+        return int(self.slot_of[key]) >= 0
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counts across all processes using the cache"""
+        hits = int(self.counters[_HITS])
+        misses = int(self.counters[_MISSES])
+        return {
+            "hits": hits,
+            "misses": misses,
+            "evictions": int(self.counters[_EVICTIONS]),
+            "hit_rate": hits / max(hits + misses, 1),
+            "entries": int((self.owner >= 0).sum()),
+            "capacity": self.num_slots,
+            "bytes": self.num_slots * self.entry_bytes,
+        }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.slot_of.fill_(-1)
+            self.owner.fill_(-1)
+            self.last_used.zero_()
+            self.rows.zero_()
+            self.counters.zero_()
@@ -0,0 +1,153 @@
+"""
+This module contains the consolidated caption index for a Flickr30K exdir archive.
+Instead of storing the tokenized captions of every image as YAML attributes, each
+split gets one binary file in the archive's ``caption_index`` raw directory holding
+
+ - a token matrix of shape (num_captions, max_cap_len)
+ - the length of every caption
+ - the image ids and the offsets of their first caption row
+ - the word map
+
+Loading a split is then a single file read instead of one archive open and
+YAML parse per image.
+"""
+import os
+from typing import Dict, List, NoReturn
+
+import exdir
+import numpy as np
+from tqdm import tqdm
+
+INDEX_DIRECTORY = "caption_index"
+
+
+def index_path(root: str, mode: str) -> str:
+    return os.path.join(root, INDEX_DIRECTORY, f"{mode}.npz")
+
+
+def has_caption_index(root: str, mode: str) -> bool:
+    return os.path.exists(index_path(root, mode))
+
+
+class CaptionIndex(object):
+    """In-memory caption index for one split
+
+    Attributes:
+        ids (list): image ids in storage order
+        offsets (np.ndarray): caption row of the first caption of every image, with a trailing end offset
+        tokens (np.ndarray): token matrix of shape (num_captions, max_cap_len)
+        lengths (np.ndarray): number of words of every caption (excluding <start> and <end>)
+        word_map (dict): token to id map
+        max_cap_len (int): padded caption length
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        offsets: np.ndarray,
+        tokens: np.ndarray,
+        lengths: np.ndarray,
+        word_map: Dict[str, int],
+        max_cap_len: int,
+    ) -> None:
+        self.ids = ids
+        self.offsets = offsets
+        self.tokens = tokens
+        self.lengths = lengths
+        self.word_map = word_map
+        self.max_cap_len = max_cap_len
+
+    @classmethod
+    def load(cls, root: str, mode: str) -> "CaptionIndex":
+        with open(index_path(root, mode), "rb") as f:
+            data = dict(np.load(f))
+        word_map = {str(w): int(t) for w, t in zip(data["words"], data["word_ids"])}
+        return cls(
+            [str(img_id) for img_id in data["ids"]],
+            data["offsets"],
+            data["tokens"],
+            data["lengths"],
+            word_map,
+            int(data["max_cap_len"]),
+        )
+
+    @classmethod
+    def from_captions(
+        cls,
+        captions: Dict[str, list],
+        lengths: Dict[str, list],
+        word_map: Dict[str, int],
+        max_cap_len: int,
+    ) -> "CaptionIndex":
+        """Builds an index from per image lists of tokenized captions and caption lengths"""
+        ids = list(captions.keys())
+        counts = np.array([len(captions[img_id]) for img_id in ids], dtype=np.int64)
+        offsets = np.zeros(len(ids) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        dtype = np.int16 if len(word_map) < 2**15 else np.int32
+        tokens = np.full((int(offsets[-1]), max_cap_len), word_map["<pad>"], dtype=dtype)
+        caption_lengths = np.zeros(int(offsets[-1]), dtype=np.int16)
+        for i, img_id in enumerate(ids):
+            for j, (cap, length) in enumerate(zip(captions[img_id], lengths[img_id])):
+                tokens[offsets[i] + j, : len(cap)] = cap
+                caption_lengths[offsets[i] + j] = length
+        return cls(ids, offsets, tokens, caption_lengths, word_map, max_cap_len)
+
+    def extend(self, other: "CaptionIndex") -> "CaptionIndex":
+        """Index with the images of another index of the same word map appended after the existing ones"""
+        offsets = np.concatenate([self.offsets, other.offsets[1:] + self.offsets[-1]])
+        return CaptionIndex(
+            self.ids + other.ids,
+            offsets,
+            np.concatenate([self.tokens, other.tokens.astype(self.tokens.dtype)]),
+            np.concatenate([self.lengths, other.lengths.astype(self.lengths.dtype)]),
+            self.word_map,
+            self.max_cap_len,
+        )
+
+    def save(self, root: str, mode: str) -> NoReturn:
+        os.makedirs(os.path.dirname(index_path(root, mode)), exist_ok=True)
+        words = list(self.word_map.keys())
+        # replaced atomically, readers never see a partially written index
+        temporary = os.path.join(root, INDEX_DIRECTORY, f"{mode}.tmp.npz")
+        np.savez(
+            temporary,
+            ids=np.array(self.ids),
+            offsets=self.offsets,
+            tokens=self.tokens,
+            lengths=self.lengths,
+            words=np.array(words),
+            word_ids=np.array([self.word_map[w] for w in words], dtype=np.int64),
+            max_cap_len=np.array(self.max_cap_len),
+        )
+        os.replace(temporary, index_path(root, mode))
+
+    def captions(self, i: int) -> np.ndarray:
+        """Token matrix of the captions of the i-th image"""
+        return self.tokens[self.offsets[i] : self.offsets[i + 1]]
+
+    def caption_lengths(self, i: int) -> np.ndarray:
+        return self.lengths[self.offsets[i] : self.offsets[i + 1]]
+
+
+def write_caption_index(root: str, mode: str, disable_progress_bar: bool = False) -> CaptionIndex:
+    """Builds the caption index of a legacy archive from its per image attributes
+    Args:
+        root (str): path to the exdir archive
+        mode (str): split to index (train, valid, or test)
+        disable_progress_bar (bool): hide the progress bar
+    Returns:
+        (CaptionIndex): the index that was written
+    """
+    archive = exdir.File(root, mode="r")
+    group = archive.require_group(mode)
+    captions = {}
+    lengths = {}
+    for img_id in tqdm(sorted(group.keys()), desc=f"Indexing {mode} captions", disable=disable_progress_bar):
+        attrs = group[img_id].attrs
+        captions[img_id] = attrs["captions"]
+        lengths[img_id] = attrs["lengths"]
+    word_map = archive.attrs["word_map"].to_dict()
+    index = CaptionIndex.from_captions(captions, lengths, word_map, archive.attrs["max_cap_len"])
+    index.save(root, mode)
+    return index
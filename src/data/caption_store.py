@@ -0,0 +1,144 @@
+"""
+This module contains the in-memory caption store of the Flickr30K datasets.
+
+The captions of a split are held in a few NumPy arrays instead of dicts and lists
+of Python ints:
+
+ - a token matrix of shape (num_captions, max_cap_len)
+ - the length of every caption and the image position of every caption
+ - the sorted image ids as one fixed width string array and the offsets of their first caption
+
+Forked DataLoader workers reading Python objects update their reference counts,
+which makes the OS copy every page the objects live on, so the memory of every
+worker grows over an epoch until it holds a copy of the captions. Reading rows of
+NumPy arrays touches no reference counts, the pages stay shared, and the store
+pickles as a handful of buffers when workers are spawned instead of forked.
+
+Samples are read through CaptionRecord, a __slots__ record holding views of the
+arrays. CaptionMapping and CaptionPairs give the dict and list interface of the
+former annotations, lengths and ann_list attributes, building lists per access.
+"""
+from collections.abc import Mapping, Sequence
+from typing import Iterable, Iterator, Tuple
+
+import numpy as np
+
+from .caption_index import CaptionIndex
+
+
+class CaptionRecord(object):
+    """One caption of the store
+
+    Attributes:
+        img_id (str): image id
+        image (int): position of the image in the store
+        tokens (np.ndarray): view of the padded caption tokens
+        length (int): number of words of the caption (excluding <start> and <end>)
+    """
+
+    __slots__ = ("img_id", "image", "tokens", "length")
+
+    def __init__(self, img_id: str, image: int, tokens: np.ndarray, length: int) -> None:
+        self.img_id = img_id
+        self.image = image
+        self.tokens = tokens
+        self.length = length
+
+
+class CaptionStore(object):
+    """NumPy backed captions of one split, images are sorted by id"""
+
+    def __init__(self, ids: np.ndarray, offsets: np.ndarray, tokens: np.ndarray, lengths: np.ndarray) -> None:
+        """
+        Args:
+            ids (np.ndarray): sorted image ids
+            offsets (np.ndarray): caption row of the first caption of every image, with a trailing end offset
+            tokens (np.ndarray): token matrix of shape (num_captions, max_cap_len)
+            lengths (np.ndarray): number of words of every caption
+        """
+        self.ids = np.asarray(ids, dtype=str)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.tokens = tokens
+        self.lengths = lengths
+        self.images = np.repeat(np.arange(len(self.ids), dtype=np.int32), np.diff(self.offsets))
+
+    @classmethod
+    def from_index(cls, index: CaptionIndex, positions: Iterable[int]) -> "CaptionStore":
+        """Copies the captions of the images at the given positions of a caption index"""
+        positions = sorted(positions, key=lambda i: index.ids[i])
+        counts = np.array([index.offsets[i + 1] - index.offsets[i] for i in positions], dtype=np.int64)
+        offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)
+        rows = [np.arange(index.offsets[i], index.offsets[i + 1]) for i in positions]
+        rows = np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=np.int64)
+        ids = [index.ids[i] for i in positions]
+        return cls(ids, offsets, index.tokens[rows], index.lengths[rows])
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    @property
+    def num_images(self) -> int:
+        return len(self.ids)
+
+    def position(self, img_id: str) -> int:
+        """Position of an image, found by binary search in the sorted ids"""
+        i = int(np.searchsorted(self.ids, img_id))
+        if i == len(self.ids) or self.ids[i] != img_id:
+            raise KeyError(img_id)
+        return i
+
+    def __contains__(self, img_id: str) -> bool:
+        i = int(np.searchsorted(self.ids, img_id))
+        return i < len(self.ids) and self.ids[i] == img_id
+
+    def captions(self, image: int) -> np.ndarray:
+        """Token matrix of the captions of the image at a position"""
+        return self.tokens[self.offsets[image] : self.offsets[image + 1]]
+
+    def caption_lengths(self, image: int) -> np.ndarray:
+        return self.lengths[self.offsets[image] : self.offsets[image + 1]]
+
+    def record(self, index: int) -> CaptionRecord:
+        """The index-th caption of the store"""
+        image = int(self.images[index])
+        return CaptionRecord(str(self.ids[image]), image, self.tokens[index], int(self.lengths[index]))
+
+
+class CaptionMapping(Mapping):
+    """Read only dict view from image id to the token lists or lengths of its captions"""
+
+    def __init__(self, store: CaptionStore, lengths: bool = False) -> None:
+        self.store = store
+        self.lengths = lengths
+
+    def __getitem__(self, img_id: str) -> list:
+        image = self.store.position(img_id)
+        if self.lengths:
+            return self.store.caption_lengths(image).tolist()
+        return self.store.captions(image).tolist()
+
+    def __iter__(self) -> Iterator[str]:
+        return (str(img_id) for img_id in self.store.ids)
+
+    def __len__(self) -> int:
+        return self.store.num_images
+
+    def __contains__(self, img_id: object) -> bool:
+        return isinstance(img_id, str) and img_id in self.store
+
+
+class CaptionPairs(Sequence):
+    """Read only list view of (image id, token list) pairs, one per caption"""
+
+    def __init__(self, store: CaptionStore) -> None:
+        self.store = store
+
+    def __getitem__(self, index: int) -> Tuple[str, list]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        record = self.store.record(index)
+        return record.img_id, record.tokens.tolist()
+
+    def __len__(self) -> int:
+        return len(self.store)
@@ -0,0 +1,170 @@
+"""
+This module contains collate functions for the Flickr30K datasets. They are
+classes rather than closures so that they can be pickled into DataLoader workers.
+
+The feature collate functions also accept batches that Flickr30KFeatures.fetch_batch
+already stacked, which only need their padding trimmed or their features dequantized.
+"""
+from typing import Any, Callable, List, Optional, Tuple
+
+import torch
+import torchvision.transforms as transforms
+from torch.nn.utils.rnn import pad_sequence
+from torch.utils.data.dataloader import default_collate
+
+from .feature_store import dequantize
+
+
+class TrimPaddingCollate(object):
+    """Collates Flickr30KFeatures samples and removes the padding shared by the whole batch
+
+    Captions are cut after the last column holding a non <pad> token in any sample and
+    region features after the last detection that is non zero in any sample. With
+    BucketBatchSampler most batches then only carry the padding of their longest sample.
+    """
+
+    def __init__(self, pad_token: int) -> None:
+        self.pad_token = pad_token
+
+    def __call__(self, batch: List[Tuple[Any, Any, Any]]) -> Tuple[torch.Tensor, torch.Tensor, list]:
+        features, captions, img_ids = batch if is_stacked(batch) else default_collate(batch)
+        features = features[:, : last_used(features.abs().sum(-1) > 0, 1)].contiguous()
+        return features, self.trim_captions(captions), img_ids
+
+    def trim_captions(self, captions: torch.Tensor) -> torch.Tensor:
+        return captions[:, : last_used(captions != self.pad_token, captions.shape[1])].contiguous()
+
+
+class VariableLengthCollate(TrimPaddingCollate):
+    """Collates unpadded Flickr30KFeatures samples (pad_detections=False)
+
+    Region features are zero padded to the largest detection count of the batch and an
+    explicit padding mask is returned, so the encoder does not have to infer padding
+    from the feature values. Batches are (features, captions, img_ids, padding_mask)
+    where padding_mask is True at padded detections.
+    """
+
+    def __call__(self, batch: List[Tuple[Any, Any, Any]]) -> Tuple[torch.Tensor, torch.Tensor, list, torch.Tensor]:
+        if is_stacked(batch):
+            features, captions, img_ids, padding_mask = batch
+            return features, self.trim_captions(captions), img_ids, padding_mask
+        features, captions, img_ids = zip(*batch)
+        counts = torch.tensor([f.shape[0] for f in features])
+        features = pad_sequence(features, batch_first=True)
+        padding_mask = torch.arange(features.shape[1])[None, :] >= counts[:, None]
+        captions = self.trim_captions(torch.stack(captions))
+        return features, captions, list(img_ids), padding_mask
+
+
+class DequantizeCollate(object):
+    """Collates quantized Flickr30KFeatures samples (dequantize=False) and converts the batch to float32
+
+    Wraps another collate function, the features of its batches are dequantized once per batch.
+    """
+
+    def __init__(self, scale: Optional[torch.Tensor] = None, collate: Optional[Callable] = None) -> None:
+        """
+        Args:
+            scale (torch.Tensor, optional): per channel scales of an int8 store, see PackedFeatureStore.region_scale
+            collate (callable, optional): collate function building the batch. Defaults to default_collate.
+        """
+        self.scale = scale
+        self.collate = collate
+
+    def __call__(self, batch: List[tuple]) -> tuple:
+        if self.collate is not None:
+            batch = self.collate(batch)
+        elif not is_stacked(batch):
+            batch = default_collate(batch)
+        features, *rest = batch
+        return (dequantize(features, self.scale), *rest)
+
+
+def is_stacked(batch: Any) -> bool:
+    """Whether a batch was fetched stacked by Flickr30KFeatures.fetch_batch, per sample batches are lists"""
+    return isinstance(batch, tuple)
+
+
+def last_used(used: torch.Tensor, default: int) -> int:
+    """One past the last column of a (batch, columns) mask that is set in any row"""
+    columns = used.any(dim=0).nonzero()
+    if len(columns) == 0:
+        return default
+    return int(columns[-1]) + 1
+
+
+class NormalizeImageCollate(object):
+    """Collates Flickr30k samples holding uint8 images (image_store or batch_transforms)
+
+    The uint8 images are stacked first, then converted to float, augmented and normalized
+    once for the whole batch. Batches match the samples of Flickr30k without an image
+    store: (normalized images, caption, caption length, all captions, images).
+    """
+
+    def __init__(self, augment: Optional[Callable] = None) -> None:
+        """
+        Args:
+            augment (callable, optional): batched augmentation of (batch, 3, height, width) float images
+                with intensities in [0, 255], see data.batch_transforms
+        """
+        self.augment = augment
+        self.normalize = transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+
+    def __call__(self, batch: List[tuple]) -> tuple:
+        captions, lengths, all_captions = default_collate([sample[1:4] for sample in batch])
+        normalized, images = self.images(batch)
+        return normalized, captions, lengths, all_captions, images
+
+    def images(self, batch: List[tuple]) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Normalized and unnormalized float images of a batch of uint8 samples"""
+        # the first element of a uint8 sample is the same image, only stack it once
+        images = torch.stack([sample[4] for sample in batch]).float()
+        if self.augment is not None:
+            images = self.augment(images)
+        return self.normalize(images), images
+
+
+class ImageMajorCollate(object):
+    """Collates image major Flickr30k samples (image_major=True)
+
+    Every sample holds one image and all of its captions. Images are stacked once and
+    captions are flattened to one row per caption, so batches are
+    (images, captions, caption lengths, all captions, unnormalized images, image_index)
+    where image_index maps every caption row to its image. Encode the images once and
+    broadcast the result with ``encoded[image_index]``.
+    """
+
+    def __init__(self, image_collate: Optional[NormalizeImageCollate] = None) -> None:
+        """
+        Args:
+            image_collate (NormalizeImageCollate, optional): converts the images of uint8 samples
+                (image_store or batch_transforms)
+        """
+        self.image_collate = image_collate
+
+    def __call__(self, batch: List[tuple]) -> tuple:
+        counts = torch.tensor([len(sample[1]) for sample in batch])
+        image_index = torch.repeat_interleave(torch.arange(len(batch)), counts)
+        captions = torch.cat([sample[1] for sample in batch])
+        lengths = torch.cat([sample[2] for sample in batch])
+        # the references of an image are repeated for each of its caption rows
+        all_captions = torch.stack([sample[3] for sample in batch])[image_index]
+        if self.image_collate is not None:
+            normalized, images = self.image_collate.images(batch)
+        else:
+            normalized = torch.stack([sample[0] for sample in batch])
+            images = torch.stack([sample[4] for sample in batch])
+        return normalized, captions, lengths, all_captions, images, image_index
+
+
+def broadcast_images(encoded: torch.Tensor, batch: tuple) -> torch.Tensor:
+    """Expands the encoded images of an ImageMajorCollate batch to one row per caption
+    Args:
+        encoded (torch.Tensor): encoder output with one row per image of the batch
+        batch (tuple): the batch the images were taken from
+    Returns:
+        (torch.Tensor): encoder output with one row per caption, unchanged for other batches
+    """
+    if len(batch) < 6:
+        return encoded
+    return encoded[batch[5].to(encoded.device)]
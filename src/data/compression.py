@@ -0,0 +1,201 @@
+"""
+This module contains the lossless chunk compression of the packed feature store.
+
+A compressed store holds the features of ``chunk_images`` consecutive images per
+chunk. The bytes of every array are shuffled by significance before compression,
+so the mostly zero high order bytes of small activations compress to almost
+nothing. Chunks are decompressed by a thread pool (zlib, zstd and lz4 release the
+GIL) and kept in a least recently used cache of decompressed chunks, while the
+chunks following the one just read are decompressed ahead in the background.
+
+zlib is always available, zstd requires the zstandard package and lz4 the lz4
+package.
+"""
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+CODECS = ["zstd", "lz4", "zlib"]
+
+
+def check_codec(codec: str) -> None:
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec}, expected one of {CODECS}")
+    if codec == "zstd" and zstandard is None:
+        raise ImportError("zstd compression requires the zstandard package")
+    if codec == "lz4" and lz4 is None:
+        raise ImportError("lz4 compression requires the lz4 package")
+
+
+def compress(data: bytes, codec: str, level: Optional[int] = None) -> bytes:
+    """Compresses data with zstd, lz4, or zlib at the codec's default level unless given"""
+    check_codec(codec)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    if codec == "lz4":
+        return lz4.frame.compress(data, compression_level=0 if level is None else level)
+    return zlib.compress(data, 6 if level is None else level)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    check_codec(codec)
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "lz4":
+        return lz4.frame.decompress(data)
+    return zlib.decompress(data)
+
+
+def shuffle_bytes(array: np.ndarray) -> bytes:
+    """Groups the bytes of the elements of an array by significance"""
+    array = np.ascontiguousarray(array)
+    return array.view(np.uint8).reshape(-1, array.itemsize).T.tobytes()
+
+
+def unshuffle_bytes(data: bytes, dtype: np.dtype, shape: Tuple[int, ...], offset: int = 0) -> np.ndarray:
+    """Inverts shuffle_bytes for an array of dtype and shape starting at offset of data"""
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    grouped = np.frombuffer(data, dtype=np.uint8, count=size * dtype.itemsize, offset=offset)
+    # the copy is writable and C contiguous, so torch.from_numpy can share it
+    return grouped.reshape(dtype.itemsize, size).T.copy().view(dtype).reshape(shape)
+
+
+def encode_chunk(arrays: List[np.ndarray], codec: str, level: Optional[int] = None) -> bytes:
+    """Compresses the byte shuffled arrays of a chunk into one block"""
+    return compress(b"".join(shuffle_bytes(array) for array in arrays), codec, level)
+
+
+def decode_chunk(data: bytes, codec: str, dtype: np.dtype, shapes: List[Tuple[int, ...]]) -> List[np.ndarray]:
+    """Decompresses a block written by encode_chunk into arrays of the given shapes"""
+    raw = decompress(data, codec)
+    arrays, offset = [], 0
+    for shape in shapes:
+        arrays.append(unshuffle_bytes(raw, dtype, shape, offset))
+        offset += arrays[-1].nbytes
+    return arrays
+
+
+class ChunkCache(object):
+    """Thread safe least recently used cache of decompressed chunks
+
+    Misses are decoded by a thread pool, which also decodes the next readahead
+    chunks after every miss. The pool and the cached chunks belong to a single
+    process and are dropped when the cache is pickled into DataLoader workers.
+    """
+
+    def __init__(
+        self,
+        decode: Callable[[int], List[np.ndarray]],
+        num_chunks: int,
+        max_chunks: int = 32,
+        threads: int = 4,
+        readahead: int = 2,
+    ) -> None:
+        """
+        Args:
+            decode (callable): decodes the chunk with the given index
+            num_chunks (int): number of chunks
+            max_chunks (int): decompressed chunks kept in memory
+            threads (int): decompression threads
+            readahead (int): chunks decoded ahead of the last miss
+        """
+        self.decode = decode
+        self.num_chunks = num_chunks
+        self.max_chunks = max(max_chunks, 1)
+        self.threads = max(threads, 1)
+        self.readahead = min(readahead, self.max_chunks - 1)
+        self.hits = 0
+        self.misses = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        # reentrant: a future that is already done runs its callback in the submitting thread
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        self._chunks = OrderedDict()
+        self._pending: Dict[int, Future] = {}
+        self._pool = None
+
+    def _check_process(self) -> None:
+        # forked DataLoader workers inherit the pool object but not its threads
+        if self._pid != os.getpid():
+            self._reset()
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="decompress")
+        return self._pool
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def _store(self, index: int, future: Future) -> None:
+        with self._lock:
+            self._pending.pop(index, None)
+            if future.exception() is not None:
+                return
+            self._chunks[index] = future.result()
+            self._chunks.move_to_end(index)
+            while len(self._chunks) > self.max_chunks:
+                self._chunks.popitem(last=False)
+
+    def _submit(self, index: int) -> Future:
+        # expects the lock to be held
+        future = self._pending.get(index)
+        if future is None:
+            future = self.pool.submit(self.decode, index)
+            self._pending[index] = future
+            future.add_done_callback(lambda done: self._store(index, done))
+        return future
+
+    def get(self, index: int) -> List[np.ndarray]:
+        """Returns the arrays of a chunk, decoding it if it is not cached"""
+        self._check_process()
+        with self._lock:
+            chunk = self._chunks.get(index)
+            if chunk is not None:
+                self._chunks.move_to_end(index)
+                self.hits += 1
+                return chunk
+            self.misses += 1
+            future = self._submit(index)
+            for ahead in range(index + 1, min(index + 1 + self.readahead, self.num_chunks)):
+                if ahead not in self._chunks:
+                    self._submit(ahead)
+        return future.result()
+
+    def prefetch(self, indices: Iterable[int]) -> None:
+        """Decodes chunks in parallel and waits until they are cached"""
+        self._check_process()
+        indices = list(dict.fromkeys(indices))[: self.max_chunks]
+        with self._lock:
+            futures = [self._submit(i) for i in indices if i not in self._chunks]
+        for future in futures:
+            future.result()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for name in ["_lock", "_pid", "_chunks", "_pending", "_pool"]:
+            del state[name]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._reset()
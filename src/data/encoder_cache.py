@@ -0,0 +1,149 @@
+"""
+This module contains an on-disk cache of SATEncoder outputs.
+
+With a frozen backbone the annotation vectors of an image never change, so they are
+computed once and decoder-only epochs read them instead of running ResNet-152 on
+every image again. Caches are stored under a key derived from the backbone
+architecture, the input size and a hash of the weights, so changing any of them
+selects a different cache directory. Encoders with trainable backbone parameters
+(e.g. ``unfreeze_last > 0``) are not cacheable, see encoder_is_frozen.
+
+Layout of a cache directory::
+
+    <cache>/<key>/<mode>/annotations.npy  (num_images, height, width, channels) float32 or float16
+    <cache>/<key>/<mode>/index.npz        ids
+"""
+import hashlib
+import os
+from typing import List, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+ANNOTATION_FILE = "annotations.npy"
+INDEX_FILE = "index.npz"
+
+
+def encoder_is_frozen(encoder: nn.Module) -> bool:
+    """True if no parameter of the encoder is trained, the only case its outputs can be cached"""
+    return not any(param.requires_grad for param in encoder.parameters())
+
+
+def encoder_key(encoder: nn.Module, input_size: int = 224) -> str:
+    """Cache key of an encoder: hash of its architecture, input size and weights"""
+    digest = hashlib.sha1(f"{encoder!r}|{input_size}".encode())
+    for name, tensor in encoder.state_dict().items():
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+def cache_directory(path: str, encoder: nn.Module, input_size: int = 224) -> str:
+    """Directory of the cache of an encoder below the cache root path"""
+    return os.path.join(path, encoder_key(encoder, input_size))
+
+
+def has_encoder_cache(path: str, mode: str, ids: Optional[List[str]] = None) -> bool:
+    """True if the split of a cache is complete and, when given, holds every id"""
+    # the index is written last, a cache without one is incomplete
+    index_file = os.path.join(path, mode, INDEX_FILE)
+    if not os.path.exists(index_file):
+        return False
+    if ids is None:
+        return True
+    return set(ids).issubset(str(img_id) for img_id in np.load(index_file)["ids"])
+
+
+class EncoderCache(object):
+    """Read only view over a single split of an encoder cache
+
+    Like PackedFeatureStore, the memory map is opened lazily and is not pickled into
+    DataLoader workers.
+    """
+
+    def __init__(self, path: str, mode: str = "test") -> None:
+        self.path = path
+        self.mode = mode
+        self.split_dir = os.path.join(path, mode)
+        index = np.load(os.path.join(self.split_dir, INDEX_FILE))
+        self.ids = [str(img_id) for img_id in index["ids"]]
+        self.positions = {img_id: i for i, img_id in enumerate(self.ids)}
+        self._annotations = None
+
+    @property
+    def annotations(self) -> np.ndarray:
+        if self._annotations is None:
+            self._annotations = np.load(os.path.join(self.split_dir, ANNOTATION_FILE), mmap_mode="c")
+        return self._annotations
+
+    def __contains__(self, img_id: str) -> bool:
+        return img_id in self.positions
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def annotation(self, img_id: str) -> np.ndarray:
+        """Returns a zero copy (height, width, channels) view of the encoder output of an image"""
+        return self.annotations[self.positions[img_id]]
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_annotations"] = None
+        return state
+
+
+@torch.no_grad()
+def write_encoder_cache(
+    encoder: nn.Module,
+    data: Dataset,
+    path: str,
+    batch_size: int = 32,
+    num_workers: int = 0,
+    fp16: bool = False,
+    device: str = "cpu",
+    disable_progress_bar: bool = False,
+) -> str:
+    """Runs the encoder once over every image of a split and stores its outputs
+    Args:
+        encoder (nn.Module): frozen SATEncoder, run in eval mode
+        data (Flickr30k): image major dataset (image_major=True) of the split to encode, without augmentation
+        path (str): cache directory of the encoder, see cache_directory
+        batch_size (int): images per forward pass
+        num_workers (int): DataLoader workers decoding images
+        fp16 (bool): store float16 instead of float32 annotation vectors
+        device (str): device the encoder runs on
+        disable_progress_bar (bool): hide the progress bar
+    Returns:
+        (str): path, for chaining with EncoderCache
+    """
+    if not encoder_is_frozen(encoder):
+        raise ValueError("only encoders without trainable parameters can be cached")
+    if not data.image_major:
+        raise ValueError("the dataset must be image major")
+    mode = data.mode
+    loader = DataLoader(data, batch_size=batch_size, num_workers=num_workers, collate_fn=data.collate_fn())
+    split_dir = os.path.join(path, mode)
+    os.makedirs(split_dir, exist_ok=True)
+    was_training = encoder.training
+    encoder.eval()
+    annotations = None
+    position = 0
+    for batch in tqdm(loader, desc=f"Encoding {mode} images", disable=disable_progress_bar):
+        encoded = encoder(batch[0].to(device)).cpu().numpy()
+        if annotations is None:
+            annotations = np.lib.format.open_memmap(
+                os.path.join(split_dir, ANNOTATION_FILE),
+                mode="w+",
+                dtype=np.float16 if fp16 else np.float32,
+                shape=(len(data), *encoded.shape[1:]),
+            )
+        annotations[position : position + len(encoded)] = encoded
+        position += len(encoded)
+    encoder.train(was_training)
+    if annotations is not None:
+        annotations.flush()
+    np.savez(os.path.join(split_dir, INDEX_FILE), ids=np.array(data.ids))
+    return path
@@ -0,0 +1,149 @@
+"""
+This module contains the feature extraction of the Flickr30KFeatures datasets.
+
+Images are decoded, resized and normalized by DataLoader workers and streamed in
+batches through a torchvision ResNet. One forward pass yields both feature kinds:
+
+ - global features: the average pooled output of the last stage (2048 for ResNet-50/101/152)
+ - region features: a grid_size x grid_size grid of average pooled cells of an intermediate
+   stage (1024 for layer3 of ResNet-50/101/152), one feature vector per cell
+
+The grid stands in for the detections of the bottom up attention model used to
+build the original archive, which needs detectron2. Features are appended to a
+packed feature store batch by batch, images already in the store are skipped, so
+an interrupted run resumes and new images are processed incrementally.
+"""
+import os
+from typing import List, Tuple
+
+import torch
+import torch.nn as nn
+import torchvision.models as models
+import torchvision.transforms as transforms
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+from .feature_store import FeatureStoreWriter
+
+BACKBONES = ["resnet18", "resnet34", "resnet50", "resnet101", "resnet152"]
+REGION_LAYERS = ["layer3", "layer4"]
+
+
+class FeatureExtractor(nn.Module):
+    """Frozen ResNet returning the global and the grid region features of a batch of images"""
+
+    def __init__(
+        self, backbone: str = "resnet152", pretrained: bool = True, region_layer: str = "layer3", grid_size: int = 7
+    ) -> None:
+        """
+        Args:
+            backbone (str): torchvision ResNet, see BACKBONES
+            pretrained (bool): load the ImageNet weights
+            region_layer (str): stage the region features are pooled from, "layer3" or "layer4"
+            grid_size (int): region features are a grid_size x grid_size grid of cells
+        """
+        super().__init__()
+        if backbone not in BACKBONES or region_layer not in REGION_LAYERS:
+            raise ValueError(f"Unsupported backbone {backbone} or region layer {region_layer}")
+        resnet = getattr(models, backbone)(weights="DEFAULT" if pretrained else None)
+        self.stem = nn.Sequential(
+            resnet.conv1, resnet.bn1, resnet.relu, resnet.maxpool, resnet.layer1, resnet.layer2, resnet.layer3
+        )
+        self.layer4 = resnet.layer4
+        self.region_layer = region_layer
+        self.grid = nn.AdaptiveAvgPool2d(grid_size)
+        self.global_size = resnet.fc.in_features
+        # layer3 has half the channels of layer4 in every ResNet
+        self.region_size = self.global_size if region_layer == "layer4" else self.global_size // 2
+        for param in self.parameters():
+            param.requires_grad = False
+        self.eval()
+
+    def forward(self, images: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Args:
+            images (torch.Tensor): normalized images of shape (batch_size, 3, height, width)
+        Returns:
+            (torch.Tensor, torch.Tensor): global features (batch_size, global_size) and
+                region features (batch_size, grid_size ** 2, region_size)
+        """
+        intermediate = self.stem(images)
+        last = self.layer4(intermediate)
+        global_features = last.mean(dim=(2, 3))
+        regions = self.grid(intermediate if self.region_layer == "layer3" else last)
+        return global_features, regions.flatten(2).transpose(1, 2)
+
+
+class ImageFiles(Dataset):
+    """Decodes, resizes and normalizes image files for the feature extractor"""
+
+    def __init__(self, image_dir: str, ids: List[str], image_size: int = 224) -> None:
+        """
+        Args:
+            image_dir (str): directory of the image files, named by image id
+            ids (list): image ids to load
+            image_size (int): images are resized to image_size x image_size
+        """
+        self.image_dir = image_dir
+        self.ids = ids
+        self.transform = transforms.Compose(
+            [
+                transforms.Resize((image_size, image_size)),
+                transforms.ToTensor(),
+                transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+            ]
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, i: int) -> torch.Tensor:
+        with Image.open(os.path.join(self.image_dir, self.ids[i])) as image:
+            return self.transform(image.convert("RGB"))
+
+
+@torch.no_grad()
+def extract_features(
+    extractor: FeatureExtractor,
+    image_dir: str,
+    ids: List[str],
+    path: str,
+    mode: str,
+    batch_size: int = 64,
+    num_workers: int = 0,
+    image_size: int = 224,
+    device: str = "cpu",
+    quantization: str = "float32",
+    disable_progress_bar: bool = False,
+) -> FeatureStoreWriter:
+    """Extracts the features of the images of a split that are missing from a feature store
+    Args:
+        extractor (FeatureExtractor): backbone computing the features
+        image_dir (str): directory of the image files
+        ids (list): image ids of the split
+        path (str): directory of the feature store
+        mode (str): split (train, valid, or test)
+        batch_size (int): images per forward pass and per append to the store
+        num_workers (int): DataLoader workers decoding images
+        image_size (int): images are resized to image_size x image_size
+        device (str): device the extractor runs on
+        quantization (str): "float32" or "float16" features for new stores
+        disable_progress_bar (bool): hide the progress bar
+    Returns:
+        (FeatureStoreWriter): writer of the split, for chaining
+    """
+    writer = FeatureStoreWriter(path, mode, extractor.region_size, extractor.global_size, quantization)
+    missing = [img_id for img_id in ids if img_id not in writer]
+    loader = DataLoader(
+        ImageFiles(image_dir, missing, image_size),
+        batch_size=batch_size,
+        num_workers=num_workers,
+        pin_memory=torch.device(device).type == "cuda",
+    )
+    extractor = extractor.to(device)
+    for b, images in enumerate(tqdm(loader, desc=f"Extracting {mode} features", disable=disable_progress_bar)):
+        global_features, regions = extractor(images.to(device, non_blocking=True))
+        batch_ids = missing[b * batch_size : b * batch_size + len(images)]
+        writer.append(batch_ids, list(regions.cpu().numpy()), global_features.cpu().numpy())
+    return writer
@@ -0,0 +1,458 @@
+"""
+This module contains a packed, memory-mapped store for the precomputed image
+features used by the transformer models. Every split is written as one
+contiguous array of region features, one array of global features, and an
+offsets/length index. Reading an image's detections is then a slice of a
+memory map instead of an open of a small exdir file, and the OS page cache
+backing the map is shared by every DataLoader worker.
+
+Features can be stored quantized to float16 or to int8 with one symmetric scale
+per feature channel, halving or quartering the bytes read per sample. Quantized
+features are converted back to float32 with PackedFeatureStore.dequantize.
+
+Independently of quantization, a store can be compressed losslessly in chunks of
+consecutive images with zstd, lz4 or zlib, see data.compression. Compressed
+stores replace the two feature files with a single chunk file.
+
+Uncompressed stores can grow: FeatureStoreWriter appends the features of new
+images to the end of the feature files and replaces the index afterwards.
+
+Layout of a store directory::
+
+    <store>/<mode>/region_features.npy  (total_detections, region_size) float32, float16 or int8
+    <store>/<mode>/global_features.npy  (num_images, global_size) float32, float16 or int8
+    <store>/<mode>/index.npz            ids, offsets, counts, quantization and int8 channel scales
+    <store>/<mode>/chunks.bin           compressed chunks of region and global features, located
+                                        by the chunk offsets in the index
+"""
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, NoReturn, Optional, Tuple
+
+import exdir
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from .compression import ChunkCache, check_codec, decode_chunk, encode_chunk
+
+REGION_FILE = "region_features.npy"
+GLOBAL_FILE = "global_features.npy"
+INDEX_FILE = "index.npz"
+CHUNK_FILE = "chunks.bin"
+QUANTIZATIONS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+class PackedFeatureStore(object):
+    """Read only view over a single split of a packed feature store.
+
+    The memory maps are opened lazily and are dropped when the store is pickled,
+    so each DataLoader worker maps the files itself rather than receiving a copy
+    of the data from the parent process. Chunks of compressed stores are
+    decompressed by every worker itself as well.
+    """
+
+    def __init__(
+        self, path: str, mode: str = "test", cache_chunks: int = 32, threads: int = 4, readahead: int = 2
+    ) -> None:
+        """
+        Args:
+            path (str): directory of the feature store
+            mode (str): split (train, valid, or test)
+            cache_chunks (int): decompressed chunks kept in memory by compressed stores
+            threads (int): decompression threads of compressed stores
+            readahead (int): chunks decompressed ahead of the chunk read last
+        """
+        self.path = path
+        self.mode = mode
+        self.split_dir = os.path.join(path, mode)
+        index = np.load(os.path.join(self.split_dir, INDEX_FILE))
+        self.ids = [str(img_id) for img_id in index["ids"]]
+        self.offsets = index["offsets"]
+        self.counts = index["counts"]
+        # stores written before quantization was added hold float32 features
+        self.quantization = str(index["quantization"]) if "quantization" in index else "float32"
+        self.region_scale = None
+        self.global_scale = None
+        if self.quantization == "int8":
+            self.region_scale = torch.from_numpy(index["region_scale"])
+            self.global_scale = torch.from_numpy(index["global_scale"])
+        self.positions = {img_id: i for i, img_id in enumerate(self.ids)}
+        self._region_features = None
+        self._global_features = None
+        self._chunk_file = None
+        self.codec = str(index["codec"]) if "codec" in index else None
+        self.chunks = None
+        if self.codec is not None:
+            check_codec(self.codec)
+            self.chunk_images = int(index["chunk_images"])
+            self.chunk_offsets = index["chunk_offsets"]
+            self.feature_sizes = (int(index["region_size"]), int(index["global_size"]))
+            num_chunks = len(self.chunk_offsets) - 1
+            self.chunks = ChunkCache(self._decode_chunk, num_chunks, cache_chunks, threads, readahead)
+
+    def _open(self, name: str) -> np.ndarray:
+        # copy-on-write maps give writable arrays (torch.from_numpy does not warn)
+        # while pages are still shared with every other process mapping the file
+        return np.load(os.path.join(self.split_dir, name), mmap_mode="c")
+
+    @property
+    def region_features(self) -> np.ndarray:
+        if self._region_features is None:
+            self._region_features = self._open(REGION_FILE)
+        return self._region_features
+
+    @property
+    def global_features(self) -> np.ndarray:
+        if self._global_features is None:
+            self._global_features = self._open(GLOBAL_FILE)
+        return self._global_features
+
+    @property
+    def chunk_file(self) -> np.ndarray:
+        if self._chunk_file is None:
+            self._chunk_file = np.memmap(os.path.join(self.split_dir, CHUNK_FILE), dtype=np.uint8, mode="r")
+        return self._chunk_file
+
+    def _chunk_images(self, chunk: int) -> range:
+        return range(chunk * self.chunk_images, min((chunk + 1) * self.chunk_images, len(self.ids)))
+
+    def _decode_chunk(self, chunk: int) -> List[np.ndarray]:
+        images = self._chunk_images(chunk)
+        rows = int(self.counts[images].sum())
+        data = self.chunk_file[self.chunk_offsets[chunk] : self.chunk_offsets[chunk + 1]]
+        shapes = [(rows, self.feature_sizes[0]), (len(images), self.feature_sizes[1])]
+        return decode_chunk(data, self.codec, QUANTIZATIONS[self.quantization], shapes)
+
+    def prefetch(self, img_ids: List[str]) -> NoReturn:
+        """Decompresses the chunks holding the given images in parallel, a no-op for uncompressed stores"""
+        if self.chunks is not None:
+            self.chunks.prefetch(self.positions[img_id] // self.chunk_images for img_id in img_ids)
+
+    def __contains__(self, img_id: str) -> bool:
+        return img_id in self.positions
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def region(self, img_id: str) -> np.ndarray:
+        """Returns a zero copy view of the region features of an image
+        Args:
+            img_id (str): image identifier
+        Returns:
+            (np.ndarray): array of shape (num_detections, region_size)
+        """
+        i = self.positions[img_id]
+        if self.chunks is not None:
+            chunk = i // self.chunk_images
+            start = self.offsets[i] - self.offsets[chunk * self.chunk_images]
+            return self.chunks.get(chunk)[0][start : start + self.counts[i]]
+        start = self.offsets[i]
+        return self.region_features[start : start + self.counts[i]]
+
+    def global_(self, img_id: str) -> np.ndarray:
+        """Returns a zero copy view of the global feature vector of an image"""
+        i = self.positions[img_id]
+        if self.chunks is not None:
+            return self.chunks.get(i // self.chunk_images)[1][i % self.chunk_images]
+        return self.global_features[i]
+
+    def dequantize(self, features: torch.Tensor, feature_mode: str = "region") -> torch.Tensor:
+        """Converts (batches of) stored features back to float32
+        Args:
+            features (torch.Tensor): features read from the store, channels in the last dimension
+            feature_mode (str): "region" or "global" features
+        Returns:
+            (torch.Tensor): float32 features
+        """
+        return dequantize(features, self.region_scale if feature_mode == "region" else self.global_scale)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_region_features"] = None
+        state["_global_features"] = None
+        state["_chunk_file"] = None
+        return state
+
+
+def dequantize(features: torch.Tensor, scale: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """float32 features from float16 features or int8 features with per channel scales"""
+    if scale is None:
+        return features.float()
+    return features.float() * scale.to(features.device)
+
+
+def channel_scale(max_abs: np.ndarray) -> np.ndarray:
+    """Symmetric int8 scale of every channel: the largest magnitude of the channel maps to 127"""
+    return np.where(max_abs > 0, max_abs / 127, 1).astype(np.float32)
+
+
+def quantize(features: np.ndarray, dtype: type, scale: Optional[np.ndarray] = None) -> np.ndarray:
+    if scale is None:
+        return features.astype(dtype)
+    return np.clip(np.rint(features / scale), -127, 127).astype(np.int8)
+
+
+def split_ids(root: str, mode: str) -> List[str]:
+    """Lists the valid image ids of an exdir split in a deterministic order"""
+    archive = exdir.File(root, mode="r")
+    valid_ids = archive.attrs["valid_ids"]
+    group = archive.require_group(mode)
+    return sorted(set(group.keys()).intersection(set(valid_ids)))
+
+
+def write_feature_store(
+    root: str,
+    path: str,
+    mode: str,
+    ids: Optional[List[str]] = None,
+    disable_progress_bar: bool = False,
+    quantization: str = "float32",
+    compression: Optional[str] = None,
+    chunk_images: int = 64,
+    level: Optional[int] = None,
+    threads: int = 4,
+) -> NoReturn:
+    """Packs the region and global features of an exdir split into a feature store
+    Args:
+        root (str): path to the exdir archive holding the features
+        path (str): directory of the feature store
+        mode (str): split to convert (train, valid, or test)
+        ids (list, optional): image ids to pack. Defaults to every valid id in the split.
+        disable_progress_bar (bool): hide the progress bars
+        quantization (str): "float32", "float16", or "int8" with per channel scales computed over the split
+        compression (str, optional): "zstd", "lz4", or "zlib" to compress chunks of images losslessly
+        chunk_images (int): images per compressed chunk
+        level (int, optional): compression level. Defaults to the codec's default.
+        threads (int): compression threads
+    """
+    dtype = QUANTIZATIONS[quantization]
+    if compression is not None:
+        check_codec(compression)
+    if ids is None:
+        ids = split_ids(root, mode)
+    group = exdir.File(root, mode="r").require_group(mode)
+    split_dir = os.path.join(path, mode)
+    os.makedirs(split_dir, exist_ok=True)
+
+    # first pass only reads the array headers to size the output files
+    counts = np.zeros(len(ids), dtype=np.int64)
+    for i, img_id in enumerate(tqdm(ids, desc=f"Indexing {mode} features", disable=disable_progress_bar)):
+        counts[i] = group[img_id]["region_features"].shape[0]
+    offsets = np.zeros(len(ids), dtype=np.int64)
+    offsets[1:] = np.cumsum(counts)[:-1]
+    region_size = group[ids[0]]["region_features"].shape[1]
+    global_size = group[ids[0]]["global_features"].shape[-1]
+
+    scales = {}
+    region_scale = global_scale = None
+    if quantization == "int8":
+        # int8 needs the range of every channel before the first image is written
+        region_max = np.zeros(region_size, dtype=np.float32)
+        global_max = np.zeros(global_size, dtype=np.float32)
+        for img_id in tqdm(ids, desc=f"Scaling {mode} features", disable=disable_progress_bar):
+            region_max = np.maximum(region_max, np.abs(group[img_id]["region_features"][:]).max(axis=0, initial=0))
+            global_max = np.maximum(global_max, np.abs(np.reshape(group[img_id]["global_features"][:], -1)))
+        region_scale = channel_scale(region_max)
+        global_scale = channel_scale(global_max)
+        scales = {"region_scale": region_scale, "global_scale": global_scale}
+
+    def read(img_id: str) -> Tuple[np.ndarray, np.ndarray]:
+        region = quantize(group[img_id]["region_features"][:], dtype, region_scale)
+        return region, quantize(np.reshape(group[img_id]["global_features"][:], -1), dtype, global_scale)
+
+    progress = tqdm(ids, desc=f"Packing {mode} features", disable=disable_progress_bar)
+    if compression is None:
+        regions = np.lib.format.open_memmap(
+            os.path.join(split_dir, REGION_FILE), mode="w+", dtype=dtype, shape=(int(counts.sum()), region_size)
+        )
+        globals_ = np.lib.format.open_memmap(
+            os.path.join(split_dir, GLOBAL_FILE), mode="w+", dtype=dtype, shape=(len(ids), global_size)
+        )
+        for i, img_id in enumerate(progress):
+            regions[offsets[i] : offsets[i] + counts[i]], globals_[i] = read(img_id)
+        regions.flush()
+        globals_.flush()
+        del regions, globals_
+        chunks = {}
+    else:
+        chunk_offsets = _write_chunks(
+            os.path.join(split_dir, CHUNK_FILE), ids, read, progress, compression, chunk_images, level, threads
+        )
+        chunks = {
+            "codec": np.array(compression),
+            "chunk_images": np.array(chunk_images),
+            "chunk_offsets": chunk_offsets,
+            "region_size": np.array(region_size),
+            "global_size": np.array(global_size),
+        }
+    np.savez(
+        os.path.join(split_dir, INDEX_FILE),
+        ids=np.array(ids),
+        offsets=offsets,
+        counts=counts,
+        quantization=np.array(quantization),
+        **scales,
+        **chunks,
+    )
+
+
+def _write_chunks(
+    path: str,
+    ids: List[str],
+    read: Callable[[str], Tuple[np.ndarray, np.ndarray]],
+    progress: tqdm,
+    codec: str,
+    chunk_images: int,
+    level: Optional[int],
+    threads: int,
+) -> np.ndarray:
+    """Compresses chunks in a thread pool while the next chunks are read, returns their byte offsets"""
+    offsets = [0]
+    pending = deque()
+    with open(path, "wb") as f, ThreadPoolExecutor(max(threads, 1)) as pool:
+
+        def write(future: Future) -> None:
+            data = future.result()
+            f.write(data)
+            offsets.append(offsets[-1] + len(data))
+
+        for start in range(0, len(ids), chunk_images):
+            features = [read(img_id) for img_id in ids[start : start + chunk_images]]
+            progress.update(len(features))
+            regions, globals_ = zip(*features)
+            arrays = [np.concatenate(regions), np.stack(globals_)]
+            pending.append(pool.submit(encode_chunk, arrays, codec, level))
+            # bounds the chunks held in memory
+            while len(pending) > 2 * threads:
+                write(pending.popleft())
+        while pending:
+            write(pending.popleft())
+    progress.close()
+    return np.array(offsets, dtype=np.int64)
+
+
+def _header_length(path: str) -> int:
+    with open(path, "rb") as f:
+        np.lib.format.read_magic(f)
+        np.lib.format.read_array_header_1_0(f)
+        return f.tell()
+
+
+def _write_header(path: str, shape: Tuple[int, int], dtype: np.dtype, length: Optional[int] = None) -> int:
+    """Writes a version 1.0 npy header of a fixed length in place, the data behind it is kept"""
+    header = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": shape})
+    if length is None:
+        # room for the row count to grow, aligned like the headers numpy writes
+        length = 64 * ((len(header) + 32 + 11 + 63) // 64)
+    if len(header) + 11 > length:
+        raise ValueError(f"The header of {path} has no room for shape {shape}")
+    header = header.ljust(length - 11) + "\n"
+    with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+        f.write(b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + header.encode("latin1"))
+    return length
+
+
+class FeatureStoreWriter(object):
+    """Appends the features of new images to a split of an uncompressed feature store
+
+    Rows are appended to the end of the feature files and the index is replaced
+    afterwards, so readers opening the store only see complete images and rows left
+    behind by an interrupted append are dropped when the writer is reopened. Appends
+    to int8 stores reuse the channel scales of the store.
+    """
+
+    def __init__(self, path: str, mode: str, region_size: int, global_size: int, quantization: str = "float32") -> None:
+        """
+        Args:
+            path (str): directory of the feature store
+            mode (str): split (train, valid, or test)
+            region_size (int): size of the region feature vectors
+            global_size (int): size of the global feature vectors
+            quantization (str): "float32" or "float16" for new stores, existing stores keep theirs
+        """
+        self.split_dir = os.path.join(path, mode)
+        self.files = [os.path.join(self.split_dir, REGION_FILE), os.path.join(self.split_dir, GLOBAL_FILE)]
+        self.sizes = (region_size, global_size)
+        self.scales = {}
+        os.makedirs(self.split_dir, exist_ok=True)
+        if os.path.exists(os.path.join(self.split_dir, INDEX_FILE)):
+            index = dict(np.load(os.path.join(self.split_dir, INDEX_FILE)))
+            if "codec" in index:
+                raise ValueError("Compressed feature stores can't be appended to")
+            self.ids = [str(img_id) for img_id in index["ids"]]
+            self.counts = list(index["counts"])
+            self.quantization = str(index["quantization"]) if "quantization" in index else "float32"
+            if self.quantization == "int8":
+                self.scales = {"region_scale": index["region_scale"], "global_scale": index["global_scale"]}
+            self.headers = [_header_length(name) for name in self.files]
+            self._truncate()
+        else:
+            if quantization == "int8":
+                raise ValueError("int8 stores need channel scales, write them with write_feature_store")
+            self.ids, self.counts, self.quantization = [], [], quantization
+            self.headers = [_write_header(name, (0, size), self.dtype) for name, size in zip(self.files, self.sizes)]
+        self.positions = {img_id: i for i, img_id in enumerate(self.ids)}
+
+    @property
+    def dtype(self) -> type:
+        return QUANTIZATIONS[self.quantization]
+
+    def _rows(self) -> Tuple[int, int]:
+        return int(sum(self.counts)), len(self.ids)
+
+    def _truncate(self) -> NoReturn:
+        # drops rows of an append that did not update the index
+        itemsize = np.dtype(self.dtype).itemsize
+        for name, header, rows, size in zip(self.files, self.headers, self._rows(), self.sizes):
+            _write_header(name, (rows, size), self.dtype, header)
+            with open(name, "r+b") as f:
+                f.truncate(header + rows * size * itemsize)
+
+    def __contains__(self, img_id: str) -> bool:
+        return img_id in self.positions
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def append(self, ids: List[str], regions: List[np.ndarray], globals_: np.ndarray) -> NoReturn:
+        """Appends the features of images that are not in the store yet
+        Args:
+            ids (list): image ids
+            regions (list): (num_detections, region_size) region features of every image
+            globals_ (np.ndarray): (num_images, global_size) global features
+        """
+        new = [i for i, img_id in enumerate(ids) if img_id not in self.positions]
+        if len(new) == 0:
+            return
+        region_scale, global_scale = self.scales.get("region_scale"), self.scales.get("global_scale")
+        region = np.concatenate([regions[i] for i in new]).reshape(-1, self.sizes[0])
+        region = quantize(region, self.dtype, region_scale)
+        global_ = quantize(np.asarray(globals_)[new].reshape(-1, self.sizes[1]), self.dtype, global_scale)
+        for name, data in zip(self.files, [region, global_]):
+            with open(name, "ab") as f:
+                f.write(np.ascontiguousarray(data).tobytes())
+        for i in new:
+            self.positions[ids[i]] = len(self.ids)
+            self.ids.append(ids[i])
+            self.counts.append(len(regions[i]))
+        for name, header, rows, size in zip(self.files, self.headers, self._rows(), self.sizes):
+            _write_header(name, (rows, size), self.dtype, header)
+        self._write_index()
+
+    def _write_index(self) -> NoReturn:
+        counts = np.array(self.counts, dtype=np.int64)
+        offsets = np.zeros(len(counts), dtype=np.int64)
+        offsets[1:] = np.cumsum(counts)[:-1]
+        # replaced atomically, readers never see an index ahead of the feature files
+        temporary = os.path.join(self.split_dir, "index.tmp.npz")
+        np.savez(
+            temporary,
+            ids=np.array(self.ids),
+            offsets=offsets,
+            counts=counts,
+            quantization=np.array(self.quantization),
+            **self.scales,
+        )
+        os.replace(temporary, os.path.join(self.split_dir, INDEX_FILE))
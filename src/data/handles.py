@@ -0,0 +1,86 @@
+"""
+This module contains the per process pool of open exdir archive handles.
+
+The datasets no longer keep an open archive group as an attribute. An exdir
+File caches the metadata of the objects it has read, and a handle opened in
+the parent process was pickled or forked into every DataLoader worker along
+with that state. The datasets instead look their group up in a small pool of
+handles owned by the current process: handles are opened on first use, reused
+by every later read, and the pool starts out empty after a fork, so workers
+never read through state inherited from the parent. Passing open_worker_handles
+as the worker_init_fn of a DataLoader opens the handles of the dataset when the
+worker starts instead of on its first sample.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import NoReturn
+
+import exdir
+from torch.utils.data import get_worker_info
+
+MAX_HANDLES = 8
+
+
+class ArchiveHandles(object):
+    """Least recently used pool of read only exdir groups, keyed by archive path and split"""
+
+    def __init__(self, max_handles: int = MAX_HANDLES) -> None:
+        """
+        Args:
+            max_handles (int): open groups kept by the process
+        """
+        self.max_handles = max_handles
+        self._reset()
+
+    def _reset(self) -> NoReturn:
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._groups = OrderedDict()
+        self.opened = 0
+
+    def group(self, root: str, mode: str) -> exdir.Group:
+        """Returns the open group of a split, opening the archive if the process has no handle for it"""
+        if self._pid != os.getpid():
+            # forked: handles of the parent are never used by the child
+            self._reset()
+        key = (os.path.abspath(root), mode)
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                group = exdir.File(root, mode="r").require_group(mode)
+                self.opened += 1
+            self._groups[key] = group
+            self._groups.move_to_end(key)
+            while len(self._groups) > self.max_handles:
+                self._groups.popitem(last=False)
+            return group
+
+    def clear(self) -> NoReturn:
+        with self._lock:
+            self._groups.clear()
+
+    def __len__(self) -> int:
+        return len(self._groups) if self._pid == os.getpid() else 0
+
+    def __getstate__(self) -> dict:
+        return {"max_handles": self.max_handles}
+
+    def __setstate__(self, state: dict) -> NoReturn:
+        self.max_handles = state["max_handles"]
+        self._reset()
+
+
+handles = ArchiveHandles()
+
+
+def archive_group(root: str, mode: str) -> exdir.Group:
+    """Open group of a split from the handle pool of the current process"""
+    return handles.group(root, mode)
+
+
+def open_worker_handles(worker_id: int) -> NoReturn:
+    """worker_init_fn that opens the archive handles of the worker's dataset when the worker starts"""
+    info = get_worker_info()
+    if info is not None and hasattr(info.dataset, "open_handles"):
+        info.dataset.open_handles()
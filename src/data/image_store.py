@@ -0,0 +1,200 @@
+"""
+This module contains a packed, memory-mapped store of pre-resized Flickr30K images.
+Every image of a split is resized to 256x256, center cropped to 224x224 and written
+as a (3, 224, 224) uint8 array into one contiguous file, so the datasets no longer
+resize full resolution images on every access and read a quarter of the bytes of
+a float image.
+
+A split can also hold an augmentation bank written by write_augmentation_bank:
+a fixed number of augmented variants of every image, computed once with the
+batched augmentations of data.batch_transforms. AugmentedFlickrDataset then
+samples one variant per access instead of augmenting every sample on the CPU
+in every epoch.
+
+Layout of a store directory::
+
+    <store>/<mode>/images.npy    (num_images, 3, crop, crop) uint8
+    <store>/<mode>/variants.npy  (num_images, num_variants, 3, crop, crop) uint8, optional
+    <store>/<mode>/index.npz     ids
+"""
+import os
+from typing import Callable, List, NoReturn, Optional
+
+import exdir
+import numpy as np
+import torch
+from PIL import Image
+from tqdm import tqdm
+
+from .jpeg import decode_image
+
+IMAGE_FILE = "images.npy"
+VARIANT_FILE = "variants.npy"
+INDEX_FILE = "index.npz"
+RESIZE = 256
+CROP = 224
+
+
+def resize_and_crop(image: Image.Image, size: int = RESIZE, crop: int = CROP) -> np.ndarray:
+    """Applies the Resize((size, size)) and CenterCrop(crop) of the Flickr30k transform
+    Returns:
+        (np.ndarray): uint8 array of shape (3, crop, crop)
+    """
+    image = image.convert("RGB").resize((size, size), Image.BILINEAR)
+    left = (size - crop) // 2
+    image = image.crop((left, left, left + crop, left + crop))
+    return np.asarray(image, dtype=np.uint8).transpose(2, 0, 1)
+
+
+class PackedImageStore(object):
+    """Read only view over a single split of a packed image store
+
+    Like PackedFeatureStore, the memory map is opened lazily and is not pickled into
+    DataLoader workers.
+    """
+
+    def __init__(self, path: str, mode: str = "test") -> None:
+        self.path = path
+        self.mode = mode
+        self.split_dir = os.path.join(path, mode)
+        index = np.load(os.path.join(self.split_dir, INDEX_FILE))
+        self.ids = [str(img_id) for img_id in index["ids"]]
+        self.positions = {img_id: i for i, img_id in enumerate(self.ids)}
+        self._images = None
+        self._variants = None
+
+    @property
+    def images(self) -> np.ndarray:
+        if self._images is None:
+            self._images = np.load(os.path.join(self.split_dir, IMAGE_FILE), mmap_mode="c")
+        return self._images
+
+    @property
+    def variants(self) -> Optional[np.ndarray]:
+        """Augmentation bank of the split, None if it has none"""
+        if self._variants is None and os.path.exists(os.path.join(self.split_dir, VARIANT_FILE)):
+            self._variants = np.load(os.path.join(self.split_dir, VARIANT_FILE), mmap_mode="c")
+        return self._variants
+
+    @property
+    def num_variants(self) -> int:
+        """Augmented variants per image, 0 without an augmentation bank"""
+        return 0 if self.variants is None else self.variants.shape[1]
+
+    def __contains__(self, img_id: str) -> bool:
+        return img_id in self.positions
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def image(self, img_id: str) -> np.ndarray:
+        """Returns a zero copy (3, crop, crop) uint8 view of an image"""
+        return self.images[self.positions[img_id]]
+
+    def variant(self, img_id: str, k: int) -> np.ndarray:
+        """Returns a zero copy (3, crop, crop) uint8 view of the k-th augmented variant of an image"""
+        return self.variants[self.positions[img_id], k]
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_images"] = None
+        state["_variants"] = None
+        return state
+
+
+class ImageStoreWriter(object):
+    """Writes resized images of one split into a packed image store"""
+
+    def __init__(self, path: str, mode: str, ids: List[str], crop: int = CROP, resume: bool = False) -> None:
+        """
+        Args:
+            path (str): directory of the image store
+            mode (str): split (train, valid, or test)
+            ids (list): image ids of the split in storage order
+            crop (int): size of the stored images
+            resume (bool): keep the images of an unfinished store with the same ids instead of recreating it
+        """
+        self.split_dir = os.path.join(path, mode)
+        os.makedirs(self.split_dir, exist_ok=True)
+        self.ids = ids
+        self.positions = {img_id: i for i, img_id in enumerate(ids)}
+        image_file = os.path.join(self.split_dir, IMAGE_FILE)
+        shape = (len(ids), 3, crop, crop)
+        if resume and os.path.exists(image_file) and np.load(image_file, mmap_mode="r").shape == shape:
+            self.images = np.lib.format.open_memmap(image_file, mode="r+")
+        else:
+            self.images = np.lib.format.open_memmap(image_file, mode="w+", dtype=np.uint8, shape=shape)
+
+    def add(self, img_id: str, image: Image.Image) -> NoReturn:
+        self.write(img_id, resize_and_crop(image, crop=self.images.shape[-1]))
+
+    def write(self, img_id: str, image: np.ndarray) -> NoReturn:
+        """Stores an image already resized with resize_and_crop"""
+        self.images[self.positions[img_id]] = image
+
+    def flush(self) -> NoReturn:
+        self.images.flush()
+
+    def close(self) -> NoReturn:
+        self.images.flush()
+        self.images = None
+        np.savez(os.path.join(self.split_dir, INDEX_FILE), ids=np.array(self.ids))
+
+
+def write_image_store(
+    root: str, path: str, mode: str, ids: Optional[List[str]] = None, disable_progress_bar: bool = False
+) -> NoReturn:
+    """Packs the decoded images of an exdir split into an image store
+    Args:
+        root (str): path to the exdir archive written by project1_preprocess_data.py
+        path (str): directory of the image store
+        mode (str): split to convert (train, valid, or test)
+        ids (list, optional): image ids to pack. Defaults to every image in the split.
+        disable_progress_bar (bool): hide the progress bar
+    """
+    group = exdir.File(root, mode="r").require_group(mode)
+    if ids is None:
+        ids = sorted(group.keys())
+    writer = ImageStoreWriter(path, mode, ids)
+    for img_id in tqdm(ids, desc=f"Packing {mode} images", disable=disable_progress_bar):
+        writer.add(img_id, Image.fromarray(np.asarray(decode_image(group[img_id][:], RESIZE), dtype=np.uint8)))
+    writer.close()
+
+
+def write_augmentation_bank(
+    path: str,
+    mode: str,
+    augment: Callable[[torch.Tensor], torch.Tensor],
+    num_variants: int = 4,
+    batch_size: int = 64,
+    seed: int = 0,
+    disable_progress_bar: bool = False,
+) -> NoReturn:
+    """Writes augmented variants of every image of a split of an image store
+    Args:
+        path (str): directory of the image store written by pack_images.py
+        mode (str): split (train, valid, or test)
+        augment (callable): batched augmentation of (batch, 3, crop, crop) float images with intensities
+            in [0, 255], see data.batch_transforms
+        num_variants (int): augmented variants per image
+        batch_size (int): images augmented at once
+        seed (int): seed of the augmentations, the bank is reproducible
+        disable_progress_bar (bool): hide the progress bar
+    """
+    store = PackedImageStore(path, mode)
+    images = store.images
+    # written next to the store and renamed when complete, readers never see a partial bank
+    temporary = os.path.join(store.split_dir, "variants.tmp.npy")
+    shape = (len(images), num_variants) + images.shape[1:]
+    variants = np.lib.format.open_memmap(temporary, mode="w+", dtype=np.uint8, shape=shape)
+    with torch.random.fork_rng(devices=[]):
+        torch.manual_seed(seed)
+        batches = range(0, len(images), batch_size)
+        for start in tqdm(batches, desc=f"Augmenting {mode} images", disable=disable_progress_bar):
+            batch = torch.from_numpy(np.asarray(images[start : start + batch_size])).float()
+            for k in range(num_variants):
+                augmented = augment(batch).round().clamp(0, 255).to(torch.uint8)
+                variants[start : start + len(batch), k] = augmented.numpy()
+    variants.flush()
+    del variants
+    os.replace(temporary, os.path.join(store.split_dir, VARIANT_FILE))
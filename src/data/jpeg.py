@@ -0,0 +1,86 @@
+"""
+This module contains the JPEG image format of the exdir archive.
+
+Archives written with project1_preprocess_data.py --image_format jpeg keep the
+encoded bytes of every Flickr30K JPEG as a one dimensional uint8 dataset instead
+of the decoded (height, width, 3) array, which makes the archive several times
+smaller and the reads several times shorter. Images are decoded when a sample
+is loaded, with PIL's draft mode decoding the JPEG at a reduced scale that is
+still at least the decode size, so the DCT of the skipped resolution is never
+computed. Decoded arrays found in the archive are returned as they are, so both
+formats can be read by the same code.
+
+DecodePool decodes the images of a batch with a few threads per process; PIL
+releases the GIL while decoding.
+"""
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, NoReturn, Optional
+
+import numpy as np
+from PIL import Image
+
+IMAGE_FORMATS = ["array", "jpeg"]
+DECODE_SIZE = 256
+
+
+def read_encoded(path: str) -> np.ndarray:
+    """Encoded bytes of an image file as a uint8 array"""
+    with open(path, "rb") as f:
+        return np.frombuffer(f.read(), dtype=np.uint8)
+
+
+def is_encoded(image: np.ndarray) -> bool:
+    return image.ndim == 1
+
+
+def open_encoded(image: np.ndarray, size: Optional[int] = DECODE_SIZE) -> Image.Image:
+    """Opens encoded bytes, JPEGs are decoded at the smallest scale with both sides of at least size"""
+    image = Image.open(io.BytesIO(image.tobytes()))
+    if size is not None:
+        image.draft("RGB", (size, size))
+    return image.convert("RGB")
+
+
+def decode_image(image: np.ndarray, size: Optional[int] = DECODE_SIZE) -> np.ndarray:
+    """Decoded (height, width, 3) uint8 image of an archive dataset
+    Args:
+        image (np.ndarray): encoded bytes, or an already decoded image which is returned as it is
+        size (int, optional): JPEGs are decoded at a reduced scale with both sides of at least size pixels.
+            None decodes at full resolution.
+    Returns:
+        (np.ndarray): decoded image
+    """
+    if not is_encoded(image):
+        return image
+    return np.asarray(open_encoded(image, size))
+
+
+class DecodePool(object):
+    """Threads decoding the images of a batch, created by every process on first use"""
+
+    def __init__(self, threads: int = 0) -> None:
+        """
+        Args:
+            threads (int): decode threads, 0 decodes in the calling thread
+        """
+        self.threads = threads
+        self._pool = None
+        self._pid = None
+
+    def map(self, decode: Callable, items: Iterable) -> List:
+        items = list(items)
+        if self.threads <= 0 or len(items) <= 1:
+            return [decode(item) for item in items]
+        if self._pool is None or self._pid != os.getpid():
+            # threads are not inherited by forked DataLoader workers
+            self._pool = ThreadPoolExecutor(self.threads)
+            self._pid = os.getpid()
+        return list(self._pool.map(decode, items))
+
+    def __getstate__(self) -> dict:
+        return {"threads": self.threads}
+
+    def __setstate__(self, state: dict) -> NoReturn:
+        self.__init__(state["threads"])
@@ -0,0 +1,143 @@
+"""
+This module contains a prefetching wrapper around a DataLoader.
+
+A background thread keeps the next few batches ready while the model works on the
+current one. On CUDA devices the batches are pinned and copied to the device on a
+separate stream, so the host to device transfer overlaps with the training step.
+On CPU only hosts the thread still overlaps waiting for the DataLoader workers and
+the collate work of the main process with the step. The time the training loop
+spent blocked on the next batch is reported as wait_time.
+"""
+import queue
+import threading
+import time
+from typing import Any, Iterable, Iterator, Optional
+
+import torch
+
+_END = object()
+
+
+def move_to_device(batch: Any, device: torch.device, non_blocking: bool = False, pin_memory: bool = False) -> Any:
+    """Moves every tensor of a (nested) batch to a device, other values are returned unchanged"""
+    if isinstance(batch, torch.Tensor):
+        if pin_memory and batch.device.type == "cpu":
+            batch = batch.pin_memory()
+        return batch.to(device, non_blocking=non_blocking)
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(move_to_device(value, device, non_blocking, pin_memory) for value in batch)
+    if isinstance(batch, dict):
+        return {key: move_to_device(value, device, non_blocking, pin_memory) for key, value in batch.items()}
+    return batch
+
+
+def _record_stream(batch: Any, stream: "torch.cuda.Stream") -> None:
+    # tensors created on the copy stream are used on the compute stream
+    if isinstance(batch, torch.Tensor):
+        if batch.is_cuda:
+            batch.record_stream(stream)
+    elif isinstance(batch, (list, tuple)):
+        for value in batch:
+            _record_stream(value, stream)
+    elif isinstance(batch, dict):
+        for value in batch.values():
+            _record_stream(value, stream)
+
+
+class Prefetcher(object):
+    """Iterates a DataLoader while a background thread stages the next batches on the device
+
+    Usage::
+
+        loader = Prefetcher(DataLoader(...), device, num_batches=2)
+        for epoch in range(epochs):
+            for batch in loader:
+                ...
+            print(loader.wait_time)
+    """
+
+    def __init__(self, loader: Iterable, device: torch.device = "cpu", num_batches: int = 2) -> None:
+        """
+        Args:
+            loader (iterable): DataLoader or any iterable of batches
+            device (torch.device): device the batches are moved to
+            num_batches (int): batches kept ready ahead of the training loop
+        """
+        self.loader = loader
+        self.device = torch.device(device)
+        self.num_batches = max(num_batches, 1)
+        self.cuda = self.device.type == "cuda"
+        # statistics of the current or last epoch
+        self.wait_time = 0.0
+        self.batches = 0
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __getattr__(self, name: str) -> Any:
+        # expose dataset, batch_size, sampler, ... of the wrapped loader
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def stats(self) -> dict:
+        return {
+            "data_wait": self.wait_time,
+            "data_wait_per_batch": self.wait_time / max(self.batches, 1),
+        }
+
+    def _produce(self, staged: queue.Queue, stop: threading.Event, stream: Optional["torch.cuda.Stream"]) -> None:
+        try:
+            for batch in self.loader:
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = move_to_device(batch, self.device, non_blocking=True, pin_memory=True)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    batch = move_to_device(batch, self.device)
+                if not self._put(staged, stop, (batch, event)):
+                    return
+            self._put(staged, stop, _END)
+        except Exception as e:
+            self._put(staged, stop, e)
+
+    @staticmethod
+    def _put(staged: queue.Queue, stop: threading.Event, item: Any) -> bool:
+        # time out regularly so the thread exits when the training loop stops early
+        while not stop.is_set():
+            try:
+                staged.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __iter__(self) -> Iterator:
+        self.wait_time = 0.0
+        self.batches = 0
+        staged = queue.Queue(maxsize=self.num_batches)
+        stop = threading.Event()
+        stream = torch.cuda.Stream(self.device) if self.cuda else None
+        thread = threading.Thread(target=self._produce, args=(staged, stop, stream), daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = staged.get()
+                self.wait_time += time.perf_counter() - start
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                batch, event = item
+                if event is not None:
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(event)
+                    _record_stream(batch, current)
+                self.batches += 1
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,167 @@
+"""
+This module contains the single pass preprocessing of the raw Flickr30K data used by
+project1_preprocess_data.py.
+
+Images are decoded and their captions tokenized and lemmatized once, in a pool of
+worker processes, and the tokens are kept for building the word map and encoding
+the captions afterwards. Every lemmatizer caches the lemma of each distinct token.
+The tokens of every finished batch of images are appended to a progress log next
+to the archive, so an interrupted run continues after the last logged batch.
+"""
+import os
+import pickle
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterator, List, NoReturn, Optional, Tuple
+
+import numpy as np
+
+from .image_store import RESIZE, resize_and_crop
+from .jpeg import is_encoded, open_encoded
+
+TOPK = 1000
+SPLITS = {"train": 0.8, "valid": 0.15}
+PROGRESS_FILE = "preprocess_progress.pkl"
+
+# dataset and tokenizer of a worker process, see init_worker
+_worker = {}
+
+
+def assign_splits(img_ids: List[str]) -> Dict[str, str]:
+    """Maps every image id to its split: the first 80% train, the next 15% valid, and the rest test"""
+    num_train = int(len(img_ids) * SPLITS["train"])
+    num_valid = int(len(img_ids) * SPLITS["valid"])
+    splits = {}
+    for i, img_id in enumerate(img_ids):
+        splits[img_id] = "train" if i < num_train else "valid" if i < num_train + num_valid else "test"
+    return splits
+
+
+class CaptionTokenizer(object):
+    """Lower cases, tokenizes and lemmatizes captions, caching the lemma of every token"""
+
+    def __init__(
+        self, tokenize: Optional[Callable[[str], List[str]]] = None, lemmatize: Optional[Callable[[str], str]] = None
+    ) -> None:
+        """
+        Args:
+            tokenize (callable, optional): splits a caption into tokens. Defaults to nltk's word_tokenize.
+            lemmatize (callable, optional): lemma of a token. Defaults to nltk's WordNetLemmatizer.
+        """
+        if tokenize is None or lemmatize is None:
+            import nltk
+            from nltk.stem import WordNetLemmatizer
+
+            tokenize = tokenize or nltk.tokenize.word_tokenize
+            lemmatize = lemmatize or WordNetLemmatizer().lemmatize
+        self.tokenize = tokenize
+        self.lemmatize = lemmatize
+        self.lemmas = {}
+
+    def lemma(self, token: str) -> str:
+        lemma = self.lemmas.get(token)
+        if lemma is None:
+            lemma = self.lemmas[token] = self.lemmatize(token)
+        return lemma
+
+    def __call__(self, caption: str) -> List[str]:
+        return [self.lemma(token) for token in self.tokenize(caption.lower())]
+
+
+def init_worker(dataset: Any, tokenizer: Optional[CaptionTokenizer] = None, pack_images: bool = False) -> NoReturn:
+    """Initializer of the preprocessing pool, every process keeps its own dataset and lemma cache
+    Args:
+        dataset (torchvision.datasets.Flickr30k): raw dataset returning (image, captions)
+        tokenizer (CaptionTokenizer, optional): caption tokenizer. Defaults to the nltk tokenizer.
+        pack_images (bool): also return the resized image of the packed image store
+    """
+    _worker["dataset"] = dataset
+    _worker["tokenizer"] = tokenizer if tokenizer is not None else CaptionTokenizer()
+    _worker["pack_images"] = pack_images
+
+
+def load_example(i: int) -> Tuple[np.ndarray, Optional[np.ndarray], List[List[str]]]:
+    """Decodes the i-th image and tokenizes its captions in a worker process
+    Returns:
+        (tuple): decoded image or JPEG bytes, resized image or None, and tokenized captions
+    """
+    image, captions = _worker["dataset"][i]
+    tokenizer = _worker["tokenizer"]
+    tokens = [tokenizer(caption) for caption in captions]
+    if isinstance(image, np.ndarray) and is_encoded(image):
+        # JPEG bytes are stored as they are, only the packed image store needs the decoded image
+        resized = resize_and_crop(open_encoded(image, RESIZE)) if _worker["pack_images"] else None
+        return image, resized, tokens
+    resized = resize_and_crop(image) if _worker["pack_images"] else None
+    return np.asarray(image), resized, tokens
+
+
+def build_word_map(tokens: Iterator[List[str]], topk: int = TOPK) -> Tuple[Dict[str, int], int]:
+    """Word map of the topk most frequent tokens and the padded caption length
+    Args:
+        tokens (iterator): tokenized captions, in dataset order so ties keep the order of first occurrence
+        topk (int): vocabulary size without the special tokens
+    Returns:
+        (dict, int): token to id map and the longest caption plus <start> and <end>
+    """
+    words = defaultdict(lambda: 0)
+    max_caption_length = 0
+    for caption in tokens:
+        max_caption_length = max(max_caption_length, len(caption))
+        for token in caption:
+            words[token] += 1
+    word_freqs = sorted(words.items(), key=lambda x: x[1], reverse=True)
+    token_map = {token: i + 4 for i, (token, _) in enumerate(word_freqs[:topk])}
+    token_map["<start>"] = 0
+    token_map["<end>"] = 1
+    token_map["<unc>"] = 2
+    token_map["<pad>"] = 3
+    return token_map, max_caption_length + 2
+
+
+def encode_caption(tokens: List[str], token_map: Dict[str, int], max_caption_length: int) -> List[int]:
+    """Maps tokens to ids, uncommon words to <unc>, and adds <start>, <end> and padding"""
+    unknown = token_map["<unc>"]
+    encoded = [token_map["<start>"]] + [token_map.get(token, unknown) for token in tokens] + [token_map["<end>"]]
+    return encoded + [token_map["<pad>"]] * (max_caption_length - len(encoded))
+
+
+class ProgressLog(object):
+    """Append only log of the preprocessed images
+
+    Every record maps the image ids of one batch to their tokenized captions and is
+    appended after the batch's images were written. A record cut short by an
+    interruption is ignored when the log is read.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def read(self) -> Dict[str, List[List[str]]]:
+        """Returns the tokenized captions of every logged image"""
+        done = {}
+        if not self.exists():
+            return done
+        with open(self.path, "rb+") as f:
+            end = 0
+            while True:
+                try:
+                    done.update(pickle.load(f))
+                    end = f.tell()
+                except (EOFError, pickle.UnpicklingError):
+                    break
+            # drop a partial record so later records are not appended behind it
+            f.truncate(end)
+        return done
+
+    def append(self, batch: Dict[str, List[List[str]]]) -> NoReturn:
+        with open(self.path, "ab") as f:
+            pickle.dump(batch, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self) -> NoReturn:
+        if self.exists():
+            os.remove(self.path)
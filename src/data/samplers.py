@@ -0,0 +1,197 @@
+"""
+This module contains batch samplers for the Flickr30K datasets.
+
+The bucketing sampler groups samples with similar caption lengths and numbers
+of region detections into the same batch. Combined with a collate function that
+only pads to the longest sample of a batch, this removes most of the padding the
+models would otherwise process.
+
+Both samplers can resume in the middle of an epoch: resume(epoch, batches) makes
+the next iteration of that epoch skip the batches that were already trained on,
+see utils.ResumableSamplerCallback.
+"""
+import os
+from collections import defaultdict
+from typing import Iterator, List, NoReturn, Optional
+
+import exdir
+import numpy as np
+from torch.utils.data import Sampler
+from tqdm import tqdm
+
+STATISTICS_DIRECTORY = "sample_statistics"
+
+
+def statistics_path(root: str, mode: str) -> str:
+    return os.path.join(root, STATISTICS_DIRECTORY, f"{mode}.npz")
+
+
+def detection_counts(root: str, mode: str, ids: List[str], disable_progress_bar: bool = False) -> np.ndarray:
+    """Number of region detections of every image
+
+    The counts are read from the array headers in the archive once and stored in the
+    archive's sample_statistics directory so later runs only read one small file.
+    Args:
+        root (str): path to the exdir archive
+        mode (str): split (train, valid, or test)
+        ids (list): image ids to get counts for
+        disable_progress_bar (bool): hide the progress bar
+    Returns:
+        (np.ndarray): detection count of every id
+    """
+    path = statistics_path(root, mode)
+    counts = {}
+    if os.path.exists(path):
+        data = np.load(path)
+        counts = dict(zip([str(img_id) for img_id in data["ids"]], data["num_regions"].tolist()))
+    missing = [img_id for img_id in ids if img_id not in counts]
+    if len(missing) > 0:
+        group = exdir.File(root, mode="r").require_group(mode)
+        for img_id in tqdm(missing, desc=f"Counting {mode} detections", disable=disable_progress_bar):
+            counts[img_id] = group[img_id]["region_features"].shape[0]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        num_regions = np.array(list(counts.values()), dtype=np.int64)
+        np.savez(path, ids=np.array(list(counts.keys())), num_regions=num_regions)
+    return np.array([counts[img_id] for img_id in ids], dtype=np.int64)
+
+
+def _chunk(indices: np.ndarray, batch_size: int) -> List[np.ndarray]:
+    return [indices[i : i + batch_size] for i in range(0, len(indices), batch_size)]
+
+
+class BucketBatchSampler(Sampler):
+    """Batch sampler that groups samples by caption length and number of detections
+
+    Samples are assigned to buckets of ``length_bucket_width`` caption lengths and
+    ``region_bucket_width`` detections. Every epoch the samples are shuffled inside
+    their bucket, split into batches and the batches are shuffled.
+    """
+
+    def __init__(
+        self,
+        statistics: np.ndarray,
+        batch_size: int,
+        length_bucket_width: int = 2,
+        region_bucket_width: int = 10,
+        shuffle: bool = True,
+        drop_last: bool = False,
+        constant_batch_size: bool = True,
+        seed: int = 0,
+    ) -> None:
+        """
+        Args:
+            statistics (np.ndarray): (num_samples, 2) caption length and detection count of every sample,
+                see Flickr30k.sample_statistics
+            batch_size (int): samples per batch
+            length_bucket_width (int): caption lengths per bucket
+            region_bucket_width (int): detection counts per bucket
+            shuffle (bool): shuffle samples inside the buckets and the order of the batches
+            drop_last (bool): drop the final incomplete batch
+            constant_batch_size (bool): merge the incomplete batches of neighbouring buckets so that
+                every batch but the last one has batch_size samples
+            seed (int): base seed of the per epoch shuffles
+        """
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.constant_batch_size = constant_batch_size
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+        self.num_samples = len(statistics)
+
+        keys = np.stack(
+            [statistics[:, 0] // max(length_bucket_width, 1), statistics[:, 1] // max(region_bucket_width, 1)], axis=1
+        )
+        buckets = defaultdict(list)
+        for i, key in enumerate(map(tuple, keys.tolist())):
+            buckets[key].append(i)
+        # buckets are kept in key order so leftovers are merged with their neighbours
+        self.buckets = [np.array(buckets[key], dtype=np.int64) for key in sorted(buckets.keys())]
+
+    def set_epoch(self, epoch: int) -> NoReturn:
+        if epoch != self.epoch:
+            self.start_batch = 0
+        self.epoch = epoch
+
+    def resume(self, epoch: int, batches: int, batch_size: Optional[int] = None) -> NoReturn:
+        """Continues epoch after its first batches batches on the next iteration"""
+        self.epoch = epoch
+        self.start_batch = batches
+
+    def batches(self, epoch: Optional[int] = None) -> List[np.ndarray]:
+        """All batches of an epoch in the order they are yielded"""
+        rng = np.random.default_rng(self.seed + (self.epoch if epoch is None else epoch))
+        batches = []
+        leftovers = []
+        for bucket in self.buckets:
+            if self.shuffle:
+                bucket = rng.permutation(bucket)
+            full = len(bucket) - len(bucket) % self.batch_size
+            batches.extend(_chunk(bucket[:full], self.batch_size))
+            if full < len(bucket):
+                leftovers.append(bucket[full:])
+        if self.constant_batch_size and len(leftovers) > 0:
+            leftovers = np.concatenate(leftovers)
+            full = len(leftovers) - len(leftovers) % self.batch_size
+            batches.extend(_chunk(leftovers[:full], self.batch_size))
+            leftovers = [leftovers[full:]] if full < len(leftovers) else []
+        if not self.drop_last:
+            batches.extend(leftovers)
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self) -> Iterator[List[int]]:
+        batches = self.batches()[self.start_batch :]
+        self.epoch += 1
+        self.start_batch = 0
+        for batch in batches:
+            yield batch.tolist()
+
+    def __len__(self) -> int:
+        if self.constant_batch_size:
+            if self.drop_last:
+                return self.num_samples // self.batch_size
+            return -(-self.num_samples // self.batch_size)
+        if self.drop_last:
+            return sum(len(bucket) // self.batch_size for bucket in self.buckets)
+        return sum(-(-len(bucket) // self.batch_size) for bucket in self.buckets)
+
+
+class ResumableSampler(Sampler):
+    """Sequential or shuffled sampler over a map-style dataset that can resume mid-epoch"""
+
+    def __init__(self, num_samples: int, shuffle: bool = True, seed: int = 0) -> None:
+        """
+        Args:
+            num_samples (int): length of the dataset
+            shuffle (bool): visit the samples in a new random order every epoch
+            seed (int): base seed of the per epoch shuffles
+        """
+        self.num_samples = num_samples
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.start_index = 0
+
+    def set_epoch(self, epoch: int) -> NoReturn:
+        if epoch != self.epoch:
+            self.start_index = 0
+        self.epoch = epoch
+
+    def resume(self, epoch: int, batches: int, batch_size: Optional[int] = None) -> NoReturn:
+        """Continues epoch after its first batches batches of batch_size samples on the next iteration"""
+        self.epoch = epoch
+        self.start_index = batches * (batch_size or 1)
+
+    def __iter__(self) -> Iterator[int]:
+        order = np.arange(self.num_samples)
+        if self.shuffle:
+            order = np.random.default_rng(self.seed + self.epoch).permutation(order)
+        start = self.start_index
+        self.start_index = 0
+        return iter(order[start:].tolist())
+
+    def __len__(self) -> int:
+        return self.num_samples
@@ -0,0 +1,254 @@
+"""
+This module contains a sharded, streaming format of the Flickr30K feature datasets.
+
+The exporter writes the region features, global features, captions and ids of a
+split into shard files holding a fixed number of images each. Every shard is read
+with one sequential read, and each rank and DataLoader worker only reads its own
+shards, so several nodes training from a shared filesystem no longer open
+thousands of small exdir files each.
+
+Layout of a shard directory::
+
+    <shards>/<mode>/manifest.npz        shard names, image and caption counts, word map
+    <shards>/<mode>/shard-00000.npz     ids, region features and offsets, global features,
+                                        caption tokens, caption offsets and lengths
+"""
+import os
+from typing import Any, Dict, Iterator, List, NoReturn, Optional, Tuple
+
+import exdir
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+from tqdm import tqdm
+
+from .caption_index import CaptionIndex, has_caption_index
+from .feature_store import split_ids
+
+MANIFEST_FILE = "manifest.npz"
+
+
+def shard_name(i: int) -> str:
+    return f"shard-{i:05d}.npz"
+
+
+def _split_captions(root: str, mode: str) -> CaptionIndex:
+    if has_caption_index(root, mode):
+        return CaptionIndex.load(root, mode)
+    archive = exdir.File(root, mode="r")
+    group = archive.require_group(mode)
+    captions = {img_id: group[img_id].attrs["captions"] for img_id in group.keys()}
+    lengths = {img_id: group[img_id].attrs["lengths"] for img_id in group.keys()}
+    word_map = archive.attrs["word_map"].to_dict()
+    return CaptionIndex.from_captions(captions, lengths, word_map, archive.attrs["max_cap_len"])
+
+
+def write_shards(
+    root: str,
+    path: str,
+    mode: str,
+    images_per_shard: int = 1024,
+    ids: Optional[List[str]] = None,
+    disable_progress_bar: bool = False,
+) -> NoReturn:
+    """Exports the features and captions of an exdir split into shards
+    Args:
+        root (str): path to the exdir archive
+        path (str): directory of the shards
+        mode (str): split to export (train, valid, or test)
+        images_per_shard (int): images per shard, the last shard may hold fewer
+        ids (list, optional): image ids to export. Defaults to every valid image in the split.
+        disable_progress_bar (bool): hide the progress bar
+    """
+    group = exdir.File(root, mode="r").require_group(mode)
+    if ids is None:
+        ids = split_ids(root, mode)
+    index = _split_captions(root, mode)
+    positions = {img_id: i for i, img_id in enumerate(index.ids)}
+    ids = [img_id for img_id in ids if img_id in positions]
+    split_dir = os.path.join(path, mode)
+    os.makedirs(split_dir, exist_ok=True)
+
+    names, num_images, num_captions = [], [], []
+    starts = range(0, len(ids), images_per_shard)
+    for start in tqdm(starts, desc=f"Writing {mode} shards", disable=disable_progress_bar):
+        shard_ids = ids[start : start + images_per_shard]
+        region = [np.asarray(group[img_id]["region_features"][:], dtype=np.float32) for img_id in shard_ids]
+        global_ = [np.asarray(group[img_id]["global_features"][:], dtype=np.float32) for img_id in shard_ids]
+        captions = [index.captions(positions[img_id]) for img_id in shard_ids]
+        lengths = [index.caption_lengths(positions[img_id]) for img_id in shard_ids]
+        name = shard_name(len(names))
+        np.savez(
+            os.path.join(split_dir, name),
+            ids=np.array(shard_ids),
+            region_features=np.concatenate(region),
+            region_offsets=np.concatenate([[0], np.cumsum([len(r) for r in region])]),
+            global_features=np.stack(global_),
+            tokens=np.concatenate(captions),
+            caption_offsets=np.concatenate([[0], np.cumsum([len(c) for c in captions])]),
+            lengths=np.concatenate(lengths),
+        )
+        names.append(name)
+        num_images.append(len(shard_ids))
+        num_captions.append(sum(len(c) for c in captions))
+
+    words = list(index.word_map.keys())
+    np.savez(
+        os.path.join(split_dir, MANIFEST_FILE),
+        shards=np.array(names),
+        num_images=np.array(num_images, dtype=np.int64),
+        num_captions=np.array(num_captions, dtype=np.int64),
+        words=np.array(words),
+        word_ids=np.array([index.word_map[w] for w in words], dtype=np.int64),
+        max_cap_len=np.array(index.max_cap_len),
+    )
+
+
+def _distributed_rank() -> Tuple[int, int]:
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+class ShardedFlickr30KFeatures(IterableDataset):
+    """Streams the samples of Flickr30KFeatures from shards written by write_shards
+
+    Samples are (features, caption, img_id) like Flickr30KFeatures. Every epoch the shards
+    are permuted with the same seed on all ranks and dealt out to the ranks and then to the
+    DataLoader workers of each rank. Samples are shuffled with a buffer of shuffle_buffer
+    samples. Call set_epoch before every epoch to reseed, see utils.SetEpochCallback, and
+    resume to continue an epoch that was interrupted, see utils.ResumableSamplerCallback.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_detections: int,
+        mode: str = "train",
+        feature_mode: str = "global",
+        pad_detections: bool = True,
+        shuffle: bool = True,
+        shuffle_buffer: int = 4096,
+        seed: int = 0,
+        rank: Optional[int] = None,
+        world_size: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            path (str): directory of the shards
+            max_detections (int): number of region features returned per image
+            mode (str): split (train, valid, or test)
+            feature_mode (str): "region" or "global" features
+            pad_detections (bool): zero pad region features to max_detections
+            shuffle (bool): shuffle the shards and samples every epoch
+            shuffle_buffer (int): samples held in the shuffle buffer
+            seed (int): base seed of the per epoch shuffles
+            rank (int, optional): rank of this process. Defaults to the torch.distributed rank.
+            world_size (int, optional): number of processes. Defaults to the torch.distributed world size.
+        """
+        super().__init__()
+        self.path = path
+        self.mode = mode
+        self.max_detect = max_detections
+        self.feature_mode = feature_mode
+        self.pad_detections = pad_detections
+        self.shuffle = shuffle
+        self.shuffle_buffer = max(shuffle_buffer, 1)
+        self.seed = seed
+        self.epoch = 0
+        self.start_batch = 0
+        self.batch_size = None
+        self.rank = rank
+        self.world_size = world_size
+        self.split_dir = os.path.join(path, mode)
+        manifest = np.load(os.path.join(self.split_dir, MANIFEST_FILE))
+        self.shards = [str(name) for name in manifest["shards"]]
+        self.num_images = manifest["num_images"]
+        self.num_captions = manifest["num_captions"]
+        self.word_map = {str(w): int(t) for w, t in zip(manifest["words"], manifest["word_ids"])}
+        self.inv_word_map = {v: k for k, v in self.word_map.items()}
+        self.max_cap_len = int(manifest["max_cap_len"])
+
+    def set_epoch(self, epoch: int) -> NoReturn:
+        if epoch != self.epoch:
+            self.start_batch = 0
+        self.epoch = epoch
+
+    def resume(self, epoch: int, batches: int, batch_size: Optional[int] = None) -> NoReturn:
+        """Continues epoch after the first batches batches the DataLoader returned on the next iteration
+
+        The DataLoader takes batches from its workers in turn, so each worker skips the samples of
+        the batches it produced.
+        """
+        self.epoch = epoch
+        self.start_batch = batches
+        self.batch_size = batch_size
+
+    def _rank(self) -> Tuple[int, int]:
+        rank, world_size = _distributed_rank()
+        rank = rank if self.rank is None else self.rank
+        world_size = world_size if self.world_size is None else self.world_size
+        return rank, world_size
+
+    def assigned_shards(self, worker_id: int = 0, num_workers: int = 1) -> List[int]:
+        """Shards read by a worker of this rank in the current epoch"""
+        rank, world_size = self._rank()
+        order = np.arange(len(self.shards))
+        if self.shuffle:
+            # the same permutation on every rank so the shards are dealt out without overlap
+            order = np.random.default_rng(self.seed + self.epoch).permutation(order)
+        return order[rank::world_size][worker_id::num_workers].tolist()
+
+    def _read_shard(self, i: int) -> Dict[str, np.ndarray]:
+        with open(os.path.join(self.split_dir, self.shards[i]), "rb") as f:
+            return dict(np.load(f))
+
+    def _shard_samples(self, shard: Dict[str, np.ndarray]) -> Iterator[Tuple[Any, Any, Any]]:
+        region_offsets = shard["region_offsets"]
+        caption_offsets = shard["caption_offsets"]
+        for i, img_id in enumerate(shard["ids"]):
+            if self.feature_mode == "region":
+                start = region_offsets[i]
+                end = min(region_offsets[i + 1], start + self.max_detect)
+                features = torch.from_numpy(shard["region_features"][start:end])
+                if self.pad_detections and features.shape[0] < self.max_detect:
+                    padding = features.new_zeros((self.max_detect - features.shape[0], features.shape[1]))
+                    features = torch.cat([features, padding])
+            else:
+                features = torch.from_numpy(shard["global_features"][i])[None, :]
+            for caption in shard["tokens"][caption_offsets[i] : caption_offsets[i + 1]]:
+                yield features, torch.from_numpy(caption.astype(np.int64)), str(img_id)
+
+    def __iter__(self) -> Iterator[Tuple[Any, Any, Any]]:
+        worker = get_worker_info()
+        worker_id, num_workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+        # a new iterator takes its first batch from worker 0, which continues the part of the
+        # worker the next batch would have come from
+        worker_id = (worker_id + self.start_batch) % num_workers
+        shards = self.assigned_shards(worker_id, num_workers)
+        rng = np.random.default_rng([self.seed, self.epoch, self._rank()[0], worker_id])
+        skip = len(range(worker_id, self.start_batch, num_workers)) * (self.batch_size or 1)
+        self.start_batch = 0
+        for sample in self._samples(shards, rng):
+            if skip > 0:
+                skip -= 1
+                continue
+            yield sample
+
+    def _samples(self, shards: List[int], rng: np.random.Generator) -> Iterator[Tuple[Any, Any, Any]]:
+        buffer = []
+        for i in shards:
+            for sample in self._shard_samples(self._read_shard(i)):
+                if not self.shuffle:
+                    yield sample
+                    continue
+                if len(buffer) < self.shuffle_buffer:
+                    buffer.append(sample)
+                    continue
+                j = rng.integers(len(buffer))
+                yield buffer[j]
+                buffer[j] = sample
+        if self.shuffle:
+            for j in rng.permutation(len(buffer)):
+                yield buffer[j]
@@ -0,0 +1,136 @@
+"""
+This module contains small, materialized subsets of a Flickr30K exdir archive for
+smoke tests and fast development runs.
+
+A subset is an exdir archive of its own with the layout of the full archive: the
+images or features of a few images per split, their captions, the word map of the
+full archive and a caption index. Images are picked deterministically and
+stratified by caption length and, for feature archives, by the number of region
+detections, so a handful of images still covers short and long captions and few
+and many detections. Pass the subset's path to the datasets with the subset
+argument instead of using smoke_test or fast_test on the full archive.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import exdir
+import numpy as np
+from tqdm import tqdm
+
+from .caption_index import CaptionIndex, has_caption_index
+from .samplers import detection_counts
+
+
+def stratified_sample(keys: np.ndarray, size: int, bins: int = 4, seed: int = 0) -> np.ndarray:
+    """Draws a deterministic sample that keeps the distribution of the given keys
+    Args:
+        keys (np.ndarray): array of shape (num_items, num_keys), every key is split into bins quantile bins
+        size (int): number of items to draw
+        bins (int): bins per key
+        seed (int): seed of the draw within each stratum
+    Returns:
+        (np.ndarray): sorted positions of the drawn items
+    """
+    keys = np.asarray(keys, dtype=np.float64).reshape(len(keys), -1)
+    size = min(size, len(keys))
+    if size <= 0:
+        return np.zeros(0, dtype=np.int64)
+    strata = np.zeros(len(keys), dtype=np.int64)
+    for column in keys.T:
+        edges = np.unique(np.quantile(column, np.linspace(0, 1, bins + 1)[1:-1]))
+        strata = strata * bins + np.searchsorted(edges, column, side="right")
+    _, inverse, counts = np.unique(strata, return_inverse=True, return_counts=True)
+    # largest remainder allocation proportional to the size of every stratum
+    quota = size * counts / len(keys)
+    take = np.floor(quota).astype(np.int64)
+    remainders = np.argsort(take - quota, kind="stable")
+    take[remainders[: size - int(take.sum())]] += 1
+    rng = np.random.default_rng(seed)
+    selected = [rng.permutation(np.flatnonzero(inverse == s))[:n] for s, n in enumerate(take)]
+    return np.sort(np.concatenate(selected))
+
+
+def _read_captions(root: str, mode: str, group: exdir.Group, ids: List[str]) -> Tuple[Dict, Dict]:
+    captions = {}
+    lengths = {}
+    if has_caption_index(root, mode):
+        index = CaptionIndex.load(root, mode)
+        positions = {img_id: i for i, img_id in enumerate(index.ids)}
+        for img_id in ids:
+            captions[img_id] = index.captions(positions[img_id]).tolist()
+            lengths[img_id] = index.caption_lengths(positions[img_id]).tolist()
+    else:
+        for img_id in ids:
+            captions[img_id] = list(group[img_id].attrs["captions"])
+            lengths[img_id] = list(group[img_id].attrs["lengths"])
+    return captions, lengths
+
+
+def _copy(source, target: exdir.Group, name: str) -> None:
+    """Copies an image dataset or a group of feature datasets"""
+    if isinstance(source, exdir.core.Group):
+        copy = target.require_group(name)
+        for key in source.keys():
+            _copy(source[key], copy, key)
+    else:
+        target.require_dataset(name, data=source[:])
+
+
+def write_subset(
+    root: str,
+    path: str,
+    mode: str,
+    size: Optional[int] = 64,
+    fraction: Optional[float] = None,
+    bins: int = 4,
+    seed: int = 0,
+    disable_progress_bar: bool = False,
+) -> List[str]:
+    """Writes a stratified subset of an exdir split into a subset archive
+    Args:
+        root (str): path to the full exdir archive
+        path (str): path to the subset archive, created if it doesn't exist
+        mode (str): split to sample (train, valid, or test)
+        size (int, optional): number of images in the subset
+        fraction (float, optional): fraction of the split's images in the subset, overrides size
+        bins (int): quantile bins of the mean caption length and of the detection count
+        seed (int): seed of the draw
+        disable_progress_bar (bool): hide the progress bar
+    Returns:
+        (list): ids of the images in the subset
+    """
+    archive = exdir.File(root, mode="r")
+    group = archive.require_group(mode)
+    valid_ids = set(archive.attrs["valid_ids"])
+    ids = sorted(img_id for img_id in group.keys() if img_id in valid_ids)
+    captions, lengths = _read_captions(root, mode, group, ids)
+
+    keys = [[np.mean(lengths[img_id]) for img_id in ids]]
+    if len(ids) > 0 and isinstance(group[ids[0]], exdir.core.Group) and "region_features" in group[ids[0]]:
+        keys.append(detection_counts(root, mode, ids, disable_progress_bar))
+    if fraction is not None:
+        size = int(len(ids) * fraction)
+    selected = [ids[i] for i in stratified_sample(np.stack(keys, axis=1), size, bins, seed)]
+
+    subset = exdir.File(path)
+    if mode in subset:
+        # a rewritten split doesn't keep the images of an earlier draw
+        del subset[mode]
+    target = subset.require_group(mode)
+    for img_id in tqdm(selected, desc=f"Writing {mode} subset", disable=disable_progress_bar):
+        _copy(group[img_id], target, img_id)
+        target[img_id].attrs["captions"] = captions[img_id]
+        target[img_id].attrs["lengths"] = lengths[img_id]
+    word_map = archive.attrs["word_map"].to_dict()
+    # the ids of the other splits of the subset stay valid
+    subset_ids = set(subset.attrs["valid_ids"]) - set(ids) if "valid_ids" in subset.attrs else set()
+    subset.attrs["valid_ids"] = sorted(subset_ids.union(selected))
+    subset.attrs["word_map"] = word_map
+    subset.attrs["max_cap_len"] = archive.attrs["max_cap_len"]
+    index = CaptionIndex.from_captions(
+        {img_id: captions[img_id] for img_id in selected},
+        {img_id: lengths[img_id] for img_id in selected},
+        word_map,
+        archive.attrs["max_cap_len"],
+    )
+    index.save(subset.directory, mode)
+    return selected
@@ -0,0 +1,73 @@
+"""
+This module contains the token id to text conversion shared by the training loops,
+the metric aggregation and the evaluation scripts.
+
+The words of a word map are stored in a NumPy lookup array, so whole batches of
+token ids are converted with array indexing instead of a dict lookup per token.
+"""
+from typing import Dict, List, Union
+
+import numpy as np
+import torch
+
+UNKNOWN = "<unc>"
+
+
+class Vocabulary(object):
+    """Token id to word lookup backed by a NumPy array
+
+    Detokenizing drops <pad> and <start> tokens, stops at the first <end> token and
+    maps ids outside of the word map to <unc>.
+    """
+
+    def __init__(self, word_map: Dict[str, int]) -> None:
+        """
+        Args:
+            word_map (dict): token to id map
+        """
+        self.word_map = word_map
+        size = max(word_map.values()) + 1 if len(word_map) > 0 else 0
+        # the last entry is returned for ids outside of the word map
+        self.words = np.full(size + 1, UNKNOWN, dtype=object)
+        for word, i in word_map.items():
+            self.words[i] = word
+        self.unknown = size
+        self.end = word_map.get("<end>")
+        self.dropped = np.zeros(size + 1, dtype=bool)
+        for token in ["<pad>", "<start>"]:
+            if token in word_map:
+                self.dropped[word_map[token]] = True
+
+    @classmethod
+    def from_inverse(cls, inv_word_map: Dict[int, str]) -> "Vocabulary":
+        return cls({word: i for i, word in inv_word_map.items()})
+
+    def __len__(self) -> int:
+        return len(self.word_map)
+
+    def detokenize(
+        self, tokens: Union[torch.Tensor, np.ndarray, list], join: bool = True
+    ) -> Union[str, List[str], List[list]]:
+        """Converts token ids to text
+        Args:
+            tokens (torch.Tensor, np.ndarray or list): token ids of shape (..., sequence_length)
+            join (bool): join the words of every caption with spaces, otherwise return lists of words
+        Returns:
+            (str or list): one caption per sequence, nested like the leading dimensions of tokens
+        """
+        if isinstance(tokens, torch.Tensor):
+            tokens = tokens.detach().cpu().numpy()
+        tokens = np.asarray(tokens, dtype=np.int64)
+        if tokens.ndim == 0:
+            tokens = tokens.reshape(1)
+        shape = tokens.shape[:-1]
+        tokens = tokens.reshape(int(np.prod(shape)), tokens.shape[-1])
+        ids = np.where((tokens >= 0) & (tokens < self.unknown), tokens, self.unknown)
+        keep = ~self.dropped[ids]
+        if self.end is not None:
+            keep &= np.cumsum(ids == self.end, axis=1) == 0
+        words = self.words[ids]
+        captions = np.empty(len(words), dtype=object)
+        for i, (row, mask) in enumerate(zip(words, keep)):
+            captions[i] = " ".join(row[mask]) if join else row[mask].tolist()
+        return captions.reshape(shape).tolist()
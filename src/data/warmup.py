@@ -0,0 +1,146 @@
+"""
+This module contains the warmup of packed feature stores before training.
+
+Without it, the first epoch reads every feature cold from disk and is several
+times slower than the following epochs, which are served from the OS page cache.
+warmup_store reads the files of a split in parallel blocks so they are in the
+page cache before the first batch. copy_to_shm instead copies a split into a
+RAM backed directory such as /dev/shm and returns the path of the copy, which
+keeps the features in memory even if the page cache is under pressure.
+resident_bytes reports how much of a file is in memory.
+"""
+import ctypes
+import ctypes.util
+import mmap
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NoReturn, Optional
+
+import numpy as np
+
+from .feature_store import CHUNK_FILE, GLOBAL_FILE, INDEX_FILE, REGION_FILE
+
+BLOCK_SIZE = 16 * 2**20
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True) if os.name == "posix" else None
+
+
+def store_files(path: str, mode: str) -> List[str]:
+    """Files of a split of a packed feature store, the index last"""
+    split_dir = os.path.join(path, mode)
+    names = [REGION_FILE, GLOBAL_FILE, CHUNK_FILE, INDEX_FILE]
+    return [os.path.join(split_dir, name) for name in names if os.path.exists(os.path.join(split_dir, name))]
+
+
+def resident_bytes(path: str) -> Optional[int]:
+    """Bytes of a file that are in memory, None where mincore is not available"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return 0
+    if _libc is None or not hasattr(_libc, "mincore"):
+        return None
+    page_size = mmap.PAGESIZE
+    pages = (ctypes.c_ubyte * ((size + page_size - 1) // page_size))()
+    with open(path, "rb") as f:
+        # private mappings export a writable buffer, only their address is used
+        mapping = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_COPY)
+    try:
+        start = ctypes.c_char.from_buffer(mapping)
+        result = _libc.mincore(ctypes.c_void_p(ctypes.addressof(start)), ctypes.c_size_t(size), pages)
+        del start
+    finally:
+        mapping.close()
+    if result != 0:
+        return None
+    return min(int((np.frombuffer(pages, dtype=np.uint8) & 1).sum()) * page_size, size)
+
+
+def _read_block(fd: int, offset: int, length: int) -> int:
+    return len(os.pread(fd, length, offset))
+
+
+def read_ahead(path: str, pool: ThreadPoolExecutor, block_size: int = BLOCK_SIZE) -> int:
+    """Reads a file in parallel blocks to load it into the page cache, returns the bytes read"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(fd, 0, size, os.POSIX_FADV_WILLNEED)
+        jobs = [pool.submit(_read_block, fd, offset, block_size) for offset in range(0, size, block_size)]
+        return sum(job.result() for job in jobs)
+    finally:
+        os.close(fd)
+
+
+def warmup_store(path: str, modes: List[str], threads: int = 8, block_size: int = BLOCK_SIZE) -> Dict[str, int]:
+    """Loads the splits of a feature store into the page cache
+    Args:
+        path (str): directory of the feature store
+        modes (list): splits to load
+        threads (int): parallel reads
+        block_size (int): bytes per read
+    Returns:
+        (dict): bytes read per file
+    """
+    read = {}
+    with ThreadPoolExecutor(max(threads, 1)) as pool:
+        for mode in modes:
+            for name in store_files(path, mode):
+                read[name] = read_ahead(name, pool, block_size)
+    return read
+
+
+def _copy_block(source: int, target: int, offset: int, length: int) -> NoReturn:
+    os.pwrite(target, os.pread(source, length, offset), offset)
+
+
+def copy_to_shm(
+    path: str, mode: str, shm_dir: str = "/dev/shm", threads: int = 8, block_size: int = BLOCK_SIZE
+) -> str:
+    """Copies a split of a feature store into a RAM backed directory
+    Args:
+        path (str): directory of the feature store
+        mode (str): split to copy (train, valid, or test)
+        shm_dir (str): RAM backed directory the store is copied into
+        threads (int): parallel block copies
+        block_size (int): bytes per copied block
+    Returns:
+        (str): directory of the copied store, pass it as the feature store of the datasets
+    """
+    target_dir = os.path.join(shm_dir, os.path.basename(os.path.normpath(path)))
+    os.makedirs(os.path.join(target_dir, mode), exist_ok=True)
+    files = store_files(path, mode)
+    index = os.path.join(target_dir, mode, INDEX_FILE)
+    if os.path.exists(index) and os.path.getmtime(index) >= max(os.path.getmtime(name) for name in files):
+        # copied after the last change of the store
+        return target_dir
+    if os.path.exists(index):
+        # readers never see an index without its features
+        os.remove(index)
+    with ThreadPoolExecutor(max(threads, 1)) as pool:
+        for name in files[:-1]:
+            size = os.path.getsize(name)
+            source = os.open(name, os.O_RDONLY)
+            target = os.open(os.path.join(target_dir, mode, os.path.basename(name)), os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(target, size)
+                jobs = [
+                    pool.submit(_copy_block, source, target, offset, block_size)
+                    for offset in range(0, size, block_size)
+                ]
+                for job in jobs:
+                    job.result()
+            finally:
+                os.close(source)
+                os.close(target)
+    shutil.copyfile(files[-1], index)
+    return target_dir
+
+
+def warmup_in_background(path: str, modes: List[str], threads: int = 8) -> threading.Thread:
+    """Starts warmup_store in a daemon thread, e.g. while the model is built"""
+    thread = threading.Thread(target=warmup_store, args=(path, modes, threads), daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,83 @@
+"""Reports the effect of quantized feature stores on the language metrics.
+
+A trained meshed memory transformer is validated on the valid split once with
+float32 features and once per quantized feature store written by
+pack_features.py --quantization float16/int8. BLEU-1 to BLEU-4, METEOR and
+ROUGE of every store are printed next to their change from float32.
+"""
+import argparse
+from multiprocessing import cpu_count
+from typing import Dict, Optional
+
+import pytorch_lightning as pl
+from torch.utils.data import DataLoader
+
+from data.augmentation import Flickr30KFeatures
+from models.Configuration import *
+from models.meshed_memory import MeshedMemoryTransformer
+from utils import Flickr30KMetricsCallback
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Quantized Feature Evaluation")
+    parser.add_argument("--smoke_test", action="store_true", default=False)
+    parser.add_argument("--data_dir", action="store", type=str, default="../flickr30k.exdir")
+    parser.add_argument("--checkpoint", action="store", type=str, default="./best_project2_checkpoint.ckpt")
+    parser.add_argument(
+        "--baseline_store", action="store", type=str, default=None, help="float32 store, defaults to the exdir archive"
+    )
+    parser.add_argument("--stores", action="store", type=str, nargs="+", required=True, help="quantized stores")
+    parser.add_argument("--num_workers", action="store", type=int, default=cpu_count())
+    return parser.parse_args()
+
+
+def validate(
+    model: pl.LightningModule,
+    config: dict,
+    data_dir: str,
+    checkpoint: str,
+    feature_store: Optional[str] = None,
+    num_workers: int = 0,
+    smoke_test: bool = False,
+) -> Dict[str, float]:
+    """Language metrics of a checkpoint on the valid split read from a feature store"""
+    valid = Flickr30KFeatures(
+        root=data_dir,
+        max_detections=config["max_detections"],
+        feature_mode="region",
+        smoke_test=smoke_test,
+        mode="valid",
+        feature_store=feature_store,
+    )
+    valloader = DataLoader(valid, batch_size=config["batch_size"], num_workers=num_workers)
+    metric_callback = Flickr30KMetricsCallback(valid.inv_word_map, valid.annotations)
+    trainer = pl.Trainer(logger=False, fast_dev_run=smoke_test, callbacks=[metric_callback])
+    trainer.validate(model=model, dataloaders=valloader, ckpt_path=checkpoint, verbose=False)
+    return dict(model.current_epoch_language_metrics)
+
+
+def main():
+    args = parse_args()
+
+    # Load Config
+    config = MemoryLessTinyTransformerConfiguration()
+
+    # Load Model
+    lightning_model = MeshedMemoryTransformer(config)
+
+    options = dict(num_workers=args.num_workers, smoke_test=args.smoke_test)
+    baseline = validate(lightning_model, config, args.data_dir, args.checkpoint, args.baseline_store, **options)
+    results = {}
+    for store in args.stores:
+        results[store] = validate(lightning_model, config, args.data_dir, args.checkpoint, store, **options)
+
+    print(f"{'metric':<16}{'float32':>10}" + "".join(f"{store:>24}" for store in results))
+    for metric, value in baseline.items():
+        row = f"{metric:<16}{value:>10.4f}"
+        for metrics in results.values():
+            row += f"{metrics[metric]:>14.4f} ({metrics[metric] - value:+.4f})"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,7 @@ from pl_bolts.optimizers import LinearWarmupCosineAnnealingLR
 from pytorch_lightning.utilities.types import STEP_OUTPUT
 from typing import Any
 from .model_utils import BeamSearch
+from data.vocabulary import Vocabulary
 from .metrics.cider import Cider
 import pdb
 from nltk.translate import meteor
@@ -180,17 +181,31 @@ class MeshedMemoryEncoder(nn.Module):
         # initialization
         nn.init.xavier_uniform_(self.input_project.weight)
 
-    def forward(self, x, attention_weights: Optional[torch.Tensor] = None):
-
+    def forward(
+        self,
+        x,
+        attention_weights: Optional[torch.Tensor] = None,
+        padding_mask: Optional[torch.Tensor] = None,
+    ):
+        """
+        Args:
+            x (torch.Tensor): features of shape (batch_size, sequence_length, in_size)
+            attention_weights (Optional[torch.Tensor], optional): attention weights. Defaults to None.
+            padding_mask (Optional[torch.Tensor], optional): (batch_size, sequence_length) mask that is True
+                at padded detections. Inferred from the features when not given. Defaults to None.
+        """
         # (batch_size, 1, 1, sequence_length)
         x = self.relu(self.input_project(x))
         x = self.dropout(x)
         x = self.layer_norm(x)
         # generate masks to prevent data leaks. This also preserves the autoregressive
         # property of transformers. See Attention is All You Need paper
-        mask = (
-            (torch.sum(x, -1) == self.pad_token).unsqueeze(1).unsqueeze(1)
-        )  # mask over sequence (batch_size, 1 , 1 , sequence_length)
+        if padding_mask is not None:
+            mask = padding_mask.unsqueeze(1).unsqueeze(1)
+        else:
+            mask = (
+                (torch.sum(x, -1) == self.pad_token).unsqueeze(1).unsqueeze(1)
+            )  # mask over sequence (batch_size, 1 , 1 , sequence_length)
         encoded_output = []
         if self.training:
             self.kl = []
@@ -387,6 +402,11 @@ class Decoder(nn.Module):
         return out
 
 
+def padding_mask(batch) -> Optional[torch.Tensor]:
+    """Explicit detection padding mask of batches built by data.collate.VariableLengthCollate"""
+    return batch[3] if len(batch) > 3 else None
+
+
 class MeshedMemoryTransformer(pl.LightningModule):
     def __init__(
         self, config: Configuration, beam_size=5, inv_word_map: dict = None, reference_captions: dict = None
@@ -449,9 +469,9 @@ class MeshedMemoryTransformer(pl.LightningModule):
             if p.dim() > 1:
                 nn.init.xavier_uniform_(p)
 
-    def forward(self, data, captions):
+    def forward(self, data, captions, padding_mask: Optional[torch.Tensor] = None):
         self.kl = []
-        encoded, masks = self.encoder(data)
+        encoded, masks = self.encoder(data, padding_mask=padding_mask)
         out = self.decoder(captions, encoded, masks)
         if self.training:
             self.kl.extend(self.encoder.kl)
@@ -466,8 +486,8 @@ class MeshedMemoryTransformer(pl.LightningModule):
 
     def training_step(self, batch, batch_idx):
         self.lr_schedulers().step()
-        inputs, captions, _ = batch
-        out = self(inputs, captions)
+        inputs, captions, _ = batch[:3]
+        out = self(inputs, captions, padding_mask(batch))
         # remove start token for backpropagation
         y = captions[:, 1:].contiguous()
         y = y.view(-1)
@@ -494,8 +514,8 @@ class MeshedMemoryTransformer(pl.LightningModule):
         self.lr_schedulers().step()
 
     def validation_step(self, batch, batch_idx):
-        inputs, caption, _ = batch
-        out = self(inputs, caption)
+        inputs, caption, _ = batch[:3]
+        out = self(inputs, caption, padding_mask(batch))
 
         # remove start token for backpropagation
         y = caption[:, 1:].contiguous()
@@ -510,7 +530,7 @@ class MeshedMemoryTransformer(pl.LightningModule):
 
     # Searches for best sequence with beam search, by default beam_size=5
     def test_step(self, batch, batch_idx):
-        inputs, _, filename = batch
+        inputs, _, filename = batch[:3]
         filename = filename[0]
         # Avoid dupes
         if filename == self.previous_image:
@@ -525,18 +545,18 @@ class MeshedMemoryTransformerSelfCrit(MeshedMemoryTransformer):
         super().__init__(config, reference_captions=reference_captions)
         self.train_inv_word_map = train_inv_word_map
         self.valid_inv_word_map = valid_inv_word_map
+        self.train_vocabulary = Vocabulary.from_inverse(train_inv_word_map)
 
-    # Copied from ../utils.py because I don't want a metrics agg in here
     def convert_tokens_to_string(self, caption: list) -> list:
-        return [self.train_inv_word_map.get(tok, "<unc>") for tok in caption if self.train_inv_word_map.get(tok, "<unc>") not in ["<pad>", "<start>"]]
+        return self.train_vocabulary.detokenize(caption, join=False)
         
     def training_step(self, batch, batch_idx):
         # Run through, get results of beam search
-        inputs,captions,img_id = batch
+        inputs,captions,img_id = batch[:3]
         batch_size = inputs.shape[0]
         all_meteorscores = torch.empty([batch_size, 1])
         all_lengths = torch.empty([batch_size, 1])
-        out = self(inputs, captions)
+        out = self(inputs, captions, padding_mask(batch))
         # for i in range(0, batch_size):
         #     all_caps = self.reference_captions[img_id[i]]
         #     #beam_search_result = BeamSearch(self, inputs[i,:,:].unsqueeze(0), 5)
@@ -552,10 +572,11 @@ class MeshedMemoryTransformerSelfCrit(MeshedMemoryTransformer):
         pred_seq = nn.functional.softmax(out, dim=-1)
         max_probs,max_words=torch.max(pred_seq,dim=2)
 
+        best_sequence_strings = self.convert_tokens_to_string(max_words)
         for i in range(0, batch_size):
-            best_sequence_string = self.convert_tokens_to_string(max_words[i,:].tolist())
+            best_sequence_string = best_sequence_strings[i]
             all_caps = self.reference_captions[img_id[i]]
-            captions_strings = [self.convert_tokens_to_string(cap) for cap in all_caps]
+            captions_strings = self.convert_tokens_to_string(all_caps)
             all_meteorscores[i] = meteor(captions_strings, best_sequence_string)
             
         # remove start token for backpropagation
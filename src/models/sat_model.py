@@ -228,7 +228,11 @@ class SATDecoder(nn.Module):
         αs = torch.zeros(
             batch_size, self._max_cap_size, x.size(1)
         )  # attention generated weights stored for Doubly Stochastic Regularization
-        for i in range(self._max_cap_size):
+        steps = self._max_cap_size
+        if self.training and lengths is not None:
+            # predictions past the longest caption of the batch are dropped by pack_padded_sequence
+            steps = min(int(lengths.max()), self._max_cap_size)
+        for i in range(steps):
             # For each token, determine if we apply teacher forcing
             if scheduled_sampling and np.random.uniform(0, 1) < self._teacher_forcing_rate:
                 # In teacher forcing we know which captions have a specified length, so we can reduce wasteful
@@ -309,11 +313,14 @@ class SATModel(nn.Module):
         # TODO: move this to Operations.py
         self.criterion = nn.CrossEntropyLoss()
 
-    def forward(self, images, captions, caption_lengths):
+    def forward(self, images, captions, caption_lengths, image_index=None):
         images = images.to(self.device)
         captions = captions.to(self.device)
         caption_lengths = caption_lengths.to(self.device)
         encoded_images = self.encoder(images)
+        if image_index is not None:
+            # image major batches, see data.collate.ImageMajorCollate
+            encoded_images = encoded_images[image_index.to(self.device)]
         self.predictions, self.alphas = self.decoder(encoded_images, captions, caption_lengths, False)
         # best_pred = torch.max(self.predictions, dim=2).tolist()
 
@@ -0,0 +1,46 @@
+"""Script to pack the exdir feature archive into a memory-mapped feature store.
+The packed store holds every split's region and global features in contiguous
+files with an offsets index. Pass its path to Flickr30KFeatures with the
+feature_store argument to read features as memory-mapped views. With
+--quantization float16 or int8 the features are stored quantized, see
+evaluate_quantization.py for the effect on the language metrics. With
+--compression the features are compressed losslessly in chunks of
+--chunk_images images, trading decompression time for less disk traffic.
+"""
+import argparse
+from multiprocessing import cpu_count
+
+from data.compression import CODECS
+from data.feature_store import write_feature_store
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Pack Flickr30K features")
+    parser.add_argument("--data_dir", action="store", type=str, default="../flickr30k.exdir")
+    parser.add_argument("--store_dir", action="store", type=str, default="../flickr30k.features")
+    parser.add_argument("--modes", action="store", nargs="+", default=["train", "valid", "test"])
+    parser.add_argument("--quantization", action="store", choices=["float32", "float16", "int8"], default="float32")
+    parser.add_argument("--compression", action="store", choices=CODECS, default=None)
+    parser.add_argument("--chunk_images", action="store", type=int, default=64)
+    parser.add_argument("--compression_level", action="store", type=int, default=None)
+    parser.add_argument("--threads", action="store", type=int, default=cpu_count())
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for mode in args.modes:
+        write_feature_store(
+            args.data_dir,
+            args.store_dir,
+            mode,
+            quantization=args.quantization,
+            compression=args.compression,
+            chunk_images=args.chunk_images,
+            level=args.compression_level,
+            threads=args.threads,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+"""Script to pack the images of an exdir archive into a pre-resized image store.
+Images are resized and center cropped once and stored as uint8 arrays in one
+memory-mapped file per split. Pass its path to Flickr30k with the image_store
+argument, and build batches with NormalizeImageCollate.
+"""
+import argparse
+
+from data.image_store import write_image_store
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Pack Flickr30K images")
+    parser.add_argument("--data_dir", action="store", type=str, default="../flickr30k/flickr30k.exdir")
+    parser.add_argument("--store_dir", action="store", type=str, default="../flickr30k/flickr30k.images")
+    parser.add_argument("--modes", action="store", nargs="+", default=["train", "valid", "test"])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for mode in args.modes:
+        write_image_store(args.data_dir, args.store_dir, mode)
+
+
+if __name__ == "__main__":
+    main()
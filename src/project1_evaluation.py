@@ -1,5 +1,6 @@
 from cgi import test
 from data.augmentation import Flickr30k
+from data.vocabulary import Vocabulary
 from models.sat_model import SATEncoder, SATDecoder
 from tqdm import tqdm
 
@@ -39,6 +40,7 @@ def main():
     vocab_size = len(test_data.word_map.keys())
 
     inv_word_map = {v: k for k, v in word_map.items()}
+    vocabulary = Vocabulary(word_map)
     # load the model
     state_dicts = torch.load(best_checkpoint_path, map_location="cpu")
     encoder = SATEncoder()
@@ -70,23 +72,10 @@ def main():
         predictions, alphas = decoder(ann, target, lengths, SCHEDULED_SAMPLING)
 
         # get  reference captions without additional characters
-        references = []
-        for j in range(all_captions.shape[0]):  # iterate over batches
-            ref_caps = all_captions[j].tolist()
-            temp_ref = []
-            for ref in ref_caps:  # iterate over available captions for image
-                # strip unnecessary tokens
-                tmp = [f"{inv_word_map[t]} " for t in ref if t not in [word_map["<pad>"], word_map["<start>"]]]
-                temp_ref.append("".join(tmp))
-            references.append(temp_ref)
+        references = vocabulary.detokenize(all_captions)
 
         _, preds = torch.max(predictions, dim=2)
-        preds = preds.tolist()
-        predicted_captions = []
-        for k in range(len(preds)):
-            p = preds[k]
-            temp = [f"{inv_word_map[t]} " for t in p if t not in [word_map["<pad>"], word_map["<start>"]]]
-            predicted_captions.append("".join(temp).split(".")[0])
+        predicted_captions = [caption.split(".")[0] for caption in vocabulary.detokenize(preds)]
 
         score = blue_score(predicted_captions, references)
         pbar.set_postfix({"bleu4": score.numpy()})
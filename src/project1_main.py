@@ -11,7 +11,11 @@ import numpy as np
 from models.model_utils import load_model_dict, save_model_dict
 from models.sat_model import SATDecoder, SATEncoder
 from models.attention import SATAttention
-from data.augmentation import Flickr30k, AugmentedFlickrDataset
+from data.augmentation import Flickr30k, Flickr30kAnnotations, AugmentedFlickrDataset
+from data.encoder_cache import cache_directory, encoder_is_frozen, has_encoder_cache, write_encoder_cache
+from data.handles import open_worker_handles
+from data.prefetch import Prefetcher
+from data.samplers import BucketBatchSampler
 from train import train_sat_epoch, validate_sat_epoch
 import logging
 
@@ -59,6 +63,23 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--data_directory", action="store", type=str, required=True)
     parser.add_argument("--smoke_test", action="store_true", default=False, required=False)
     parser.add_argument("--fast_test", action="store_true", default=False, required=False)
+    # batch captions of similar length together so the decoder stops at the longest one
+    parser.add_argument("--bucket_batches", action="store_true", default=False, required=False)
+    # load every training image once per epoch with all of its captions and encode it once
+    parser.add_argument("--image_major", action="store_true", default=False, required=False)
+    # packed store of pre-resized images written by pack_images.py
+    parser.add_argument("--image_store", action="store", type=str, default=None, required=False)
+    # convert, augment and normalize whole batches instead of single images
+    parser.add_argument("--batch_transforms", action="store_true", default=False, required=False)
+    # sample the augmented variants written by augment_images.py into the image store instead of augmenting
+    parser.add_argument("--augmentation_bank", action="store_true", default=False, required=False)
+    # train the decoder on encoder outputs cached in this directory, only used with a frozen encoder
+    parser.add_argument("--encoder_cache", action="store", type=str, default=None, required=False)
+    parser.add_argument("--encoder_cache_fp16", action="store_true", default=False, required=False)
+    # number of batches staged on the device ahead of the training loop, 0 disables prefetching
+    parser.add_argument("--prefetch_batches", action="store", type=int, default=0, required=False)
+    # threads of every loader worker decoding the images of archives written with --image_format jpeg
+    parser.add_argument("--decode_threads", action="store", type=int, default=0, required=False)
     return parser.parse_args()
 
 
@@ -71,6 +92,7 @@ def train_model(
     word_map: dict,
     checkpoint_name: str,
     logger: logging.Logger,
+    encoded: bool = False,
 ):
     """Starts/Resumes training session"""
     # initialize variables
@@ -98,7 +120,9 @@ def train_model(
             break  # stop training when the model fails to learn for too long
         if epoch > 15 and epoch % 2 == 1:
             decoder.update_scheduled_sampling_rate(SCHEDULED_SAMPLING_CONVERGENCE)
-        train_metrics = train_sat_epoch(epoch, encoder, decoder, trainloader, optimizer, criterion, word_map, DEVICE)
+        train_metrics = train_sat_epoch(
+            epoch, encoder, decoder, trainloader, optimizer, criterion, word_map, DEVICE, encoded
+        )
         val_metrics, best_img, best_caption, actual_caption = validate_sat_epoch(
             epoch, encoder, decoder, valloader, criterion, word_map, DEVICE
         )
@@ -122,6 +146,8 @@ def train_model(
             global_step=epoch,
         )
         writer.add_scalar("BLEU4", val_metrics["bleu4"], global_step=epoch)
+        if "data_wait" in train_metrics:
+            writer.add_scalar("Data Wait", train_metrics["data_wait"], global_step=epoch)
         writer.add_scalars(
             "Top 5 Acc",
             {"train top 5 acc": train_metrics["top 5 acc"], "val top 5 acc": val_metrics["top 5 acc"]},
@@ -249,12 +275,37 @@ def main():
         if args.augment_data:
             # load augmented dataset
             train_data = AugmentedFlickrDataset(
-                DATA_DIRECTORY, mode="train", smoke_test=args.smoke_test, fast_test=args.fast_test
+                DATA_DIRECTORY,
+                mode="train",
+                smoke_test=args.smoke_test,
+                fast_test=args.fast_test,
+                image_store=args.image_store,
+                batch_transforms=args.batch_transforms,
+                image_major=args.image_major,
+                decode_threads=args.decode_threads,
+                augmentation_bank=args.augmentation_bank,
             )
         else:
-            train_data = Flickr30k(DATA_DIRECTORY, mode="train", smoke_test=args.smoke_test, fast_test=args.fast_test)
+            train_data = Flickr30k(
+                DATA_DIRECTORY,
+                mode="train",
+                smoke_test=args.smoke_test,
+                fast_test=args.fast_test,
+                image_store=args.image_store,
+                batch_transforms=args.batch_transforms,
+                image_major=args.image_major,
+                decode_threads=args.decode_threads,
+            )
         # no augmentation on validation set
-        valid_data = Flickr30k(DATA_DIRECTORY, mode="valid", smoke_test=args.smoke_test, fast_test=args.fast_test)
+        valid_data = Flickr30k(
+            DATA_DIRECTORY,
+            mode="valid",
+            smoke_test=args.smoke_test,
+            fast_test=args.fast_test,
+            image_store=args.image_store,
+            batch_transforms=args.batch_transforms,
+            decode_threads=args.decode_threads,
+        )
 
     # Construct the model
     encoder = SATEncoder()
@@ -272,6 +323,37 @@ def main():
     encoder.to(DEVICE)
     decoder.to(DEVICE)
 
+    use_encoder_cache = False
+    if not args.skip_training and args.encoder_cache is not None:
+        # augmented images change every epoch and a trainable encoder changes every step
+        use_encoder_cache = not args.augment_data and encoder_is_frozen(encoder)
+        if not use_encoder_cache:
+            logger.warning("Encoder outputs are not cached with data augmentation or a trainable encoder")
+    if use_encoder_cache:
+        # the cache directory is keyed by the encoder weights, a different backbone gets a new cache
+        cache = cache_directory(args.encoder_cache, encoder)
+        if not has_encoder_cache(cache, "train", train_data.ids):
+            images = Flickr30k(
+                DATA_DIRECTORY,
+                mode="train",
+                smoke_test=args.smoke_test,
+                fast_test=args.fast_test,
+                image_store=args.image_store,
+                image_major=True,
+                decode_threads=args.decode_threads,
+            )
+            write_encoder_cache(
+                encoder, images, cache, BATCH_SIZE, num_workers=8, fp16=args.encoder_cache_fp16, device=DEVICE
+            )
+        train_data = Flickr30kAnnotations(
+            cache,
+            DATA_DIRECTORY,
+            mode="train",
+            smoke_test=args.smoke_test,
+            fast_test=args.fast_test,
+            image_major=args.image_major,
+        )
+
     if args.smoke_test:
         EPOCHS = 10
         # check to make sure that the model actually works
@@ -282,10 +364,46 @@ def main():
 
     if not args.skip_training:
         # train the model
-        trainloader = DataLoader(train_data, num_workers=8, batch_size=BATCH_SIZE)
-        valloader = DataLoader(valid_data, num_workers=8, batch_size=BATCH_SIZE)
+        # image store and batch_transforms samples are converted and normalized per batch
+        collate = train_data.collate_fn()
+        if args.image_major:
+            # five caption rows per image, keep the number of caption rows per batch
+            trainloader = DataLoader(
+                train_data,
+                num_workers=8,
+                worker_init_fn=open_worker_handles,
+                batch_size=max(1, BATCH_SIZE // 5),
+                collate_fn=collate,
+            )
+        elif args.bucket_batches:
+            sampler = BucketBatchSampler(train_data.sample_statistics(), BATCH_SIZE)
+            trainloader = DataLoader(
+                train_data, num_workers=8, worker_init_fn=open_worker_handles, batch_sampler=sampler, collate_fn=collate
+            )
+        else:
+            trainloader = DataLoader(
+                train_data, num_workers=8, worker_init_fn=open_worker_handles, batch_size=BATCH_SIZE, collate_fn=collate
+            )
+        valloader = DataLoader(
+            valid_data,
+            num_workers=8,
+            worker_init_fn=open_worker_handles,
+            batch_size=BATCH_SIZE,
+            collate_fn=valid_data.collate_fn(),
+        )
+        if args.prefetch_batches > 0:
+            trainloader = Prefetcher(trainloader, DEVICE, args.prefetch_batches)
+            valloader = Prefetcher(valloader, DEVICE, args.prefetch_batches)
         train_model(
-            encoder, decoder, trainloader, valloader, RESULTS_DIRECTORY, train_data.word_map, "checkpoint.pt", logger
+            encoder,
+            decoder,
+            trainloader,
+            valloader,
+            RESULTS_DIRECTORY,
+            train_data.word_map,
+            "checkpoint.pt",
+            logger,
+            use_encoder_cache,
         )
 
     if not args.skip_evaluation:
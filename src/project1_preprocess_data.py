@@ -1,29 +1,50 @@
 """Script to convert raw Flickr 30K data to a useable format.
 This script creates an exdir dataset that holds the images for Flickr30K,
 a word map for the n most popular words, and the mapped captions.
+
+Images are decoded and captions tokenized and lemmatized in a single pass by a
+pool of --num_workers processes. Progress is logged after every --batch_size
+images, so rerunning the script after an interruption continues where it
+stopped. Pass --restart to start over.
+
+With --image_format jpeg the archive keeps the encoded bytes of the Flickr30K
+JPEGs instead of the decoded images, the datasets decode them when a sample is
+loaded, see data.jpeg.
 """
 import argparse
-from collections import defaultdict
-import copy
-import enum
-from lib2to3.pgen2 import token
 import exdir
 import nltk
-import numpy as np
 import os
+from multiprocessing import Pool, cpu_count
 from tqdm import tqdm
 from torchvision.datasets import Flickr30k
+from data.caption_index import CaptionIndex
+from data.image_store import ImageStoreWriter
+from data.jpeg import IMAGE_FORMATS, read_encoded
+from data.preprocessing import (
+    PROGRESS_FILE,
+    TOPK,
+    ProgressLog,
+    assign_splits,
+    build_word_map,
+    encode_caption,
+    init_worker,
+    load_example,
+)
 
 nltk.download("omw-1.4")
 nltk.download("wordnet")
-from nltk.stem import WordNetLemmatizer
-
-TOPK = 1000
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--flickr_dir", action="store")
+    # optionally also write pre-resized uint8 images to a packed image store
+    parser.add_argument("--image_store", action="store", default=None)
+    parser.add_argument("--num_workers", action="store", type=int, default=cpu_count())
+    parser.add_argument("--batch_size", action="store", type=int, default=256, help="images per logged batch")
+    parser.add_argument("--restart", action="store_true", help="ignore the progress of an interrupted run")
+    parser.add_argument("--image_format", action="store", choices=IMAGE_FORMATS, default="array")
     return parser.parse_args()
 
 
@@ -35,101 +56,93 @@ def main():
     assert os.path.exists(img_path)
     ann_path = os.path.join(root, "results_20130124.token")
 
-    dataset = Flickr30k(img_path, ann_path)
+    if args.image_format == "jpeg":
+        # reads the encoded bytes of the files without decoding them
+        dataset = Flickr30k(img_path, ann_path, loader=read_encoded)
+    else:
+        dataset = Flickr30k(img_path, ann_path)
 
     # Create exdir archive
     archive = exdir.File(os.path.join(root, "flickr30k.exdir"))
-    train_archive = archive.require_group("train")
-    valid_archive = archive.require_group("valid")
-    test_archive = archive.require_group("test")
+    groups = {mode: archive.require_group(mode) for mode in ["train", "valid", "test"]}
 
     img_ids = dataset.ids
-    train_ids = img_ids[: int(len(img_ids) * 0.8)]
-    val_ids = img_ids[int(len(img_ids) * 0.8) : int(len(img_ids) * 0.8) + int(len(img_ids) * 0.15)]
-    test_ids = img_ids[int(len(img_ids) * 0.8) + int(len(img_ids) * 0.15) :]
-    train_captions = defaultdict(list)
-    val_captions = defaultdict(list)
-    test_captions = defaultdict(list)
-
-    print(f"# Train Examples {len(train_ids)}")
-    print(f"# Validation Examples {len(val_ids)}")
-    print(f"# Test examples {len(test_ids)}")
-
-    # build word count map and load images
-    words = defaultdict(lambda: 0)
-    lemmatizer = WordNetLemmatizer()
-    max_caption_length = 0
-    for i, img_id in enumerate(tqdm(img_ids, desc="Loading Data")):
-        image, captions = dataset[i]
-        image = np.asarray(image)
-        if img_id in train_ids:
-            store = train_archive
-            cap_store = train_captions
-        elif img_id in val_ids:
-            store = valid_archive
-            cap_store = val_captions
-        else:
-            store = test_archive
-            cap_store = test_captions
-        store.require_dataset(img_id, data=image)
-        for cap in captions:
-            cap_store[img_id].append(cap)
-            tokens = nltk.tokenize.word_tokenize(cap.lower())
-            tokens = [lemmatizer.lemmatize(toke) for toke in tokens]
-            if len(tokens) > max_caption_length:
-                max_caption_length = len(tokens)
-            for toke in tokens:
-                words[toke] += 1
-    max_caption_length += 2  # take start and end token into account
-
-    # build token-map
-    word_freqs = [(k, v) for k, v in words.items()]
-    word_freqs.sort(key=lambda x: x[1], reverse=True)
-    topk = word_freqs[:TOPK]  # We select top K words to be the model's vocabulary
-    topk = [w for w, _ in topk]  # only care about the words
-    token_map = {token: i + 4 for i, token in enumerate(topk)}
-    token_map["<start>"] = 0
-    token_map["<end>"] = 1
-    token_map["<unc>"] = 2
-    token_map["<pad>"] = 3
+    splits = assign_splits(img_ids)
+    split_ids = {mode: [img_id for img_id in img_ids if splits[img_id] == mode] for mode in groups}
+
+    print(f"# Train Examples {len(split_ids['train'])}")
+    print(f"# Validation Examples {len(split_ids['valid'])}")
+    print(f"# Test examples {len(split_ids['test'])}")
+
+    progress = ProgressLog(os.path.join(root, PROGRESS_FILE))
+    if args.restart:
+        progress.remove()
+    tokens = progress.read()
+    if len(tokens) > 0:
+        print(f"Resuming after {len(tokens)} preprocessed images")
+
+    image_writers = None
+    if args.image_store is not None:
+        image_writers = {}
+        for mode, ids in split_ids.items():
+            image_writers[mode] = ImageStoreWriter(args.image_store, mode, ids, resume=len(tokens) > 0)
+
+    # decode images and tokenize captions once, the next batch is loaded while the current one is written
+    todo = [i for i, img_id in enumerate(img_ids) if img_id not in tokens]
+    batches = [todo[start : start + args.batch_size] for start in range(0, len(todo), args.batch_size)]
+    pbar = tqdm(total=len(img_ids), initial=len(tokens), desc="Loading Data")
+    with Pool(args.num_workers, init_worker, (dataset, None, image_writers is not None)) as pool:
+        pending = pool.map_async(load_example, batches[0]) if batches else None
+        for b, batch in enumerate(batches):
+            examples = pending.get()
+            if b + 1 < len(batches):
+                pending = pool.map_async(load_example, batches[b + 1])
+            logged = {}
+            for i, (image, resized, caption_tokens) in zip(batch, examples):
+                img_id = img_ids[i]
+                store = groups[splits[img_id]]
+                if img_id in store:
+                    # written by an interrupted run before its batch was logged
+                    del store[img_id]
+                store.create_dataset(img_id, data=image)
+                if image_writers is not None:
+                    image_writers[splits[img_id]].write(img_id, resized)
+                logged[img_id] = caption_tokens
+            if image_writers is not None:
+                for writer in image_writers.values():
+                    writer.flush()
+            progress.append(logged)
+            tokens.update(logged)
+            pbar.update(len(batch))
+    pbar.close()
+    if image_writers is not None:
+        for writer in image_writers.values():
+            writer.close()
+
+    # build token-map from the tokens of the single pass, in dataset order
+    token_map, max_caption_length = build_word_map((caption for img_id in img_ids for caption in tokens[img_id]), TOPK)
 
     # store tokens for dataset
+    split_tokens = {mode: ({}, {}) for mode in groups}
     for img_id in tqdm(img_ids, desc="Processing Captions"):
-        if img_id in train_ids:
-            store = train_archive
-            cap_store = train_captions
-        elif img_id in val_ids:
-            store = valid_archive
-            cap_store = val_captions
-        else:
-            store = test_archive
-            cap_store = test_captions
-        tokenized_captions = []
-        lengths = []
-        for cap in cap_store[img_id]:
-            tokens = nltk.tokenize.word_tokenize(cap.lower())
-            tokens = [lemmatizer.lemmatize(toke) for toke in tokens]
-            lengths.append(len(tokens))
-            # replace uncommon words
-            res = copy.copy(tokens)
-            for i, toke in enumerate(tokens):
-                if toke not in token_map.keys():
-                    res[i] = token_map["<unc>"]
-                else:
-                    res[i] = token_map[toke]
-            res.append(token_map["<end>"])
-            res.insert(0, token_map["<start>"])
-
-            # ensure equal length for all captions
-            while len(res) < max_caption_length:
-                res.append(token_map["<pad>"])
-            tokenized_captions.append(res)
+        tokenized_captions = [encode_caption(caption, token_map, max_caption_length) for caption in tokens[img_id]]
+        lengths = [len(caption) for caption in tokens[img_id]]
 
         # store caption
+        store = groups[splits[img_id]]
         store[img_id].attrs["captions"] = tokenized_captions
         store[img_id].attrs["lengths"] = lengths
+        index_tokens, index_lengths = split_tokens[splits[img_id]]
+        index_tokens[img_id] = tokenized_captions
+        index_lengths[img_id] = lengths
     archive.attrs["word_map"] = token_map
     archive.attrs["max_cap_len"] = max_caption_length
+    archive.attrs["image_format"] = args.image_format
+
+    # consolidated caption index read by the datasets
+    for mode, (index_tokens, index_lengths) in split_tokens.items():
+        index = CaptionIndex.from_captions(index_tokens, index_lengths, token_map, max_caption_length)
+        index.save(archive.directory, mode)
 
 
 if __name__ == "__main__":
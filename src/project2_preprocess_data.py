@@ -3,19 +3,76 @@ For this project, we leverage a pretrained semantic segmentation model to
 identify regions of interest and extract features from those regions. This allows us 
 to effectively tokenize an image and apply mach ine translation techniques
 to perform the captioning. 
+
+This script regenerates the features on CPU or GPU without the detection model:
+a ResNet backbone computes global features and a grid of region features per
+image in one pass, see data.feature_extraction. The features are appended to a
+packed feature store in batches and images already in the store are skipped, so
+the script resumes interrupted runs and processes new images incrementally.
 """
+import argparse
+import os
+from multiprocessing import cpu_count
+
+import torch
+from torchvision.datasets import Flickr30k
+
+from data.feature_extraction import BACKBONES, REGION_LAYERS, FeatureExtractor, extract_features
+from data.preprocessing import assign_splits
 
 
-def generate_cnn_features():
-    raise NotImplementedError
+def generate_cnn_features(extractor: FeatureExtractor, images: torch.Tensor) -> torch.Tensor:
+    """Global features (batch_size, global_size) of a batch of normalized images"""
+    with torch.no_grad():
+        return extractor(images)[0]
 
 
-def generate_regional_features():
-    raise NotImplementedError
+def generate_regional_features(extractor: FeatureExtractor, images: torch.Tensor) -> torch.Tensor:
+    """Grid region features (batch_size, grid_size ** 2, region_size) of a batch of normalized images"""
+    with torch.no_grad():
+        return extractor(images)[1]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Extract Flickr30K features")
+    parser.add_argument("--flickr_dir", action="store", type=str, default="../flickr30k")
+    parser.add_argument("--store_dir", action="store", type=str, default="../flickr30k.features")
+    parser.add_argument("--modes", action="store", nargs="+", default=["train", "valid", "test"])
+    parser.add_argument("--backbone", action="store", choices=BACKBONES, default="resnet152")
+    parser.add_argument("--region_layer", action="store", choices=REGION_LAYERS, default="layer3")
+    parser.add_argument("--grid_size", action="store", type=int, default=7)
+    parser.add_argument("--image_size", action="store", type=int, default=224)
+    parser.add_argument("--batch_size", action="store", type=int, default=64)
+    parser.add_argument("--num_workers", action="store", type=int, default=cpu_count())
+    parser.add_argument("--quantization", action="store", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--device", action="store", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+    return parser.parse_args()
 
 
 def main():
-    raise NotImplementedError
+    args = parse_args()
+    img_path = os.path.join(args.flickr_dir, "flickr30k-images")
+    ann_path = os.path.join(args.flickr_dir, "results_20130124.token")
+    # the splits of project1_preprocess_data.py
+    img_ids = Flickr30k(img_path, ann_path).ids
+    splits = assign_splits(img_ids)
+
+    extractor = FeatureExtractor(args.backbone, region_layer=args.region_layer, grid_size=args.grid_size)
+    for mode in args.modes:
+        ids = [img_id for img_id in img_ids if splits[img_id] == mode]
+        writer = extract_features(
+            extractor,
+            img_path,
+            ids,
+            args.store_dir,
+            mode,
+            batch_size=args.batch_size,
+            num_workers=args.num_workers,
+            image_size=args.image_size,
+            device=args.device,
+            quantization=args.quantization,
+        )
+        print(f"{mode}: {len(writer)} images in {args.store_dir}")
 
 
 if __name__ == "__main__":
@@ -9,18 +9,31 @@ reinforcement learning.
 import argparse
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
+from torch.utils.data import BatchSampler, DataLoader, Sampler, SequentialSampler
 import pytorch_lightning as pl
 from pytorch_lightning.loggers import TensorBoardLogger
 import warnings
 from data.augmentation import Flickr30KFeatures
+from data.collate import DequantizeCollate, TrimPaddingCollate, VariableLengthCollate
+from data.handles import open_worker_handles
+from data.samplers import BucketBatchSampler, ResumableSampler
+from data.shards import ShardedFlickr30KFeatures
+from data.warmup import warmup_in_background
 
 from models.Configuration import *
 from models.meshed_memory import MeshedMemoryTransformer
 from models.model_utils import count_parameters
 
-from utils import Flickr30KMetricsCallback, KLAnnealingCallback, TextMessageUpdateCallback
+from utils import (
+    DataWaitCallback,
+    Flickr30KMetricsCallback,
+    KLAnnealingCallback,
+    ResumableSamplerCallback,
+    SetEpochCallback,
+    TextMessageUpdateCallback,
+)
 import os
+from typing import Callable
 from multiprocessing import cpu_count
 
 
@@ -35,6 +48,28 @@ def parse_args() -> argparse.Namespace:
         default="/home/jalexbox/Code/school/ece763/class_project/ImageCaptioningProject/flickr30k.exdir",
     )
     parser.add_argument("--num_workers", action="store", type=int, default=cpu_count())
+    parser.add_argument("--bucket_batches", action="store_true", help="batch samples of similar length together")
+    parser.add_argument(
+        "--variable_detections", action="store_true", help="pad detections per batch and pass an explicit mask"
+    )
+    parser.add_argument("--shard_dir", action="store", type=str, default=None, help="stream training data from shards")
+    parser.add_argument(
+        "--feature_store", action="store", type=str, default=None, help="read features from a pack_features.py store"
+    )
+    parser.add_argument(
+        "--dequantize_in_collate", action="store_true", help="dequantize features per batch, not per sample"
+    )
+    parser.add_argument(
+        "--batched_fetch", action="store_true", help="read whole batches at once instead of sample by sample"
+    )
+    parser.add_argument(
+        "--warmup_store", action="store_true", help="load the feature store into the page cache in the background"
+    )
+    parser.add_argument(
+        "--subset_dir", action="store", type=str, default=None, help="read a write_subset.py subset instead"
+    )
+    parser.add_argument("--checkpoint_every_n_steps", action="store", type=int, default=0)
+    parser.add_argument("--resume_from", action="store", type=str, default=None, help="checkpoint to resume training")
     return parser.parse_args()
 
 
@@ -44,30 +79,108 @@ def main():
     smoke_test = args.smoke_test
     gold_overfit = args.golden_debug_1
     num_workers = args.num_workers
+    bucket_batches = args.bucket_batches
+    variable_detections = args.variable_detections
+    shard_dir = args.shard_dir
+    checkpoint_every_n_steps = args.checkpoint_every_n_steps
+    feature_store = args.feature_store
+    dequantize_in_collate = args.dequantize_in_collate
+    subset_dir = args.subset_dir
+    batched_fetch = args.batched_fetch
+
+    if args.warmup_store and feature_store is not None:
+        # read while the datasets and the model are built, the first epoch then hits the page cache
+        warmup_in_background(feature_store, ["train", "valid"], num_workers)
 
     # Load Config
     config = BayesianMemoryTinyTransformerConfiguration()
 
     # Load Data
-    train = Flickr30KFeatures(
-        root=data_dir,
-        max_detections=config["max_detections"],
-        feature_mode="region",
-        smoke_test=smoke_test or gold_overfit,
-        mode="train",
-        lazy_cache=True,
-    )
+    if shard_dir is not None:
+        # streamed from the sequential shards written by write_shards.py, each rank reads its own shards
+        train = ShardedFlickr30KFeatures(
+            shard_dir,
+            config["max_detections"],
+            mode="train",
+            feature_mode="region",
+            pad_detections=not variable_detections,
+        )
+    else:
+        train = Flickr30KFeatures(
+            root=data_dir,
+            max_detections=config["max_detections"],
+            feature_mode="region",
+            smoke_test=smoke_test or gold_overfit,
+            mode="train",
+            pad_detections=not variable_detections,
+            feature_store=feature_store,
+            subset=subset_dir,
+            dequantize=not dequantize_in_collate,
+            lazy_cache=True,
+        )
     valid = Flickr30KFeatures(
         root=data_dir,
         max_detections=config["max_detections"],
         feature_mode="region",
         smoke_test=smoke_test or gold_overfit,
         mode="valid",
+        pad_detections=not variable_detections,
+        feature_store=feature_store,
+        subset=subset_dir,
+        dequantize=not dequantize_in_collate,
         lazy_cache=True,
     )
 
-    trainloader = DataLoader(train, batch_size=config["batch_size"], num_workers=num_workers)
-    valloader = DataLoader(valid, batch_size=config["batch_size"], num_workers=num_workers)
+    if variable_detections:
+        collate = VariableLengthCollate(train.word_map["<pad>"])
+    elif bucket_batches:
+        collate = TrimPaddingCollate(train.word_map["<pad>"])
+    else:
+        collate = None
+    train_collate = val_collate = collate
+    if dequantize_in_collate and feature_store is not None:
+        # float16 or int8 samples of a quantized store are converted to float32 once per batch
+        val_collate = DequantizeCollate(valid.store.region_scale, collate)
+        if shard_dir is None:
+            train_collate = DequantizeCollate(train.store.region_scale, collate)
+
+    def batch_loader(dataset: Flickr30KFeatures, batch_sampler: Sampler, collate_fn: Callable) -> DataLoader:
+        # --batched_fetch reads whole batches with Flickr30KFeatures.fetch_batch instead of sample by sample
+        sampling = dict(sampler=batch_sampler, batch_size=None) if batched_fetch else dict(batch_sampler=batch_sampler)
+        return DataLoader(
+            dataset,
+            **sampling,
+            collate_fn=collate_fn,
+            num_workers=num_workers,
+            worker_init_fn=open_worker_handles,
+            pin_memory=torch.cuda.is_available(),
+        )
+
+    if bucket_batches:
+        val_sampler = BucketBatchSampler(valid.sample_statistics(), config["batch_size"], shuffle=False)
+    else:
+        val_sampler = BatchSampler(SequentialSampler(valid), config["batch_size"], drop_last=False)
+    valloader = batch_loader(valid, val_sampler, val_collate)
+    # the sampler or streaming dataset keeps its position in the epoch in checkpoints
+    if shard_dir is not None:
+        # streaming datasets shuffle themselves
+        trainloader = DataLoader(
+            train,
+            batch_size=config["batch_size"],
+            collate_fn=train_collate,
+            num_workers=num_workers,
+            worker_init_fn=open_worker_handles,
+            pin_memory=torch.cuda.is_available(),
+        )
+        sampler_callback = ResumableSamplerCallback(train, config["batch_size"])
+    elif bucket_batches:
+        batch_sampler = BucketBatchSampler(train.sample_statistics(), config["batch_size"])
+        trainloader = batch_loader(train, batch_sampler, train_collate)
+        sampler_callback = ResumableSamplerCallback(batch_sampler)
+    else:
+        sampler = ResumableSampler(len(train), shuffle=False)
+        trainloader = batch_loader(train, BatchSampler(sampler, config["batch_size"], drop_last=False), train_collate)
+        sampler_callback = ResumableSamplerCallback(sampler, config["batch_size"])
 
     # Load Model
     lightning_model = MeshedMemoryTransformer(config)
@@ -78,6 +191,11 @@ def main():
         monitor="nlp_metrics/bleu4", filename="{epoch}-{nlp_metrics_bleu4:.4f}", mode="max"
     )
     lr_monitor_callback = pl.callbacks.LearningRateMonitor()
+    if checkpoint_every_n_steps > 0:
+        # mid epoch checkpoints to resume interrupted runs from with --resume_from
+        step_checkpoint_callback = pl.callbacks.ModelCheckpoint(
+            filename="last-step", every_n_train_steps=checkpoint_every_n_steps, save_top_k=1
+        )
 
     # Language Metric Aggregation
     metric_callback = Flickr30KMetricsCallback(valid.inv_word_map, valid.annotations)
@@ -88,6 +206,9 @@ def main():
             checkpoint_callback,
             metric_callback,
             lr_monitor_callback,
+            DataWaitCallback(),
+            SetEpochCallback(),
+            sampler_callback,
             TextMessageUpdateCallback(
                 os.environ["TWILIO_ACCOUNT_SID"], os.environ["TWILIO_AUTH_TOKEN"], os.environ["SMS_RECIPIENT"]
             ),
@@ -97,15 +218,21 @@ def main():
             checkpoint_callback,
             metric_callback,
             lr_monitor_callback,
+            DataWaitCallback(),
+            SetEpochCallback(),
+            sampler_callback,
         ]
     # KL Annealing Callback
     if config["bayesian"]:
         callbacks.append(KLAnnealingCallback(config["epochs"]))
+    if checkpoint_every_n_steps > 0:
+        callbacks.append(step_checkpoint_callback)
+
     # Cross Entropy Training
     trainer = pl.Trainer(
         max_epochs=config["epochs"], accelerator="auto", fast_dev_run=smoke_test, gpus=1, callbacks=callbacks
     )
-    trainer.fit(lightning_model, trainloader, valloader)
+    trainer.fit(lightning_model, trainloader, valloader, ckpt_path=args.resume_from)
 
 
 if __name__ == "__main__":
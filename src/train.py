@@ -9,6 +9,9 @@ import torch.optim as optim
 from torch.utils.data import DataLoader
 from tqdm import tqdm
 from utils import AverageMeter, calc_time, topk_accuracy
+from data.collate import broadcast_images
+from data.prefetch import Prefetcher
+from data.vocabulary import Vocabulary
 from torchmetrics import BLEUScore
 
 
@@ -25,15 +28,20 @@ def train_sat_epoch(
     criterion: nn.Module,
     word_map: dict,
     device: str = "cpu",
+    encoded: bool = False,
 ):
-    """Trains a single epoch for the Show, Attend, and Tell Model."""
+    """Trains a single epoch for the Show, Attend, and Tell Model.
+
+    With encoded set, the dataloader yields cached encoder outputs (see data.encoder_cache)
+    and the encoder is skipped.
+    """
     loss_meter = AverageMeter("Loss")
     top5_acc_meter = AverageMeter("Top5Acc")
     batch_time_meter = AverageMeter("BatchTime")
     n = len(dataloader)
     bleu4 = BLEUScore(4)
     bleu4_meter = AverageMeter()
-    inv_word_map = {v: k for k, v in word_map.items()}
+    vocabulary = Vocabulary(word_map)
     stats = {
         "top 5 acc": f"{0:.4f}",
         "loss": f"{0:.4f}",
@@ -43,16 +51,15 @@ def train_sat_epoch(
     decoder.train()
     start_time = time.time()
     prev_time = time.time()
-    for i, (images, captions, caption_lengths, all_captions, _) in enumerate(
-        pbar := tqdm(dataloader, f"Epoch {epoch+1} Train Progress ", postfix=stats)
-    ):
+    for i, batch in enumerate(pbar := tqdm(dataloader, f"Epoch {epoch+1} Train Progress ", postfix=stats)):
+        images, captions, caption_lengths, all_captions = batch[:4]
 
         images = images.to(device)
         captions = captions.to(device)
         caption_lengths = caption_lengths.to(device)
 
-        # Feed Forward
-        images = encoder(images)
+        # Feed Forward, image major batches encode every image once for all of its captions
+        images = broadcast_images(images if encoded else encoder(images), batch)
         predictions, alphas = decoder(images, captions, caption_lengths, False)
 
         # remove <start> token for backpropagation
@@ -74,23 +81,10 @@ def train_sat_epoch(
         optimizer.step()
 
         # get  reference captions without additional characters
-        references = []
-        for j in range(all_captions.shape[0]):  # iterate over batches
-            ref_caps = all_captions[j].tolist()
-            temp_ref = []
-            for ref in ref_caps:  # iterate over available captions for image
-                # strip unnecessary tokens
-                tmp = [f"{inv_word_map[t]} " for t in ref if t not in [word_map["<pad>"], word_map["<start>"]]]
-                temp_ref.append("".join(tmp))
-            references.append(temp_ref)
+        references = vocabulary.detokenize(all_captions)
 
         _, preds = torch.max(predictions, dim=2)
-        preds = preds.tolist()
-        predicted_captions = []
-        for k in range(len(preds)):
-            p = preds[k]
-            temp = [f"{inv_word_map[t]} " for t in p if t not in [word_map["<pad>"], word_map["<start>"]]]
-            predicted_captions.append("".join(temp))
+        predicted_captions = vocabulary.detokenize(preds)
 
         assert len(predicted_captions) == len(references)
 
@@ -113,11 +107,14 @@ def train_sat_epoch(
                 "t-minus": time_remaining,
             }
         )
-    return {
+    metrics = {
         "top 5 acc": top5_acc_meter.get_average(),
         "loss": loss_meter.get_average(),
         "epoch_time": time.time() - start_time,
     }
+    if isinstance(dataloader, Prefetcher):
+        metrics.update(dataloader.stats())
+    return metrics
 
 
 def validate_sat_epoch(
@@ -136,7 +133,7 @@ def validate_sat_epoch(
     batch_time_meter = AverageMeter()
     bleu4 = BLEUScore(4)
     bleu4_meter = AverageMeter()
-    inv_word_map = {v: k for k, v in word_map.items()}
+    vocabulary = Vocabulary(word_map)
 
     n = len(dataloader)
     stats = {
@@ -180,23 +177,10 @@ def validate_sat_epoch(
             loss_meter.update(loss.item())
 
             # get  reference captions without additional characters
-            references = []
-            for j in range(all_captions.shape[0]):  # iterate over batches
-                ref_caps = all_captions[j].tolist()
-                temp_ref = []
-                for ref in ref_caps:  # iterate over available captions for image
-                    # strip unnecessary tokens
-                    tmp = [f"{inv_word_map[t]} " for t in ref if t not in [word_map["<pad>"], word_map["<start>"]]]
-                    temp_ref.append("".join(tmp))
-                references.append(temp_ref)
+            references = vocabulary.detokenize(all_captions)
 
             _, preds = torch.max(predictions, dim=2)
-            preds = preds.tolist()
-            predicted_captions = []
-            for k in range(len(preds)):
-                p = preds[k]
-                temp = [f"{inv_word_map[t]} " for t in p if t not in [word_map["<pad>"], word_map["<start>"]]]
-                predicted_captions.append("".join(temp))
+            predicted_captions = vocabulary.detokenize(preds)
 
             assert len(predicted_captions) == len(references)
             end_time = time.time()
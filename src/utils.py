@@ -17,6 +17,7 @@ from pytorch_lightning.utilities.types import STEP_OUTPUT
 from typing import Any, Optional, NoReturn
 from multiprocessing import Pool, cpu_count
 from twilio.rest import Client
+from data.vocabulary import Vocabulary
 import warnings
 
 
@@ -86,6 +87,8 @@ class NLPMetricAggregator(object):
     def __init__(self, inv_word_map: dict, vocab_size: int = 2004) -> None:
         self.inv_word_map = inv_word_map
         self.vocab_size = vocab_size
+        # tokens outside of the word map, e.g. in the test set, become <unc>
+        self.vocabulary = Vocabulary.from_inverse(inv_word_map)
         self.meteor_score_tracker = []
         self.bleu1 = BLEUScore(1)
         self.bleu2 = BLEUScore(2)
@@ -96,26 +99,14 @@ class NLPMetricAggregator(object):
         self.reset()
 
     def convert_tokens_to_string(self, caption: list) -> str:
-        # return " ".join( [self.inv_word_map[tok] for tok in caption if self.inv_word_map[tok] not in ["<pad>", "<start>"] ]).strip()
-        # There are some tokens that are outside of the vocab in the test set
-        # This is just here to rectify that (idk how to do it with the previous syntax)
-        acc = ""
-        for tok in caption:
-            # If the token is outside the vocab, set it to <unc>
-            if tok >= self.vocab_size:
-                acc += " <unc>"
-            # If the token is a pad or start token
-            elif self.inv_word_map[tok] in ["<pad>", "<start>"]:
-                continue
-            else:
-                acc += " " + self.inv_word_map[tok]
-        acc = acc.strip()
-        return acc
-
-    def update(self, predicted: list, reference: list, img_id: str = None):
-        """Store predictions and references"""
-        predicted = self.convert_tokens_to_string(predicted)
-        reference = [self.convert_tokens_to_string(ref) for ref in reference]
+        return self.vocabulary.detokenize(caption)
+
+    def update(self, predicted: typing.Union[list, str], reference: list, img_id: str = None):
+        """Store predictions and references, given as token ids or as text"""
+        if not isinstance(predicted, str):
+            predicted = self.convert_tokens_to_string(predicted)
+        if len(reference) > 0 and not isinstance(reference[0], str):
+            reference = self.vocabulary.detokenize(reference)
         # Update Meteor Meter
         meteor = meteor_score([word_tokenize(r) for r in reference], word_tokenize(predicted))
         self.meteor_meter.update(meteor)
@@ -170,6 +161,13 @@ class Flickr30KMetricsCallback(Callback):
         self.tracker.reset()
         self.caption_refs = caption_reference
         self.seq_len = sequence_len
+        # the text of the reference captions of every image, they don't change between epochs
+        self._reference_text = {}
+
+    def references(self, img_id: str) -> list:
+        if img_id not in self._reference_text:
+            self._reference_text[img_id] = self.tracker.vocabulary.detokenize(self.caption_refs[img_id])
+        return self._reference_text[img_id]
 
     def on_validation_batch_end(
         self,
@@ -180,13 +178,13 @@ class Flickr30KMetricsCallback(Callback):
         batch_idx: int,
         dataloader_idx: int,
     ) -> None:
-        _, _, img_ids = batch
+        img_ids = batch[2]
         batch_predictions = outputs["val_batch_preds"]
         pred_caps = torch.argmax(batch_predictions, dim=-1)  # get token predictions
-        pred_caps = pred_caps.unsqueeze(0).view(-1, self.seq_len - 1)
-        for pred, id in zip(pred_caps.tolist(), img_ids):
-            ref_caps = self.caption_refs[id]
-            self.tracker.update(pred, ref_caps)
+        # batches may be trimmed to their longest caption, so only the batch size is fixed
+        pred_caps = pred_caps.unsqueeze(0).view(len(img_ids), -1)
+        for pred, id in zip(self.tracker.vocabulary.detokenize(pred_caps), img_ids):
+            self.tracker.update(pred, self.references(id))
 
     def on_validation_epoch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
         metrics = self.tracker.generate_metric_summaries()
@@ -206,12 +204,11 @@ class Flickr30KMetricsCallback(Callback):
     ) -> None:
         if outputs is None:
             return
-        _, _, img_ids = batch
+        img_ids = batch[2]
         pred_caps = outputs["test_batch_preds"]
         ids = outputs["test_image_ids"]
-        for pred, id in zip([pred_caps.tolist()], img_ids):
-            ref_caps = self.caption_refs[id]
-            self.tracker.update(pred, ref_caps, ids)
+        for pred, id in zip([self.tracker.vocabulary.detokenize(pred_caps)], img_ids):
+            self.tracker.update(pred, self.references(id), ids)
 
     def on_test_epoch_end(self, trainer: "pl.Trainer", pl_module: "pl.LightningModule") -> None:
         metrics = self.tracker.generate_metric_summaries()
@@ -222,6 +219,97 @@ class Flickr30KMetricsCallback(Callback):
         scores.sort(key=lambda x: x[1], reverse=True)
         print(scores[:5])
 
+class DataWaitCallback(Callback):
+    """Logs the time the training loop spent waiting for batches every epoch"""
+
+    def __init__(self) -> None:
+        self.wait_time = 0.0
+        self.batch_end = None
+
+    def on_train_epoch_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        self.wait_time = 0.0
+        self.batch_end = time()
+
+    def on_train_batch_start(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule, batch: Any, batch_idx: int
+    ) -> None:
+        # fetching and moving the batch to the device happen between the end of a step and the start of the next
+        if self.batch_end is not None:
+            self.wait_time += time() - self.batch_end
+
+    def on_train_batch_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule, outputs: STEP_OUTPUT, batch: Any, batch_idx: int
+    ) -> None:
+        self.batch_end = time()
+
+    def on_train_epoch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        pl_module.log("train_params/data_wait", self.wait_time)
+
+
+class SetEpochCallback(Callback):
+    """Calls set_epoch of the training dataset before every epoch
+
+    Lightning only sets the epoch of samplers. Streaming datasets like
+    data.shards.ShardedFlickr30KFeatures reseed their shuffles from the dataset epoch.
+    """
+
+    def on_train_epoch_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        dataset = getattr(trainer.train_dataloader, "dataset", None)
+        set_epoch = getattr(dataset, "set_epoch", None)
+        if callable(set_epoch):
+            set_epoch(trainer.current_epoch)
+
+
+class ResumableSamplerCallback(Callback):
+    """Saves the position of the training loop in the epoch in checkpoints and resumes from it
+
+    The sampler, batch sampler or streaming dataset of the training dataloader must have a resume
+    method, see data.samplers.ResumableSampler, data.samplers.BucketBatchSampler and
+    data.shards.ShardedFlickr30KFeatures. When training restarts from a checkpoint saved in the
+    middle of an epoch, the batches of that epoch that were already trained on are skipped.
+    """
+
+    def __init__(self, resumable: Any, batch_size: Optional[int] = None) -> None:
+        """
+        Args:
+            resumable: sampler, batch sampler or dataset of the training dataloader
+            batch_size (int, optional): batch size of the dataloader, None when a batch sampler is used
+        """
+        self.resumable = resumable
+        self.batch_size = batch_size
+        self.epoch = 0
+        self.batches = 0
+
+    def on_train_epoch_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        # not called when an epoch is resumed in the middle
+        self.epoch = trainer.current_epoch
+        self.batches = 0
+
+    def on_train_batch_end(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule, outputs: STEP_OUTPUT, batch: Any, batch_idx: int
+    ) -> None:
+        self.batches += 1
+
+    def state_dict(self) -> dict:
+        return {"epoch": self.epoch, "batches": self.batches}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        # checkpoints are restored before the training dataloader is iterated
+        self.epoch = state_dict["epoch"]
+        self.batches = state_dict["batches"]
+        try:
+            num_batches = len(self.resumable)
+            if self.batch_size is not None:
+                num_batches = -(-num_batches // self.batch_size)
+        except TypeError:
+            num_batches = None
+        if num_batches is not None and self.batches >= num_batches:
+            # saved after the last batch of the epoch, training continues with the next one
+            self.resumable.resume(self.epoch + 1, 0, self.batch_size)
+        else:
+            self.resumable.resume(self.epoch, self.batches, self.batch_size)
+
+
 class KLAnnealingCallback(Callback):
     def __init__(self, epochs, R = 5):
         self.epochs = epochs
@@ -0,0 +1,44 @@
+"""Script to load a packed feature store into memory before training.
+By default every split is read in parallel blocks into the OS page cache, so the
+first epoch does not read its features cold from disk. With --shm_dir the splits
+are copied into a RAM backed directory such as /dev/shm instead; pass the printed
+path as the feature store of the training scripts. The resident bytes of every
+file are reported afterwards.
+"""
+import argparse
+import os
+from multiprocessing import cpu_count
+
+from data.warmup import copy_to_shm, resident_bytes, store_files, warmup_store
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Warm up Flickr30K feature store")
+    parser.add_argument("--store_dir", action="store", type=str, default="../flickr30k.features")
+    parser.add_argument("--modes", action="store", nargs="+", default=["train", "valid", "test"])
+    parser.add_argument("--threads", action="store", type=int, default=cpu_count())
+    parser.add_argument("--shm_dir", action="store", type=str, default=None, help="copy the store here, e.g. /dev/shm")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    store_dir = args.store_dir
+    if args.shm_dir is not None:
+        for mode in args.modes:
+            store_dir = copy_to_shm(args.store_dir, mode, args.shm_dir, args.threads)
+        print(f"Feature store copied to {store_dir}")
+    else:
+        warmup_store(store_dir, args.modes, args.threads)
+    total = resident = 0
+    for mode in args.modes:
+        for name in store_files(store_dir, mode):
+            size = resident_bytes(name)
+            total += os.path.getsize(name)
+            resident += size or 0
+            print(f"{name}: {size if size is not None else 'unknown'} of {os.path.getsize(name)} bytes resident")
+    print(f"Resident: {resident / 2**20:.1f} of {total / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Script to export the exdir feature archive into sequential shards.
+Every shard holds the region features, global features and captions of a fixed
+number of images. Pass the shard directory to the training scripts with
+--shard_dir to stream the training split with ShardedFlickr30KFeatures.
+"""
+import argparse
+
+from data.shards import write_shards
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Write Flickr30K shards")
+    parser.add_argument("--data_dir", action="store", type=str, default="../flickr30k.exdir")
+    parser.add_argument("--shard_dir", action="store", type=str, default="../flickr30k.shards")
+    parser.add_argument("--images_per_shard", action="store", type=int, default=1024)
+    parser.add_argument("--modes", action="store", nargs="+", default=["train", "valid", "test"])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for mode in args.modes:
+        write_shards(args.data_dir, args.shard_dir, mode, args.images_per_shard)
+
+
+if __name__ == "__main__":
+    main()
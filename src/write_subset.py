@@ -0,0 +1,35 @@
+"""Script to write a small, stratified subset of the exdir archive for smoke tests.
+The subset is an exdir archive of its own holding --images images per split (or
+--fraction of every split), picked deterministically and stratified by caption
+length and number of region detections. Pass its path to the datasets with the
+subset argument, or to the training scripts with --subset_dir, so development
+runs and CI smoke runs start without opening the full archive.
+"""
+import argparse
+
+from data.subsets import write_subset
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser("Write Flickr30K subset")
+    parser.add_argument("--data_dir", action="store", type=str, default="../flickr30k.exdir")
+    parser.add_argument("--subset_dir", action="store", type=str, default="../flickr30k.subset.exdir")
+    parser.add_argument("--modes", action="store", nargs="+", default=["train", "valid", "test"])
+    parser.add_argument("--images", action="store", type=int, default=64, help="images per split")
+    parser.add_argument("--fraction", action="store", type=float, default=None, help="fraction of every split")
+    parser.add_argument("--bins", action="store", type=int, default=4, help="strata per caption length and detections")
+    parser.add_argument("--seed", action="store", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    for mode in args.modes:
+        ids = write_subset(
+            args.data_dir, args.subset_dir, mode, args.images, args.fraction, bins=args.bins, seed=args.seed
+        )
+        print(f"# {mode} images {len(ids)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+""" Fixtures that build a tiny Flickr30K style exdir archive
+"""
+import numpy as np
+import pytest
+import exdir
+
+WORD_MAP = {"<start>": 0, "<end>": 1, "<unc>": 2, "<pad>": 3, "a": 4, "dog": 5, "cat": 6, "runs": 7}
+MAX_CAP_LEN = 6
+
+
+def make_caption(length: int, rng: np.random.Generator) -> list:
+    words = rng.integers(4, len(WORD_MAP), size=length).tolist()
+    caption = [WORD_MAP["<start>"]] + words + [WORD_MAP["<end>"]]
+    return caption + [WORD_MAP["<pad>"]] * (MAX_CAP_LEN - len(caption))
+
+
+@pytest.fixture
+def feature_archive(tmp_path):
+    """Archive with 4 training images holding 5 captions, region and global features each"""
+    rng = np.random.default_rng(0)
+    root = str(tmp_path / "flickr30k.exdir")
+    archive = exdir.File(root)
+    group = archive.require_group("train")
+    ids = [f"{i}.jpg" for i in range(4)]
+    for i, img_id in enumerate(ids):
+        img = group.require_group(img_id)
+        img.require_dataset("region_features", data=rng.standard_normal((i + 2, 8)))
+        img.require_dataset("global_features", data=rng.standard_normal(16))
+        lengths = rng.integers(1, MAX_CAP_LEN - 1, size=5).tolist()
+        img.attrs["captions"] = [make_caption(length, rng) for length in lengths]
+        img.attrs["lengths"] = lengths
+    archive.attrs["valid_ids"] = ids
+    archive.attrs["word_map"] = WORD_MAP
+    archive.attrs["max_cap_len"] = MAX_CAP_LEN
+    return root
+
+
+@pytest.fixture
+def image_archive(tmp_path):
+    """Archive with 3 training images of different sizes holding 5 captions each"""
+    rng = np.random.default_rng(0)
+    root = str(tmp_path / "flickr30k.exdir")
+    archive = exdir.File(root)
+    group = archive.require_group("train")
+    ids = [f"{i}.jpg" for i in range(3)]
+    for i, img_id in enumerate(ids):
+        group.require_dataset(img_id, data=rng.integers(0, 256, size=(300 + 10 * i, 400, 3), dtype=np.uint8))
+        lengths = rng.integers(1, MAX_CAP_LEN - 1, size=5).tolist()
+        group[img_id].attrs["captions"] = [make_caption(length, rng) for length in lengths]
+        group[img_id].attrs["lengths"] = lengths
+    archive.attrs["valid_ids"] = ids
+    archive.attrs["word_map"] = WORD_MAP
+    archive.attrs["max_cap_len"] = MAX_CAP_LEN
+    return root
@@ -0,0 +1,55 @@
+""" Unit tests for appending images to an existing archive
+"""
+import os
+
+import exdir
+import numpy as np
+
+from conftest import MAX_CAP_LEN, WORD_MAP
+from data.append import DatasetAppender
+from data.augmentation import Flickr30k
+from data.caption_index import CaptionIndex, index_path
+
+
+def test_append_images(image_archive):
+    group = exdir.File(image_archive).require_group("train")
+    mtimes = {img_id: os.path.getmtime(group[img_id].directory) for img_id in group.keys()}
+    appender = DatasetAppender(image_archive, "train")
+    before = CaptionIndex.load(image_archive, "train")
+    assert len(appender) == 3 and "1.jpg" in appender
+
+    image = np.random.default_rng(0).integers(0, 256, size=(320, 400, 3), dtype=np.uint8)
+    tokens = [["a", "dog", "runs"], ["a", "big", "cat", "runs", "fast"]]
+    assert not appender.add("1.jpg", image, tokens)
+    assert appender.add("3.jpg", image, tokens)
+    # not visible before the commit
+    assert CaptionIndex.load(image_archive, "train").ids == before.ids
+    assert appender.commit() == ["3.jpg"]
+
+    # the frozen word map is kept, long captions are truncated and unknown words mapped to <unc>
+    archive = exdir.File(image_archive, mode="r")
+    assert archive.attrs["word_map"].to_dict() == WORD_MAP and list(archive.attrs["valid_ids"])[-1] == "3.jpg"
+    index = CaptionIndex.load(image_archive, "train")
+    assert index.ids == before.ids + ["3.jpg"]
+    np.testing.assert_array_equal(index.tokens[: len(before.tokens)], before.tokens)
+    np.testing.assert_array_equal(index.captions(3), [[0, 4, 5, 7, 1, 3], [0, 4, 2, 6, 7, 1]])
+    np.testing.assert_array_equal(index.caption_lengths(3), [3, 4])
+    assert all(os.path.getmtime(group[img_id].directory) == mtime for img_id, mtime in mtimes.items())
+
+    data = Flickr30k(image_archive, mode="train", disable_progress_bar=True, num_processes=1)
+    assert len(data) == 17 and data.annotations["3.jpg"][1][-1] == WORD_MAP["<end>"]
+    assert data._raw_image("3.jpg").shape == (320, 400, 3) and data.max_cap_len == MAX_CAP_LEN
+
+
+def test_interrupted_append_is_rewritten(image_archive):
+    image = np.zeros((300, 400, 3), dtype=np.uint8)
+    DatasetAppender(image_archive, "train").add("3.jpg", image, [["a", "dog"]])
+    # the image was written but never committed
+    appender = DatasetAppender(image_archive, "train")
+    assert "3.jpg" not in appender and len(appender) == 3
+    assert appender.add("3.jpg", image + 1, [["a", "cat"]])
+    appender.commit()
+    assert os.path.exists(index_path(image_archive, "train"))
+    assert not os.path.exists(os.path.join(os.path.dirname(index_path(image_archive, "train")), "train.tmp.npz"))
+    group = exdir.File(image_archive, mode="r").require_group("train")
+    assert group["3.jpg"][0, 0, 0] == 1 and list(group["3.jpg"].attrs["lengths"]) == [2]
@@ -0,0 +1,36 @@
+""" Unit tests for the batched image augmentations
+"""
+import torch
+import torchvision.transforms.functional as TF
+
+from data.augmentation import AugmentedFlickrDataset
+from data.batch_transforms import BatchColorJitter, BatchGaussianBlur
+
+
+def test_batch_gaussian_blur_matches_per_image_blur():
+    images = torch.rand(3, 3, 20, 24) * 255
+    blurred = BatchGaussianBlur(kernel_size=(5, 3), sigma=1.5)(images)
+    for image, result in zip(images, blurred):
+        expected = TF.gaussian_blur(image, kernel_size=[5, 3], sigma=[1.5, 1.5])
+        torch.testing.assert_close(result, expected, rtol=1e-4, atol=1e-3)
+
+
+def test_batch_color_jitter_per_image_factor():
+    images = torch.full((64, 3, 4, 4), 100.0)
+    jittered = BatchColorJitter(brightness=0.2)(images)
+    factors = jittered[:, 0, 0, 0] / 100.0
+    assert torch.all(factors >= 0.8 - 1e-6) and torch.all(factors <= 1.2 + 1e-6)
+    assert torch.unique(factors).numel() > 1
+    assert torch.equal(jittered, factors.view(-1, 1, 1, 1).expand_as(jittered) * 100.0)
+    assert BatchColorJitter(brightness=0.5)(torch.full((8, 3, 2, 2), 250.0)).max() <= 255.0
+
+
+def test_augmented_dataset_batch_transforms(image_archive):
+    data = AugmentedFlickrDataset(image_archive, mode="train", batch_transforms=True)
+    samples = [data[i] for i in range(4)]
+    assert samples[0][0].dtype == torch.uint8
+    assert samples[0][0].shape == (3, 224, 224)
+    mod, target, lengths, all_caps, img = data.collate_fn()(samples)
+    assert img.shape == mod.shape == (4, 3, 224, 224)
+    assert img.dtype == torch.float32
+    assert target.shape == (4, data.max_cap_len)
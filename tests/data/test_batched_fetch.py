@@ -0,0 +1,55 @@
+""" Unit tests for fetching whole batches of Flickr30KFeatures samples
+"""
+import pytest
+import torch
+from torch.utils.data import BatchSampler, DataLoader, SequentialSampler
+from torch.utils.data.dataloader import default_collate
+
+from data.augmentation import Flickr30KFeatures
+from data.collate import DequantizeCollate, VariableLengthCollate
+from data.feature_store import write_feature_store
+
+INDICES = [13, 0, 1, 7, 19, 2]
+
+
+def assert_batches_equal(batch, reference):
+    assert len(batch) == len(reference)
+    for value, expected in zip(batch, reference):
+        if isinstance(expected, torch.Tensor):
+            torch.testing.assert_close(value, expected)
+        else:
+            assert list(value) == list(expected)
+
+
+@pytest.mark.parametrize("store", [None, "float32", "int8", "zlib"])
+@pytest.mark.parametrize("feature_mode", ["region", "global"])
+def test_fetch_batch_matches_samples(feature_archive, tmp_path, store, feature_mode):
+    options = dict(root=feature_archive, mode="train", disable_progress_bar=True, num_processes=1)
+    if store is not None:
+        store_dir = str(tmp_path / "store")
+        compression = "zlib" if store == "zlib" else None
+        quantization = "float32" if store == "zlib" else store
+        write_feature_store(
+            feature_archive, store_dir, "train", None, True, quantization, compression, chunk_images=3
+        )
+        options["feature_store"] = store_dir
+    data = Flickr30KFeatures(4, feature_mode, **options)
+    assert_batches_equal(data[INDICES], default_collate([data[i] for i in INDICES]))
+
+    unpadded = Flickr30KFeatures(4, feature_mode, pad_detections=False, **options)
+    collate = VariableLengthCollate(unpadded.word_map["<pad>"])
+    if feature_mode == "region":
+        assert_batches_equal(collate(unpadded[INDICES]), collate([unpadded[i] for i in INDICES]))
+
+
+def test_loader_fetches_whole_batches(feature_archive, tmp_path):
+    store_dir = str(tmp_path / "store")
+    write_feature_store(feature_archive, store_dir, "train", quantization="int8", disable_progress_bar=True)
+    options = dict(root=feature_archive, mode="train", disable_progress_bar=True, num_processes=1)
+    data = Flickr30KFeatures(4, "region", feature_store=store_dir, dequantize=False, **options)
+    collate = DequantizeCollate(data.store.region_scale)
+    sampler = BatchSampler(SequentialSampler(data), 8, drop_last=False)
+    batched = DataLoader(data, sampler=sampler, batch_size=None, collate_fn=collate)
+    per_sample = DataLoader(data, batch_size=8, collate_fn=collate)
+    for batch, reference in zip(batched, per_sample):
+        assert_batches_equal(batch, reference)
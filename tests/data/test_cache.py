@@ -0,0 +1,34 @@
+""" Unit tests for the shared feature cache
+"""
+import multiprocessing
+
+import torch
+
+from data.cache import SharedFeatureCache
+
+
+def fill(cache, keys):
+    for key in keys:
+        cache.put(key, torch.full((2, 4), float(key)))
+
+
+def test_lru_eviction():
+    # budget for exactly two (3, 4) float32 entries
+    cache = SharedFeatureCache(num_keys=5, entry_shape=(3, 4), max_bytes=2 * 3 * 4 * 4)
+    fill(cache, [0, 1])
+    assert torch.equal(cache.get(0), torch.zeros((2, 4)))  # 0 is now more recent than 1
+    fill(cache, [2])
+    assert 1 not in cache
+    assert cache.get(1) is None
+    assert torch.equal(cache.get(2), torch.full((2, 4), 2.0))
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["evictions"], stats["entries"]) == (2, 1, 1, 2)
+
+
+def test_entries_are_shared_with_child_processes():
+    cache = SharedFeatureCache(num_keys=4, entry_shape=(2, 4), max_bytes=2**20)
+    process = multiprocessing.get_context("fork").Process(target=fill, args=(cache, [1, 3]))
+    process.start()
+    process.join()
+    assert torch.equal(cache.get(3), torch.full((2, 4), 3.0))
+    assert cache.stats()["entries"] == 2
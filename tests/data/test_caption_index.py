@@ -0,0 +1,29 @@
+""" Unit tests for the consolidated caption index
+"""
+from data.augmentation import Flickr30KFeatures
+from data.caption_index import CaptionIndex, has_caption_index, write_caption_index
+
+
+def load(root):
+    return Flickr30KFeatures(
+        root=root, max_detections=3, feature_mode="region", mode="train", disable_progress_bar=True, num_processes=1
+    )
+
+
+def test_index_matches_attributes(feature_archive):
+    legacy = load(feature_archive)
+    write_caption_index(feature_archive, "train", disable_progress_bar=True)
+    assert has_caption_index(feature_archive, "train")
+    indexed = load(feature_archive)
+
+    assert indexed.ids == legacy.ids
+    assert indexed.word_map == legacy.word_map
+    assert indexed.max_cap_len == legacy.max_cap_len
+    for img_id in legacy.ids:
+        assert indexed.annotations[img_id] == legacy.annotations[img_id]
+        assert indexed.lengths[img_id] == legacy.lengths[img_id]
+    assert sorted(indexed.ann_list) == sorted(legacy.ann_list)
+
+    index = CaptionIndex.load(feature_archive, "train")
+    assert index.tokens.shape == (20, index.max_cap_len)
+    assert index.offsets[-1] == 20
@@ -0,0 +1,43 @@
+""" Unit tests for the NumPy backed caption store
+"""
+import pickle
+
+import numpy as np
+import pytest
+
+from data.augmentation import Flickr30k
+from data.caption_index import CaptionIndex
+from data.caption_store import CaptionMapping, CaptionPairs, CaptionStore
+
+
+def test_store_records_and_views():
+    captions = {"b": [[0, 5, 1], [0, 6, 1]], "a": [[0, 4, 1]], "c": [[0, 7, 1]]}
+    lengths = {"b": [1, 1], "a": [1], "c": [1]}
+    index = CaptionIndex.from_captions(captions, lengths, {"<pad>": 3}, 3)
+    # images are sorted by id
+    store = CaptionStore.from_index(index, [0, 1])
+    assert store.ids.tolist() == ["a", "b"] and len(store) == 3 and store.images.tolist() == [0, 1, 1]
+    record = store.record(2)
+    assert (record.img_id, record.image, record.tokens.tolist(), record.length) == ("b", 1, [0, 6, 1], 1)
+    assert not hasattr(record, "__dict__")
+    assert store.position("b") == 1 and "c" not in store
+    with pytest.raises(KeyError):
+        store.position("c")
+
+    assert dict(CaptionMapping(store)) == {"a": captions["a"], "b": captions["b"]}
+    assert CaptionMapping(store, lengths=True)["b"] == [1, 1]
+    assert list(CaptionPairs(store)) == [("a", [0, 4, 1]), ("b", [0, 5, 1]), ("b", [0, 6, 1])]
+
+    copy = pickle.loads(pickle.dumps(store))
+    np.testing.assert_array_equal(copy.tokens, store.tokens)
+    assert copy.record(0).img_id == "a"
+
+
+def test_dataset_reads_the_store(image_archive):
+    data = Flickr30k(image_archive, mode="train", disable_progress_bar=True, num_processes=1)
+    assert len(data) == 15 and data.ids == ["0.jpg", "1.jpg", "2.jpg"]
+    _, target, lengths, all_caps, _ = data[7]
+    np.testing.assert_array_equal(target.numpy(), data.annotations["1.jpg"][2])
+    assert lengths.tolist() == [data.lengths["1.jpg"][2]]
+    assert all_caps.tolist() == data.annotations["1.jpg"]
+    np.testing.assert_array_equal(data.sample_statistics()[:, 0], data.captions.lengths)
@@ -0,0 +1,51 @@
+""" Unit tests for the Flickr30K collate functions
+"""
+import torch
+
+from data.augmentation import Flickr30k
+from data.collate import TrimPaddingCollate, VariableLengthCollate, broadcast_images
+
+PAD = 3
+
+
+def sample(num_detections, caption, img_id):
+    caption = caption + [PAD] * (8 - len(caption))
+    return torch.randn(num_detections, 4), torch.tensor(caption), img_id
+
+
+def test_variable_length_collate_pads_to_batch_max():
+    batch = [sample(2, [0, 5, 1], "a"), sample(5, [0, 5, 6, 7, 1], "b")]
+    features, captions, img_ids, padding_mask = VariableLengthCollate(PAD)(batch)
+    assert features.shape == (2, 5, 4)
+    assert captions.shape == (2, 5)
+    assert img_ids == ["a", "b"]
+    assert padding_mask.tolist() == [[False, False, True, True, True], [False] * 5]
+    assert torch.equal(features[0, :2], batch[0][0])
+    assert torch.all(features[0, 2:] == 0)
+
+
+def test_trim_padding_collate():
+    padded = []
+    for num_detections, caption, img_id in [(2, [0, 5, 1], "a"), (3, [0, 5, 6, 1], "b")]:
+        features, caption, img_id = sample(num_detections, caption, img_id)
+        padded.append((torch.cat([features, torch.zeros(7 - num_detections, 4)]), caption, img_id))
+    features, captions, img_ids = TrimPaddingCollate(PAD)(padded)
+    assert features.shape == (2, 3, 4)
+    assert captions.shape == (2, 4)
+
+
+def test_image_major_collate_matches_caption_major_samples(image_archive):
+    kwargs = dict(mode="train", batch_transforms=True, disable_progress_bar=True, num_processes=1)
+    caption_major = Flickr30k(image_archive, **kwargs)
+    image_major = Flickr30k(image_archive, image_major=True, **kwargs)
+    assert len(image_major) * 5 == len(caption_major)
+
+    batch = image_major.collate_fn()([image_major[0], image_major[1]])
+    expected = caption_major.collate_fn()([caption_major[i] for i in range(10)])
+    mod, captions, lengths, all_caps, images, image_index = batch
+    assert mod.shape[0] == images.shape[0] == 2
+    assert torch.equal(image_index, torch.arange(2).repeat_interleave(5))
+    for value, reference in zip(batch[1:4], expected[1:4]):
+        assert torch.equal(value, reference)
+    assert torch.equal(broadcast_images(mod, batch), expected[0])
+    assert broadcast_images(mod, expected) is mod
@@ -0,0 +1,63 @@
+""" Unit tests for the encoder output cache
+"""
+import pytest
+import torch
+import torch.nn as nn
+
+from data.augmentation import Flickr30k, Flickr30kAnnotations
+from data.encoder_cache import (
+    EncoderCache,
+    cache_directory,
+    encoder_is_frozen,
+    has_encoder_cache,
+    write_encoder_cache,
+)
+
+
+class TinyEncoder(nn.Module):
+    def __init__(self) -> None:
+        super().__init__()
+        self.features = nn.Sequential(nn.Conv2d(3, 4, kernel_size=32, stride=32))
+        for param in self.features.parameters():
+            param.requires_grad = False
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.features(x).permute(0, 2, 3, 1)
+
+
+def test_encoder_cache_serves_encoder_outputs(image_archive, tmp_path):
+    torch.manual_seed(0)
+    encoder = TinyEncoder()
+    path = cache_directory(str(tmp_path / "encoder_cache"), encoder)
+    data = Flickr30k(image_archive, mode="train", image_major=True, disable_progress_bar=True, num_processes=1)
+    assert not has_encoder_cache(path, "train")
+    write_encoder_cache(encoder, data, path, batch_size=2, fp16=True, disable_progress_bar=True)
+    assert has_encoder_cache(path, "train", data.ids)
+    assert not has_encoder_cache(path, "train", data.ids + ["missing.jpg"])
+
+    cache = EncoderCache(path, "train")
+    assert cache.annotations.dtype == "float16"
+    with torch.no_grad():
+        expected = encoder(data[1][0][None])[0]
+    torch.testing.assert_close(torch.from_numpy(cache.annotation(data.ids[1])).float(), expected, rtol=1e-2, atol=1e-2)
+
+    annotations = Flickr30kAnnotations(path, image_archive, mode="train", disable_progress_bar=True, num_processes=1)
+    mod, target, lengths, all_caps, img = annotations[5]
+    assert mod.dtype == torch.float32
+    assert mod.shape == (7, 7, 4)
+    assert torch.equal(target, data[1][1][0])
+
+
+def test_encoder_cache_key_and_invalidation(tmp_path):
+    encoder = TinyEncoder()
+    path = cache_directory(str(tmp_path), encoder)
+    assert path == cache_directory(str(tmp_path), encoder)
+    assert path != cache_directory(str(tmp_path), encoder, input_size=256)
+    with torch.no_grad():
+        encoder.features[0].bias.add_(1)
+    assert path != cache_directory(str(tmp_path), encoder)
+
+    encoder.features[0].weight.requires_grad = True
+    assert not encoder_is_frozen(encoder)
+    with pytest.raises(ValueError):
+        write_encoder_cache(encoder, None, path)
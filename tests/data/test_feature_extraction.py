@@ -0,0 +1,54 @@
+""" Unit tests for the feature extraction engine and appendable feature stores
+"""
+import numpy as np
+import torch
+from PIL import Image
+
+from data.feature_extraction import FeatureExtractor, ImageFiles, extract_features
+from data.feature_store import REGION_FILE, FeatureStoreWriter, PackedFeatureStore, write_feature_store
+
+
+def test_extraction_resumes_and_matches_extractor(tmp_path):
+    rng = np.random.default_rng(0)
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    ids = [f"{i}.jpg" for i in range(3)]
+    for img_id, shape in zip(ids, [(40, 60, 3), (64, 48, 3), (50, 50, 3)]):
+        Image.fromarray(rng.integers(0, 255, shape, dtype=np.uint8)).save(image_dir / img_id)
+    torch.manual_seed(0)
+    extractor = FeatureExtractor("resnet18", pretrained=False, grid_size=2)
+    assert (extractor.region_size, extractor.global_size) == (256, 512)
+
+    store_dir = str(tmp_path / "store")
+    options = dict(batch_size=2, image_size=64, disable_progress_bar=True)
+    extract_features(extractor, str(image_dir), ids[:2], store_dir, "train", **options)
+    # the second run only extracts the new image
+    writer = extract_features(extractor, str(image_dir), ids[::-1], store_dir, "train", **options)
+    assert writer.ids == ["0.jpg", "1.jpg", "2.jpg"]
+
+    store = PackedFeatureStore(store_dir, "train")
+    images = torch.stack([ImageFiles(str(image_dir), ids, 64)[i] for i in range(3)])
+    with torch.no_grad():
+        global_features, regions = extractor(images)
+    for i, img_id in enumerate(ids):
+        assert store.region(img_id).shape == (4, 256)
+        np.testing.assert_allclose(store.region(img_id), regions[i].numpy(), rtol=1e-4, atol=1e-5)
+        np.testing.assert_allclose(store.global_(img_id), global_features[i].numpy(), rtol=1e-4, atol=1e-5)
+
+
+def test_append_to_packed_store(feature_archive, tmp_path):
+    store_dir = str(tmp_path / "store")
+    write_feature_store(feature_archive, store_dir, "train", disable_progress_bar=True)
+    writer = FeatureStoreWriter(store_dir, "train", 8, 16)
+    assert len(writer) == 4 and "0.jpg" in writer
+    writer.append(["0.jpg", "new"], [np.ones((2, 8)), np.full((3, 8), 2.0)], np.ones((2, 16)))
+
+    # rows of an interrupted append are dropped on reopen
+    with open(f"{store_dir}/train/{REGION_FILE}", "ab") as f:
+        f.write(np.zeros((5, 8), dtype=np.float32).tobytes())
+    FeatureStoreWriter(store_dir, "train", 8, 16)
+
+    store = PackedFeatureStore(store_dir, "train")
+    assert len(store) == 5 and store.region_features.shape == (2 + 3 + 4 + 5 + 3, 8)
+    np.testing.assert_array_equal(store.region("new"), np.full((3, 8), 2.0))
+    np.testing.assert_array_equal(store.global_("new"), np.ones(16))
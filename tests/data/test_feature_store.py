@@ -0,0 +1,92 @@
+""" Unit tests for the packed feature store
+"""
+import pickle
+
+import exdir
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+
+from data.augmentation import Flickr30KFeatures
+from data.collate import DequantizeCollate
+from data.compression import lz4, zstandard
+from data.feature_store import PackedFeatureStore, write_feature_store
+
+
+def test_packed_store_matches_archive(feature_archive, tmp_path):
+    store_dir = str(tmp_path / "flickr30k.features")
+    write_feature_store(feature_archive, store_dir, "train", disable_progress_bar=True)
+    store = PackedFeatureStore(store_dir, "train")
+    group = exdir.File(feature_archive, mode="r").require_group("train")
+
+    assert len(store) == 4
+    for img_id in store.ids:
+        np.testing.assert_allclose(store.region(img_id), group[img_id]["region_features"][:], rtol=1e-6)
+        np.testing.assert_allclose(store.global_(img_id), group[img_id]["global_features"][:], rtol=1e-6)
+        assert np.shares_memory(store.region(img_id), store.region_features)
+
+    # memory maps are reopened instead of pickled
+    clone = pickle.loads(pickle.dumps(store))
+    assert clone._region_features is None
+    np.testing.assert_array_equal(clone.region(store.ids[-1]), store.region(store.ids[-1]))
+
+
+def test_quantized_store_round_trip(feature_archive, tmp_path):
+    group = exdir.File(feature_archive, mode="r").require_group("train")
+    for quantization, dtype in [("float16", np.float16), ("int8", np.int8)]:
+        store_dir = str(tmp_path / quantization)
+        write_feature_store(feature_archive, store_dir, "train", disable_progress_bar=True, quantization=quantization)
+        store = PackedFeatureStore(store_dir, "train")
+        assert store.quantization == quantization
+        for img_id in store.ids:
+            assert store.region(img_id).dtype == dtype
+            region = store.dequantize(torch.from_numpy(store.region(img_id)), "region")
+            global_ = store.dequantize(torch.from_numpy(store.global_(img_id)), "global")
+            assert region.dtype == torch.float32
+            expected = group[img_id]["region_features"][:]
+            if quantization == "int8":
+                # rounding to the nearest step of the channel scale
+                assert np.all(np.abs(region.numpy() - expected) <= store.region_scale.numpy() / 2 + 1e-6)
+                error = np.abs(global_.numpy() - np.reshape(group[img_id]["global_features"][:], -1))
+                assert np.all(error <= store.global_scale.numpy() / 2 + 1e-6)
+            else:
+                np.testing.assert_allclose(region.numpy(), expected, rtol=1e-3, atol=1e-3)
+
+
+def test_dequantize_in_collate_matches_dataset(feature_archive, tmp_path):
+    store_dir = str(tmp_path / "int8")
+    write_feature_store(feature_archive, store_dir, "train", disable_progress_bar=True, quantization="int8")
+    options = dict(root=feature_archive, mode="train", feature_store=store_dir, disable_progress_bar=True)
+    per_sample = Flickr30KFeatures(4, "region", num_processes=1, **options)
+    per_batch = Flickr30KFeatures(4, "region", num_processes=1, dequantize=False, **options)
+    assert per_batch[0][0].dtype == torch.int8
+
+    collate = DequantizeCollate(per_batch.store.region_scale)
+    expected = default_collate([per_sample[i] for i in range(len(per_sample))])
+    batch = collate([per_batch[i] for i in range(len(per_batch))])
+    assert batch[0].dtype == torch.float32
+    torch.testing.assert_close(batch[0], expected[0])
+
+
+def test_compressed_store_matches_uncompressed(feature_archive, tmp_path):
+    plain_dir = str(tmp_path / "plain")
+    write_feature_store(feature_archive, plain_dir, "train", disable_progress_bar=True)
+    plain = PackedFeatureStore(plain_dir, "train")
+    codecs = ["zlib"] + [codec for codec, module in [("zstd", zstandard), ("lz4", lz4)] if module is not None]
+    for codec in codecs:
+        store_dir = str(tmp_path / codec)
+        write_feature_store(
+            feature_archive, store_dir, "train", disable_progress_bar=True, compression=codec, chunk_images=3, threads=2
+        )
+        store = PackedFeatureStore(store_dir, "train", cache_chunks=1, readahead=0)
+        assert store.codec == codec and store.chunks.num_chunks == 2
+        for img_id in plain.ids:
+            np.testing.assert_array_equal(store.region(img_id), plain.region(img_id))
+            np.testing.assert_array_equal(store.global_(img_id), plain.global_(img_id))
+        # one decompressed chunk is kept
+        assert len(store.chunks) == 1 and store.chunks.misses == 2
+
+        clone = pickle.loads(pickle.dumps(store))
+        assert len(clone.chunks) == 0
+        clone.prefetch(clone.ids)
+        np.testing.assert_array_equal(clone.region(clone.ids[-1]), plain.region(plain.ids[-1]))
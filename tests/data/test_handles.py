@@ -0,0 +1,38 @@
+""" Unit tests for the per process archive handle pool
+"""
+import os
+import pickle
+import shutil
+
+import torch
+from torch.utils.data import DataLoader
+
+from data.augmentation import Flickr30k
+from data.handles import ArchiveHandles, open_worker_handles
+
+
+def test_handles_are_reused_and_reopened(feature_archive, tmp_path):
+    other = shutil.copytree(feature_archive, str(tmp_path / "other.exdir"))
+    handles = ArchiveHandles(max_handles=1)
+    group = handles.group(feature_archive, "train")
+    assert handles.group(feature_archive, "train") is group and handles.opened == 1
+    # the least recently used handle is closed beyond max_handles
+    handles.group(other, "train")
+    assert len(handles) == 1 and handles.group(feature_archive, "train") is not group
+
+    # copies in other processes start out empty
+    copy = pickle.loads(pickle.dumps(handles))
+    assert len(copy) == 0 and copy.max_handles == 1
+    handles._pid = os.getpid() + 1
+    assert len(handles) == 0
+    handles.group(feature_archive, "train")
+    assert handles.opened == 1
+
+
+def test_workers_open_their_own_handles(image_archive):
+    data = Flickr30k(image_archive, mode="train", disable_progress_bar=True, num_processes=1)
+    options = dict(batch_size=5, worker_init_fn=open_worker_handles)
+    expected = list(DataLoader(data, **options))
+    for batch, reference in zip(DataLoader(data, num_workers=2, **options), expected):
+        for tensor, reference_tensor in zip(batch, reference):
+            torch.testing.assert_close(tensor, reference_tensor)
@@ -0,0 +1,56 @@
+""" Unit tests for the packed image store
+"""
+import exdir
+import numpy as np
+import torch
+from PIL import Image
+
+from data.augmentation import AugmentedFlickrDataset, Flickr30k
+from data.batch_transforms import BatchColorJitter
+from data.caption_index import write_caption_index
+from data.collate import NormalizeImageCollate
+from data.image_store import PackedImageStore, resize_and_crop, write_augmentation_bank, write_image_store
+
+
+def test_image_store_batches(image_archive, tmp_path):
+    store_dir = str(tmp_path / "flickr30k.images")
+    write_image_store(image_archive, store_dir, "train", disable_progress_bar=True)
+    store = PackedImageStore(store_dir, "train")
+    group = exdir.File(image_archive, mode="r").require_group("train")
+    for img_id in store.ids:
+        expected = resize_and_crop(Image.fromarray(group[img_id][:]))
+        np.testing.assert_array_equal(store.image(img_id), expected)
+
+    data = Flickr30k(image_archive, mode="train", image_store=store_dir, disable_progress_bar=True, num_processes=1)
+    samples = [data[i] for i in range(4)]
+    assert samples[0][0].dtype == torch.uint8
+    mod, target, lengths, all_caps, img = NormalizeImageCollate()(samples)
+    assert img.shape == mod.shape == (4, 3, 224, 224)
+    assert img.dtype == torch.float32
+    assert torch.equal(img[0], torch.from_numpy(store.image(data.ids[0])).float())
+    assert target.shape == (4, data.max_cap_len)
+    assert lengths.shape == (4, 1)
+
+
+def test_augmentation_bank(image_archive, tmp_path):
+    store_dir = str(tmp_path / "flickr30k.images")
+    write_image_store(image_archive, store_dir, "train", disable_progress_bar=True)
+    write_caption_index(image_archive, "train", disable_progress_bar=True)
+    options = dict(mode="train", image_store=store_dir)
+    # augmented on the fly without a bank
+    assert not AugmentedFlickrDataset(image_archive, augmentation_bank=True, **options).augmentation_bank
+
+    augment = BatchColorJitter(brightness=0.5)
+    write_augmentation_bank(store_dir, "train", augment, num_variants=3, batch_size=2, disable_progress_bar=True)
+    store = PackedImageStore(store_dir, "train")
+    assert store.num_variants == 3 and store.variants.shape == (3, 3, 3, 224, 224)
+    assert not np.array_equal(store.variant("0.jpg", 0), store.variant("0.jpg", 1))
+    write_augmentation_bank(store_dir, "train", augment, num_variants=3, batch_size=2, disable_progress_bar=True)
+    np.testing.assert_array_equal(PackedImageStore(store_dir, "train").variants, store.variants)
+
+    data = AugmentedFlickrDataset(image_archive, augmentation_bank=True, batch_transforms=True, **options)
+    assert data.augmentation_bank and data.collate_fn().augment is None
+    variants = [store.variant(data.ids[0], k) for k in range(3)]
+    for _ in range(5):
+        img = data[0][0]
+        assert img.dtype == torch.uint8 and any(np.array_equal(img.numpy(), variant) for variant in variants)
@@ -0,0 +1,53 @@
+""" Unit tests for archives storing JPEG bytes
+"""
+import io
+
+import exdir
+import numpy as np
+import torch
+from PIL import Image
+
+from data.augmentation import Flickr30k
+from data.jpeg import DecodePool, decode_image, read_encoded
+from data.preprocessing import CaptionTokenizer, init_worker, load_example
+
+
+def encode(image: np.ndarray) -> np.ndarray:
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="JPEG", quality=90)
+    return np.frombuffer(buffer.getvalue(), dtype=np.uint8)
+
+
+def test_decode_at_reduced_scale(tmp_path):
+    image = np.random.default_rng(0).integers(0, 256, size=(300, 400, 3), dtype=np.uint8)
+    path = tmp_path / "0.jpg"
+    path.write_bytes(encode(image).tobytes())
+    encoded = read_encoded(str(path))
+    assert decode_image(encoded, None).shape == (300, 400, 3)
+    # the smallest scale keeping both sides of at least 128 pixels
+    assert decode_image(encoded, 128).shape == (150, 200, 3)
+    assert decode_image(image) is image
+    assert DecodePool(2).map(lambda x: x * 2, [1, 2, 3]) == [2, 4, 6]
+
+    init_worker([(encoded, ["A dog"])], CaptionTokenizer(str.split, str), pack_images=True)
+    stored, resized, tokens = load_example(0)
+    assert stored is encoded and resized.shape == (3, 224, 224) and tokens == [["a", "dog"]]
+
+
+def test_dataset_decodes_jpeg_archive(image_archive):
+    # rewrite the images of the archive as JPEG bytes
+    group = exdir.File(image_archive).require_group("train")
+    for img_id in list(group.keys()):
+        image, attrs = group[img_id][:], dict(group[img_id].attrs)
+        del group[img_id]
+        group.require_dataset(img_id, data=encode(image))
+        group[img_id].attrs["captions"], group[img_id].attrs["lengths"] = attrs["captions"], attrs["lengths"]
+
+    options = dict(mode="train", disable_progress_bar=True, num_processes=1)
+    data = Flickr30k(image_archive, decode_threads=2, **options)
+    samples = data.__getitems__([0, 1, 6, 14])
+    for index, sample in zip([0, 1, 6, 14], samples):
+        for value, expected in zip(sample, data[index]):
+            torch.testing.assert_close(value, expected)
+    image = np.asarray(Image.open(io.BytesIO(group["1.jpg"][:].tobytes())).convert("RGB"))
+    assert data._raw_image("1.jpg").shape == image.shape == (310, 400, 3)
@@ -0,0 +1,43 @@
+""" Unit tests for the DataLoader prefetcher
+"""
+import threading
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from data.prefetch import Prefetcher, move_to_device
+
+
+def test_prefetcher_yields_loader_batches():
+    data = TensorDataset(torch.arange(10.0), torch.arange(10))
+    loader = DataLoader(data, batch_size=3)
+    prefetcher = Prefetcher(loader, "cpu", num_batches=2)
+    assert len(prefetcher) == len(loader)
+    assert prefetcher.batch_size == 3
+    for _ in range(2):
+        for batch, expected in zip(prefetcher, loader):
+            assert torch.equal(batch[0], expected[0]) and torch.equal(batch[1], expected[1])
+        assert prefetcher.batches == len(loader)
+        assert prefetcher.stats()["data_wait"] >= 0.0
+
+
+def test_prefetcher_stops_and_raises():
+    threads = threading.active_count()
+    for batch in Prefetcher(DataLoader(TensorDataset(torch.arange(100.0)), batch_size=1), num_batches=1):
+        break
+    assert threading.active_count() == threads
+
+    def broken():
+        yield (torch.zeros(1),)
+        raise RuntimeError("decode failed")
+
+    with pytest.raises(RuntimeError, match="decode failed"):
+        list(Prefetcher(broken()))
+
+
+def test_move_to_device_keeps_structure():
+    batch = (torch.zeros(2), ["a", "b"], {"mask": torch.ones(2, dtype=torch.bool)})
+    moved = move_to_device(batch, torch.device("cpu"))
+    assert isinstance(moved, tuple) and moved[1] == ["a", "b"]
+    assert torch.equal(moved[2]["mask"], batch[2]["mask"])
@@ -0,0 +1,50 @@
+""" Unit tests for the single pass preprocessing
+"""
+import numpy as np
+from PIL import Image
+
+from data.preprocessing import (
+    CaptionTokenizer,
+    ProgressLog,
+    assign_splits,
+    build_word_map,
+    encode_caption,
+    init_worker,
+    load_example,
+)
+
+
+def test_splits_and_encoding():
+    splits = assign_splits([str(i) for i in range(20)])
+    assert [splits[str(i)] for i in (0, 15, 16, 18, 19)] == ["train", "train", "valid", "valid", "test"]
+
+    calls = []
+    tokenizer = CaptionTokenizer(str.split, lambda token: calls.append(token) or token.rstrip("s"))
+    captions = [tokenizer(caption) for caption in ["Two dogs run", "a dog runs", "A cat"]]
+    assert captions == [["two", "dog", "run"], ["a", "dog", "run"], ["a", "cat"]]
+    # every distinct token is lemmatized once
+    assert sorted(calls) == ["a", "cat", "dog", "dogs", "run", "runs", "two"]
+
+    token_map, max_caption_length = build_word_map(captions, topk=2)
+    # ties keep the order of first occurrence
+    assert token_map == {"dog": 4, "run": 5, "<start>": 0, "<end>": 1, "<unc>": 2, "<pad>": 3}
+    assert max_caption_length == 5
+    assert encode_caption(captions[2], token_map, max_caption_length) == [0, 2, 2, 1, 3]
+
+
+def test_load_example_and_progress_log(tmp_path):
+    image = Image.fromarray(np.zeros((300, 260, 3), dtype=np.uint8))
+    init_worker([(image, ["A dog", "Dogs"])], CaptionTokenizer(str.split, str), pack_images=True)
+    decoded, resized, tokens = load_example(0)
+    assert decoded.shape == (300, 260, 3) and resized.shape == (3, 224, 224)
+    assert tokens == [["a", "dog"], ["dogs"]]
+
+    log = ProgressLog(str(tmp_path / "progress.pkl"))
+    log.append({"1": tokens})
+    log.append({"2": [["a"]]})
+    # an interrupted append leaves a partial record behind
+    with open(log.path, "ab") as f:
+        f.write(b"\x80\x04\x95")
+    assert log.read() == {"1": tokens, "2": [["a"]]}
+    log.append({"3": []})
+    assert list(log.read()) == ["1", "2", "3"]
@@ -0,0 +1,68 @@
+""" Unit tests for the bucketing batch sampler
+"""
+import numpy as np
+
+from data.samplers import BucketBatchSampler, ResumableSampler
+from utils import ResumableSamplerCallback
+
+
+def make_statistics(n=103, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.stack([rng.integers(5, 25, size=n), rng.integers(10, 51, size=n)], axis=1)
+
+
+def test_every_sample_once_with_constant_batch_size():
+    statistics = make_statistics()
+    sampler = BucketBatchSampler(statistics, batch_size=8)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 13
+    assert sorted(i for batch in batches for i in batch) == list(range(len(statistics)))
+    assert sorted(len(batch) for batch in batches)[1:] == [8] * 12
+
+
+def test_batches_share_buckets():
+    statistics = make_statistics(n=400)
+    sampler = BucketBatchSampler(statistics, batch_size=4, constant_batch_size=False, drop_last=True)
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    for batch in batches:
+        assert len(batch) == 4
+        assert np.ptp(statistics[batch, 0] // 2) == 0
+        assert np.ptp(statistics[batch, 1] // 10) == 0
+
+
+def test_epochs_are_reproducible():
+    statistics = make_statistics()
+    sampler = BucketBatchSampler(statistics, batch_size=8, seed=3)
+    first, second = list(sampler), list(sampler)
+    assert first != second
+    sampler.set_epoch(0)
+    assert list(sampler) == first
+
+
+def test_bucket_sampler_resumes_mid_epoch():
+    statistics = make_statistics()
+    sampler = BucketBatchSampler(statistics, batch_size=8, seed=3)
+    epochs = [list(sampler) for _ in range(3)]
+
+    resumed = BucketBatchSampler(statistics, batch_size=8, seed=3)
+    callback = ResumableSamplerCallback(resumed)
+    callback.load_state_dict({"epoch": 1, "batches": 5})
+    assert list(resumed) == epochs[1][5:]
+    assert list(resumed) == epochs[2]
+
+    # a checkpoint after the last batch continues with the next epoch
+    callback.load_state_dict({"epoch": 1, "batches": len(sampler)})
+    assert list(resumed) == epochs[2]
+
+
+def test_resumable_sampler_skips_trained_batches():
+    sampler = ResumableSampler(50, seed=1)
+    sampler.set_epoch(2)
+    order = list(sampler)
+    assert sorted(order) == list(range(50))
+    ResumableSamplerCallback(sampler, batch_size=4).load_state_dict({"epoch": 2, "batches": 3})
+    sampler.set_epoch(2)
+    assert list(sampler) == order[12:]
+    assert list(sampler) == order
+    assert list(ResumableSampler(5, shuffle=False)) == [0, 1, 2, 3, 4]
@@ -0,0 +1,61 @@
+""" Unit tests for the sharded streaming feature dataset
+"""
+from collections import Counter
+
+import torch
+from torch.utils.data import DataLoader
+
+from data.augmentation import Flickr30KFeatures
+from data.shards import ShardedFlickr30KFeatures, write_shards
+
+
+def keys(samples):
+    return Counter((img_id, tuple(caption.tolist())) for _, caption, img_id in samples)
+
+
+def test_shards_stream_every_sample(feature_archive, tmp_path):
+    shard_dir = str(tmp_path / "flickr30k.shards")
+    write_shards(feature_archive, shard_dir, "train", images_per_shard=3, disable_progress_bar=True)
+    reference = Flickr30KFeatures(
+        4, "region", root=feature_archive, mode="train", disable_progress_bar=True, num_processes=1
+    )
+    data = ShardedFlickr30KFeatures(shard_dir, 4, feature_mode="region", shuffle=False)
+    assert data.shards == ["shard-00000.npz", "shard-00001.npz"]
+    samples = list(data)
+    assert keys(samples) == keys(reference[i] for i in range(len(reference)))
+    by_id = {img_id: features for features, _, img_id in samples}
+    for features, _, img_id in (reference[i] for i in range(len(reference))):
+        assert torch.equal(by_id[img_id], features)
+
+
+def test_shards_split_by_rank_and_reseed(feature_archive, tmp_path):
+    shard_dir = str(tmp_path / "flickr30k.shards")
+    write_shards(feature_archive, shard_dir, "train", images_per_shard=1, disable_progress_bar=True)
+    ranks = [ShardedFlickr30KFeatures(shard_dir, 4, shuffle_buffer=8, rank=r, world_size=2) for r in range(2)]
+    for epoch in range(2):
+        for data in ranks:
+            data.set_epoch(epoch)
+        shards = [data.assigned_shards() for data in ranks]
+        assert sorted(shards[0] + shards[1]) == [0, 1, 2, 3]
+        assert keys(list(ranks[0]) + list(ranks[1])) == keys(ShardedFlickr30KFeatures(shard_dir, 4, shuffle=False))
+
+    data = ranks[0]
+    data.set_epoch(5)
+    first = [img_id for _, _, img_id in data]
+    assert first == [img_id for _, _, img_id in data]
+    # every worker reads different shards of the rank
+    loader = DataLoader(data, batch_size=None, num_workers=2)
+    assert keys(loader) == keys(data)
+
+
+def test_shards_resume_mid_epoch(feature_archive, tmp_path):
+    shard_dir = str(tmp_path / "flickr30k.shards")
+    write_shards(feature_archive, shard_dir, "train", images_per_shard=1, disable_progress_bar=True)
+    data = ShardedFlickr30KFeatures(shard_dir, 4, shuffle_buffer=4)
+    data.set_epoch(1)
+    loader = DataLoader(data, batch_size=3, num_workers=2)
+    batches = [batch[2] for batch in loader]
+    data.resume(1, 3, batch_size=3)
+    assert [batch[2] for batch in loader] == batches[3:]
+    data.set_epoch(2)
+    assert data.start_batch == 0
@@ -0,0 +1,37 @@
+""" Unit tests for the stratified subset archives
+"""
+import numpy as np
+import torch
+
+from data.augmentation import Flickr30KFeatures
+from data.subsets import stratified_sample, write_subset
+
+
+def test_stratified_sample_covers_strata():
+    lengths = np.repeat([3, 5, 8, 12], 25)
+    detections = np.tile([10, 20, 30, 40, 50], 20)
+    keys = np.stack([lengths, detections], axis=1)
+    sample = stratified_sample(keys, 16, bins=4)
+    np.testing.assert_array_equal(sample, stratified_sample(keys, 16, bins=4))
+    assert len(sample) == 16 and len(np.unique(sample)) == 16
+    # every caption length bin gets its share
+    np.testing.assert_array_equal(np.unique(lengths[sample], return_counts=True)[1], [4, 4, 4, 4])
+    assert len(stratified_sample(keys, 1000)) == 100
+
+
+def test_subset_archive(feature_archive, tmp_path):
+    subset_dir = str(tmp_path / "subset.exdir")
+    ids = write_subset(feature_archive, subset_dir, "train", size=2, disable_progress_bar=True)
+    assert len(ids) == 2 and ids == sorted(ids)
+    assert write_subset(feature_archive, subset_dir, "train", size=2, disable_progress_bar=True) == ids
+
+    options = dict(mode="train", disable_progress_bar=True, num_processes=1)
+    subset = Flickr30KFeatures(4, "region", root=feature_archive, subset=subset_dir, **options)
+    full = Flickr30KFeatures(4, "region", root=feature_archive, **options)
+    assert subset.ids == ids and len(subset) == 10
+    assert subset.word_map == full.word_map and subset.max_cap_len == full.max_cap_len
+    for index in range(len(subset)):
+        features, target, img_id = subset[index]
+        position = full.ann_list.index((img_id, subset.ann_list[index][1]))
+        torch.testing.assert_close(features, full[position][0])
+        torch.testing.assert_close(target, full[position][1])
@@ -0,0 +1,21 @@
+""" Unit tests for the batched token id to text conversion
+"""
+import numpy as np
+import torch
+
+from data.vocabulary import Vocabulary
+
+WORD_MAP = {"<start>": 0, "<end>": 1, "<unc>": 2, "<pad>": 3, "a": 4, "dog": 5, "cat": 6, "runs": 7}
+
+
+def test_detokenize_batches():
+    vocabulary = Vocabulary(WORD_MAP)
+    assert vocabulary.detokenize([0, 4, 5, 7, 1, 3]) == "a dog runs"
+    # decoding stops at <end>, ids outside of the word map become <unc>
+    tokens = torch.tensor([[0, 4, 1, 6, 3, 3], [0, 6, 42, -1, 3, 1]])
+    assert vocabulary.detokenize(tokens) == ["a", "cat <unc> <unc>"]
+
+    references = np.array([[[0, 4, 5, 1, 3, 3], [0, 6, 1, 3, 3, 3]], [[0, 7, 1, 3, 3, 3], [0, 1, 3, 3, 3, 3]]])
+    assert vocabulary.detokenize(references) == [["a dog", "cat"], ["runs", ""]]
+    assert vocabulary.detokenize(references[0], join=False) == [["a", "dog"], ["cat"]]
+    assert Vocabulary.from_inverse({i: w for w, i in WORD_MAP.items()}).detokenize(references[1]) == ["runs", ""]
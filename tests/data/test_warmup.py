@@ -0,0 +1,34 @@
+""" Unit tests for the feature store warmup
+"""
+import os
+
+import numpy as np
+
+from data.feature_store import PackedFeatureStore, write_feature_store
+from data.warmup import copy_to_shm, resident_bytes, store_files, warmup_store
+
+
+def test_warmup_and_shm_copy(feature_archive, tmp_path):
+    store_dir = str(tmp_path / "store")
+    write_feature_store(feature_archive, store_dir, "train", disable_progress_bar=True)
+    files = store_files(store_dir, "train")
+    assert [os.path.basename(name) for name in files] == ["region_features.npy", "global_features.npy", "index.npz"]
+
+    read = warmup_store(store_dir, ["train"], threads=2, block_size=64)
+    assert read == {name: os.path.getsize(name) for name in files}
+    for name in files:
+        resident = resident_bytes(name)
+        assert resident is None or resident == os.path.getsize(name)
+
+    shm_store = copy_to_shm(store_dir, "train", str(tmp_path / "shm"), threads=2, block_size=64)
+    assert shm_store == str(tmp_path / "shm" / "store")
+    # a store copied after its last change is not copied again
+    modified = os.path.getmtime(os.path.join(shm_store, "train", "index.npz"))
+    assert copy_to_shm(store_dir, "train", str(tmp_path / "shm")) == shm_store
+    assert os.path.getmtime(os.path.join(shm_store, "train", "index.npz")) == modified
+
+    original = PackedFeatureStore(store_dir, "train")
+    copy = PackedFeatureStore(shm_store, "train")
+    for img_id in original.ids:
+        np.testing.assert_array_equal(copy.region(img_id), original.region(img_id))
+        np.testing.assert_array_equal(copy.global_(img_id), original.global_(img_id))